@@ -8,6 +8,16 @@ from atlas_assistant.context import Context
 from atlas_assistant.settings import Settings
 from chainlit import Message
 
+# One database for all chat sessions, like the API's one per worker
+database = atlas_assistant.settings.get_settings().get_database()
+# One code model client, so its connections are reused between sessions
+code_client = atlas_assistant.settings.get_settings().get_code_client()
+
+
+@chainlit.on_app_shutdown
+async def on_app_shutdown() -> None:
+    await code_client.aclose()
+
 
 @chainlit.on_chat_start
 async def on_chat_start() -> None:
@@ -28,7 +38,7 @@ async def on_message(message: Message) -> None:
         {"messages": [HumanMessage(content=message.content)]},
         stream_mode="updates",
         config={"configurable": {"thread_id": "chainlit"}},
-        context=Context(settings=settings),
+        context=Context(settings=settings, database=database, code_client=code_client),
     ):
         for key, value in update.items():
             if messages := value.get("messages"):
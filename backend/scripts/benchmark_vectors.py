@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""Compare the startup time and search latency of the vector stores.
+
+Both stores are built from the same random embeddings, with about as many
+documents as the catalog has datasets. Startup is the time to open a store and
+answer its first search, and latency is the median time of later searches.
+Queries are embedded ahead of time, so the embeddings API isn't measured.
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from atlas_assistant.dataset.ingest import ReusedEmbeddings
+from atlas_assistant.matrix import MatrixStore
+
+parser = argparse.ArgumentParser(description=__doc__)
+_ = parser.add_argument("--documents", type=int, default=500)
+_ = parser.add_argument("--dimensions", type=int, default=1024)
+_ = parser.add_argument("--queries", type=int, default=200)
+_ = parser.add_argument("--k", type=int, default=10)
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+matrix = rng.standard_normal((args.documents, args.dimensions), dtype=np.float32)
+matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+queries = [
+    list(map(float, row)) for row in matrix[rng.integers(0, len(matrix), args.queries)]
+]
+ids = [f"item-{i}/data" for i in range(args.documents)]
+texts = [f"Dataset {i}" for i in range(args.documents)]
+
+
+def measure[Store](
+    open_store: Callable[[], Store], search: Callable[[Store, list[float]], object]
+) -> tuple[float, float]:
+    """Returns the startup time and median search latency of a store."""
+    start = time.perf_counter()
+    store = open_store()
+    _ = search(store, queries[0])
+    startup = time.perf_counter() - start
+    latencies: list[float] = []
+    for query in queries:
+        start = time.perf_counter()
+        _ = search(store, query)
+        latencies.append(time.perf_counter() - start)
+    return startup, statistics.median(latencies)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    # The random embeddings stand in for the embeddings API
+    embedding = ReusedEmbeddings(
+        DeterministicFakeEmbedding(size=args.dimensions),
+        dict(zip(texts, matrix.tolist(), strict=True)),
+    )
+    chroma_directory = Path(directory) / "chroma"
+    _ = Chroma.from_texts(
+        texts, embedding, ids=ids, persist_directory=str(chroma_directory)
+    )
+    matrix_directory = Path(directory) / "matrix"
+    _ = MatrixStore.from_texts(
+        texts, embedding, ids=ids, persist_directory=str(matrix_directory)
+    )
+
+    def open_chroma() -> Chroma:
+        SharedSystemClient.clear_system_cache()
+        return Chroma(persist_directory=str(chroma_directory))
+
+    def search(store: Chroma | MatrixStore, query: list[float]) -> object:
+        return store.similarity_search_by_vector_with_relevance_scores(query, k=args.k)
+
+    results = {
+        "chroma": measure(open_chroma, search),
+        "numpy": measure(lambda: MatrixStore.load(matrix_directory), search),
+    }
+
+print(f"{args.documents} documents of {args.dimensions} dimensions, k={args.k}")
+for backend, (startup, latency) in results.items():
+    print(
+        f"{backend:>6}: startup {startup * 1e3:8.2f} ms, search {latency * 1e3:.3f} ms"
+    )
@@ -1,54 +1,238 @@
 #!/usr/bin/env python3
 
-"""Embed the STAC items"""
+"""Embed the STAC items
 
-import shutil
+Only datasets that have changed since the last run are embedded, profiled,
+compiled, rolled up, sampled, and laid out again. Everything is built in a new
+directory, which then replaces the embeddings directory.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import pystac
+import duckdb
 from langchain_chroma import Chroma
 from langchain_mistralai import MistralAIEmbeddings
-from pystac import Catalog
 
-from atlas_assistant.dataset import Dataset, Item
-from atlas_assistant.settings import get_settings
+from atlas_assistant.catalog import build_catalog
+from atlas_assistant.database import Database
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.index import (
+    DatasetIndex,
+    create_entry,
+    get_document_id,
+    write_index,
+)
+from atlas_assistant.dataset.ingest import (
+    IngestRecord,
+    Manifest,
+    ReusedEmbeddings,
+    create_directory,
+    hash_dataset,
+    link_artifacts,
+    read_datasets,
+    read_embeddings,
+    swap_directory,
+)
+from atlas_assistant.dataset.layout import build_layout
+from atlas_assistant.dataset.lexical import LexicalIndex
+from atlas_assistant.dataset.lexical import get_text as get_lexical_text
+from atlas_assistant.dataset.profile import profile_dataset
+from atlas_assistant.dataset.version import get_version
+from atlas_assistant.matrix import MatrixStore
+from atlas_assistant.prompt import compile_prompt
+from atlas_assistant.settings import EMBEDDING_MODEL, get_settings
 
 settings = get_settings()
 
 ROOT = Path(__file__).parents[1]
 EMBEDDINGS_DIRECTORY = ROOT / settings.embeddings_directory
 
-texts = []
-metadatas = []
-
-catalog = pystac.read_file(settings.stac_catalog_href)
-assert isinstance(catalog, Catalog)
-for item in catalog.get_items(recursive=True):
-    for key, asset in item.assets.items():
-        if asset.media_type == "application/vnd.apache.parquet":
-            pydantic_item = Item.model_validate(item.to_dict(transform_hrefs=False))
-            dataset = Dataset(item=pydantic_item, asset_key=key)
-            texts.append(dataset.get_description())
-            metadatas.append(
-                dataset.to_metadata().model_dump(
-                    mode="json",
-                    exclude_none=True,
-                )
-            )
-print(f"Found {len(texts)} items")
-
-if EMBEDDINGS_DIRECTORY.exists():
-    shutil.rmtree(EMBEDDINGS_DIRECTORY)
 if settings.chat_model is None:
     raise ValueError("Chat model is not configured")
-embedding = MistralAIEmbeddings(
-    model="mistral-embed", api_key=settings.chat_model.api_key
+
+datasets = read_datasets(settings.stac_catalog_href, settings.stac_max_workers)
+print(f"Found {len(datasets)} items")
+ids = [get_document_id(dataset) for dataset in datasets]
+
+
+def get_record(dataset: Dataset) -> IngestRecord:
+    """Hashes a dataset and gets its version, before it's compiled."""
+    try:
+        version = get_version(dataset.asset.href, timeout=settings.version_timeout)
+    except OSError as e:
+        print(f"Could not get the version of {dataset.item.id}: {e}")
+        version = None
+    return IngestRecord(hash=hash_dataset(dataset), version=version, compiled=False)
+
+
+with ThreadPoolExecutor(settings.stac_max_workers) as executor:
+    records = dict(zip(ids, executor.map(get_record, datasets), strict=True))
+
+# A manifest for another model means its embeddings can't be reused
+manifest = Manifest.load(EMBEDDINGS_DIRECTORY)
+if manifest is None or manifest.embedding_model != EMBEDDING_MODEL:
+    manifest = Manifest(embedding_model=EMBEDDING_MODEL)
+current = {id for id, record in records.items() if manifest.is_current(id, record)}
+changed = [d for id, d in zip(ids, datasets, strict=True) if id not in current]
+print(f"{len(changed)} of {len(datasets)} datasets have changed")
+
+directory = create_directory(EMBEDDINGS_DIRECTORY)
+staged = settings.model_copy(update={"embeddings_directory": directory})
+profile_store = staged.get_profile_store()
+prompt_cache = staged.get_prompt_cache()
+rollup_store = staged.get_rollup_store()
+sample_store = staged.get_sample_store()
+layout_directory = directory / "layouts"
+
+# The files of unchanged datasets are shared with the current directory
+previous_index = DatasetIndex(settings.get_dataset_index_path())
+store_directories = [
+    path.relative_to(directory)
+    for path in [
+        profile_store.directory,
+        prompt_cache.directory,
+        rollup_store.directory,
+        sample_store.directory,
+        layout_directory,
+    ]
+]
+for id, dataset in zip(ids, datasets, strict=True):
+    if id in current:
+        link_artifacts(EMBEDDINGS_DIRECTORY, directory, store_directories, dataset)
+        if previous := previous_index.get(id):
+            dataset.layout = previous.layout
+
+
+def lay_out_dataset(database: Database, dataset: Dataset) -> bool:
+    """Writes a partitioned copy of a dataset and records it on the dataset,
+    returning whether that succeeded."""
+    # A dataset without a layout is always read from its href
+    with database.cursor() as connection:
+        try:
+            layout = build_layout(
+                dataset,
+                layout_directory,
+                records[get_document_id(dataset)].version,
+                connection,
+            )
+        except (OSError, ValueError, duckdb.Error) as e:
+            print(f"Could not lay out {dataset.item.id}: {e}")
+            return False
+    # Layouts are read through the embeddings directory once it's swapped in
+    href = Path(layout.href).relative_to(directory)
+    dataset.layout = layout.model_copy(
+        update={"href": str(EMBEDDINGS_DIRECTORY / href)}
+    )
+    return True
+
+
+# Layouts are recorded in the embeddings' metadata, so they're written first
+hot_datasets = [
+    d
+    for d in datasets
+    if d.item.id in settings.layout_item_ids
+    and (d.layout is None or get_document_id(d) not in current)
+]
+with (
+    settings.get_database() as database,
+    ThreadPoolExecutor(settings.duckdb_max_queries) as executor,
+):
+    laid_out = sum(executor.map(lambda d: lay_out_dataset(database, d), hot_datasets))
+print(f"Laid out {laid_out} of {len(hot_datasets)} datasets in {layout_directory}")
+
+embedding = ReusedEmbeddings(
+    MistralAIEmbeddings(model=EMBEDDING_MODEL, api_key=settings.chat_model.api_key),
+    read_embeddings(EMBEDDINGS_DIRECTORY),
 )
 _ = Chroma.from_texts(
-    texts=texts,
-    metadatas=metadatas,
+    texts=[dataset.get_description() for dataset in datasets],
+    ids=ids,
+    metadatas=[
+        dataset.to_metadata().model_dump(mode="json", exclude_none=True)
+        for dataset in datasets
+    ],
     embedding=embedding,
-    persist_directory=str(EMBEDDINGS_DIRECTORY),
+    persist_directory=str(directory),
+)
+# Every description has been embedded by now, so the matrix is free to write
+_ = MatrixStore.from_texts(
+    texts=[dataset.get_description() for dataset in datasets],
+    embedding=embedding,
+    metadatas=[
+        dataset.to_metadata().model_dump(mode="json", exclude_none=True)
+        for dataset in datasets
+    ],
+    ids=ids,
+    persist_directory=str(directory),
+)
+print(f"Embeddings created, embedding {embedding.embedded} descriptions")
+
+write_index(
+    staged.get_dataset_index_path(),
+    [create_entry(id, dataset) for id, dataset in zip(ids, datasets, strict=True)],
 )
+LexicalIndex.build(
+    {id: get_lexical_text(dataset) for id, dataset in zip(ids, datasets, strict=True)}
+).write(staged.get_lexical_index_path())
+print("Dataset and keyword indexes written")
+
+
+def compile_dataset(database: Database, dataset: Dataset) -> bool:
+    """Profiles a dataset, compiles its SQL prompt, and builds its rollups and
+    sample, returning whether they all succeeded."""
+    # A prompt that isn't compiled here is compiled on first use instead
+    with database.cursor() as connection:
+        try:
+            profile = profile_dataset(dataset, connection)
+        except (OSError, duckdb.Error) as e:
+            print(f"Could not profile {dataset.item.id}: {e}")
+            profile = None
+        else:
+            profile_store.write(profile)
+        try:
+            prompt_cache.write(compile_prompt(dataset, connection, profile))
+        except (OSError, duckdb.Error) as e:
+            print(f"Could not compile the SQL prompt for {dataset.item.id}: {e}")
+            return False
+        version = records[get_document_id(dataset)].version
+        # A dataset without rollups is always queried directly
+        try:
+            _ = rollup_store.build(dataset, version, connection)
+        except (OSError, duckdb.Error) as e:
+            print(f"Could not build rollups for {dataset.item.id}: {e}")
+            return False
+        # A dataset without a sample is sampled on the fly
+        try:
+            _ = sample_store.build(
+                dataset, version, settings.sample_fraction, connection
+            )
+        except (OSError, duckdb.Error) as e:
+            print(f"Could not sample {dataset.item.id}: {e}")
+            return False
+    return profile is not None
+
+
+# Each dataset is scanned once, by its own cursor, so they run in parallel
+with (
+    settings.get_database() as database,
+    ThreadPoolExecutor(settings.duckdb_max_queries) as executor,
+):
+    results = executor.map(lambda d: compile_dataset(database, d), changed)
+    for dataset, compiled in zip(changed, results, strict=True):
+        records[get_document_id(dataset)].compiled = compiled
+for id in current:
+    records[id].compiled = True
+print(
+    f"Profiled, compiled, rolled up, and sampled "
+    f"{sum(records[get_document_id(d)].compiled for d in changed)} of "
+    f"{len(changed)} changed datasets"
+)
+
+catalog_path = staged.get_catalog_path()
+views = build_catalog(catalog_path, datasets)
+print(f"Created views of {views} of {len(datasets)} datasets")
 
-print(f"Embeddings created at {EMBEDDINGS_DIRECTORY}")
+Manifest(embedding_model=EMBEDDING_MODEL, records=records).write(directory)
+swap_directory(directory, EMBEDDINGS_DIRECTORY)
+print(f"Embeddings directory {EMBEDDINGS_DIRECTORY} now points to {directory}")
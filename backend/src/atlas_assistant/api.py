@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import uuid
 from collections.abc import AsyncGenerator
@@ -34,7 +35,44 @@ settings = get_settings()
 @asynccontextmanager
 async def lifespan(_app: FastAPI) -> AsyncGenerator[dict[str, Any]]:
     agent = create_agent(settings)
-    yield {"agent": agent}
+    embeddings = settings.get_vector_store()
+    datasets = settings.get_dataset_index(embeddings)
+    lexical = settings.get_lexical_index()
+    # One version cache, so each dataset's version is only requested once
+    versions = settings.get_version_cache()
+    mirror = settings.get_mirror(versions)
+    prompts = settings.get_prompt_cache(versions)
+    results = settings.get_result_cache(versions)
+    rollups = settings.get_rollup_store(versions)
+    footers = settings.get_footer_cache(versions)
+    samples = settings.get_sample_store(versions)
+    # One client, so connections to the code model are reused between requests
+    code_client = settings.get_code_client()
+    charts = settings.get_chart_inference()
+    # Async tools run their blocking work here, rather than on the event loop
+    executor = settings.get_tool_executor()
+    with settings.get_database() as database:
+        try:
+            yield {
+                "agent": agent,
+                "database": database,
+                "embeddings": embeddings,
+                "datasets": datasets,
+                "lexical": lexical,
+                "mirror": mirror,
+                "prompts": prompts,
+                "results": results,
+                "versions": versions,
+                "rollups": rollups,
+                "footers": footers,
+                "samples": samples,
+                "code_client": code_client,
+                "charts": charts,
+                "executor": executor,
+            }
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            await code_client.aclose()
 
 
 assert settings.oidc_url
@@ -77,6 +115,10 @@ class ChatRequest(BaseModel):
     thread_id: str | None = None
     """A thread id, provided by a previous chat."""
 
+    approximate: bool = False
+    """Whether to estimate every table from a sample, for faster but rougher
+    answers."""
+
 
 class ResponseMessage(BaseModel):
     """A response message from our API while chatting."""
@@ -136,6 +178,13 @@ class GenerateTableResponseMessage(ToolResponseMessage):
     sql_query: str | None
     """The sql query used to generate the data"""
 
+    approximate: bool = False
+    """Whether the data was estimated from a sample, with margins of error"""
+
+    tool_call_id: str
+    """The id of the tool call, shared by an approximate table and the exact
+    table that later replaces it"""
+
 
 class GenerateChartMetadataResponseMessage(ToolResponseMessage):
     """The response from generate_chart_metadata"""
@@ -192,11 +241,29 @@ async def chat(
     accept: Annotated[str | None, Header()] = None,
 ) -> StreamingResponse:
     agent: Agent = request.state.agent
+    context = Context(
+        settings=settings,
+        database=request.state.database,
+        code_client=request.state.code_client,
+        charts=request.state.charts,
+        executor=request.state.executor,
+        embeddings=request.state.embeddings,
+        datasets=request.state.datasets,
+        lexical=request.state.lexical,
+        mirror=request.state.mirror,
+        prompts=request.state.prompts,
+        results=request.state.results,
+        versions=request.state.versions,
+        rollups=request.state.rollups,
+        footers=request.state.footers,
+        samples=request.state.samples,
+        approximate=chat_request.approximate,
+    )
     thread_id = chat_request.thread_id or str(uuid.uuid4())
     event_stream = (accept and "text/event-stream" in accept) or False
     logger.info(f"Query: {chat_request.query}")
     return StreamingResponse(
-        query_agent(agent, chat_request.query, thread_id, settings, event_stream),
+        query_agent(agent, chat_request.query, thread_id, context, event_stream),
         media_type="text/event-stream" if event_stream else "application/x-ndjson",
     )
 
@@ -205,7 +272,7 @@ async def query_agent(
     agent: Agent,
     query: str,
     thread_id: str,
-    settings: Settings,
+    context: Context,
     event_stream: bool,
 ) -> AsyncGenerator[str]:
     """Query the agent and yield messages.
@@ -219,7 +286,7 @@ async def query_agent(
             {"messages": [HumanMessage(content=query)]},
             stream_mode="updates",
             config=config,
-            context=Context(settings=settings),
+            context=context,
         ):
             for value in update.values():
                 if messages := value.get("messages"):
@@ -230,6 +297,23 @@ async def query_agent(
                                 yield response_message.to_event_stream() + "\n\n"
                             else:
                                 yield response_message.model_dump_json() + "\n"
+        # Exact tables replace the approximate ones the agent answered with
+        for refinement in context.refinements:
+            try:
+                message = await asyncio.wrap_future(refinement)
+            except Exception as e:
+                logger.warning(f"Could not refine an approximate table: {e}")
+                continue
+            response_message = create_response_message(message, thread_id)
+            if response_message:
+                if event_stream:
+                    yield response_message.to_event_stream() + "\n\n"
+                else:
+                    yield response_message.model_dump_json() + "\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        logger.info(f"Client disconnected from thread {thread_id}")
+        context.cancelled.set()
+        raise
     except HTTPStatusError as e:
         logging.error(f"HTTP error occurred: {e}")
         response_message = ErrorResponseMessage(content=str(e), thread_id=thread_id)
@@ -282,6 +366,8 @@ def create_response_message(
                     thread_id=thread_id,
                     data=artifact.get("data"),
                     sql_query=artifact.get("sql_query"),
+                    approximate=artifact.get("approximate", False),
+                    tool_call_id=message.tool_call_id,
                 )
             case "generate_chart_metadata":
                 artifact = message.artifact or {}
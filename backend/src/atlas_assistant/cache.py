@@ -0,0 +1,296 @@
+"""Caches shared by the tools."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from pathlib import Path
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# The least number of seconds between removals of expired code responses from
+# the file
+PRUNE_INTERVAL = 3600.0
+
+
+@dataclass
+class CacheStats:
+    """Counters for cache activity"""
+
+    hits: int = 0
+    """The number of lookups that found a value"""
+
+    misses: int = 0
+    """The number of lookups that didn't find a value"""
+
+    evictions: int = 0
+    """The number of values removed to stay under the cache's bounds"""
+
+    @property
+    def hit_ratio(self) -> float:
+        """The fraction of lookups that were hits"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LruCache[Key: Hashable, Value]:
+    """A thread-safe, least-recently-used cache.
+
+    The cache can be bounded by number of entries, by total size (as measured
+    by `sizeof`), or both. Entries older than `ttl` seconds are treated as
+    missing.
+    """
+
+    def __init__(
+        self,
+        max_entries: int | None = 128,
+        max_size: int | None = None,
+        ttl: float | None = None,
+        sizeof: Callable[[Value], int] | None = None,
+    ) -> None:
+        if max_size is not None and sizeof is None:
+            raise ValueError("sizeof is required when max_size is set")
+        self.max_entries: int | None = max_entries
+        self.max_size: int | None = max_size
+        self.ttl: float | None = ttl
+        self.sizeof: Callable[[Value], int] | None = sizeof
+        self.stats: CacheStats = CacheStats()
+        self.size: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: OrderedDict[Key, tuple[Value, int, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Key) -> bool:
+        with self._lock:
+            return self._get_fresh(key) is not None
+
+    def get(self, key: Key) -> Value | None:
+        """Returns the value for the key, or None if it isn't cached."""
+        with self._lock:
+            entry = self._get_fresh(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[0]
+
+    def put(self, key: Key, value: Value) -> None:
+        """Caches a value, evicting least-recently-used values if needed."""
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_size is not None and size > self.max_size:
+            return
+        with self._lock:
+            _ = self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self.size += size
+            while (
+                self.max_entries is not None and len(self._entries) > self.max_entries
+            ) or (self.max_size is not None and self.size > self.max_size):
+                _ = self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def get_or_create(self, key: Key, create: Callable[[], Value]) -> Value:
+        """Returns the cached value for the key, creating and caching it if
+        needed.
+
+        `create` is called without holding the cache's lock, so concurrent
+        misses on the same key may each call it.
+        """
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def pop(self, key: Key) -> Value | None:
+        """Removes and returns a value, if it's cached."""
+        with self._lock:
+            entry = self._remove(key)
+            return entry[0] if entry else None
+
+    def clear(self) -> None:
+        """Removes all values."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _get_fresh(self, key: Key) -> tuple[Value, int, float] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+            _ = self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key: Key) -> tuple[Value, int, float] | None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= entry[1]
+        return entry
+
+
+class ResponseCache:
+    """Parsed responses of the code model, keyed by a hash of their requests.
+
+    The code model writes the same SQL for the same prompt and question, and
+    the same chart metadata for the same data, so a repeated request doesn't
+    need to wait on it. Responses are kept in memory, and, if `path` is set,
+    in a SQLite file that outlives the process. Responses older than `ttl`
+    seconds are treated as missing in both.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float | None = None,
+        path: Path | None = None,
+    ) -> None:
+        self.ttl: float | None = ttl
+        self.path: Path | None = path
+        self._memory: LruCache[str, BaseModel] = LruCache(max_entries, ttl=ttl)
+        self.disk_stats: CacheStats = CacheStats()
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+        self._pruned: float = 0.0
+
+    @property
+    def stats(self) -> CacheStats:
+        """The in-memory cache's hit, miss, and eviction counts"""
+        return self._memory.stats
+
+    def get[Response: BaseModel](
+        self, key: str, response_format: type[Response]
+    ) -> Response | None:
+        """Returns a copy of the cached response for the key, or None if it
+        isn't cached."""
+        response = self._memory.get(key)
+        if response is None:
+            response = self._read(key, response_format)
+        return self._copy(response, response_format)
+
+    async def aget[Response: BaseModel](
+        self, key: str, response_format: type[Response]
+    ) -> Response | None:
+        """Returns a copy of the cached response for the key, like `get`,
+        reading the file on a thread so the event loop doesn't wait on it."""
+        response = self._memory.get(key)
+        if response is None and self.path is not None:
+            response = await asyncio.to_thread(self._read, key, response_format)
+        return self._copy(response, response_format)
+
+    def put(self, key: str, response: BaseModel) -> None:
+        """Caches a response."""
+        self._memory.put(key, response.model_copy(deep=True))
+        self._write(key, response.model_dump_json())
+
+    async def aput(self, key: str, response: BaseModel) -> None:
+        """Caches a response, like `put`, writing the file on a thread."""
+        self._memory.put(key, response.model_copy(deep=True))
+        if self.path is not None:
+            await asyncio.to_thread(self._write, key, response.model_dump_json())
+
+    def _copy[Response: BaseModel](
+        self, response: BaseModel | None, response_format: type[Response]
+    ) -> Response | None:
+        logger.info(
+            f"Code response cache {'hit' if response is not None else 'miss'}, "
+            f"hit ratio {self.stats.hit_ratio:.2f} in memory, "
+            f"{self.disk_stats.hit_ratio:.2f} on disk"
+        )
+        if not isinstance(response, response_format):
+            return None
+        return response.model_copy(deep=True)
+
+    def _read[Response: BaseModel](
+        self, key: str, response_format: type[Response]
+    ) -> Response | None:
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return None
+            try:
+                row = connection.execute(
+                    "SELECT created, response FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read a cached code response: {e}")
+                row = None
+            if row is None or (
+                self.ttl is not None and time.time() - row[0] > self.ttl
+            ):
+                self.disk_stats.misses += 1
+                return None
+            self.disk_stats.hits += 1
+        response = response_format.model_validate_json(row[1])
+        self._memory.put(key, response)
+        return response
+
+    def _write(self, key: str, response: str) -> None:
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return
+            now = time.time()
+            try:
+                with connection:
+                    _ = connection.execute(
+                        "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                        (key, now, response),
+                    )
+                    # Expired responses are already ignored, so they're only
+                    # removed now and then, to keep the file from growing
+                    if self.ttl is not None and now - self._pruned > PRUNE_INTERVAL:
+                        _ = connection.execute(
+                            "DELETE FROM responses WHERE created < ?",
+                            (now - self.ttl,),
+                        )
+                        self._pruned = now
+            except sqlite3.Error as e:
+                logger.warning(f"Could not cache a code response: {e}")
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self._connection is None and self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(self.path, check_same_thread=False)
+                _ = connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses "
+                    "(key TEXT PRIMARY KEY, created REAL, response TEXT)"
+                )
+            except (OSError, sqlite3.Error) as e:
+                # The in-memory cache still works without the file
+                logger.warning(f"Could not open the code response cache: {e}")
+                self.path = None
+                return None
+            self._connection = connection
+        return self._connection
+
+
+def get_response_key(
+    model: str, messages: list[dict[str, str]], response_format: type[BaseModel]
+) -> str:
+    """Returns the cache key of a request to a model, which changes with the
+    model, the messages, or the schema of the response."""
+    request = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "schema": response_format.model_json_schema(),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(request.encode()).hexdigest()
@@ -0,0 +1,95 @@
+"""A DuckDB database file that names every dataset.
+
+Without it, generated queries read each dataset by its full href, e.g.
+`FROM 's3://digital-atlas/.../file.parquet'`. At ingest time,
+`scripts/embed_stac.py` writes a DuckDB database file with a view of each
+dataset, named after its item, and a table that records which view belongs to
+which dataset. Each worker's database attaches the file read-only, so prompts
+and queries can refer to datasets by their short view names.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from pathlib import Path
+
+import duckdb
+from duckdb import DuckDBPyConnection
+
+from .dataset import Dataset
+
+logger = logging.getLogger(__name__)
+
+# The name the catalog is attached under
+CATALOG = "catalog"
+
+# The table that maps datasets to their views
+DATASETS = "__datasets"
+
+
+def get_view_name(dataset: Dataset) -> str:
+    """Returns the name of the dataset's view, which is a valid bare SQL
+    identifier."""
+    name = re.sub(r"\W+", "_", f"{dataset.item.id}_{dataset.asset_key}").lower()
+    return name if re.match(r"[a-z_]", name) else "_" + name
+
+
+def build_catalog(path: Path, datasets: list[Dataset]) -> int:
+    """Writes a catalog of the datasets to a DuckDB database file, returning
+    the number of views that were created.
+
+    The file is written beside the path and then moved into place, so workers
+    never see a partially-written catalog.
+    """
+    temporary = path.with_suffix(".tmp")
+    temporary.unlink(missing_ok=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    created = 0
+    with duckdb.connect(str(temporary)) as connection:
+        _ = connection.execute(
+            f"CREATE TABLE {DATASETS} (item_id VARCHAR, asset_key VARCHAR, "
+            "view VARCHAR PRIMARY KEY)"
+        )
+        for dataset in datasets:
+            view = get_view_name(dataset)
+            # Creating a view binds it, which reads the dataset's schema
+            try:
+                _ = connection.execute(
+                    f"CREATE VIEW {view} AS SELECT * FROM '{dataset.asset.href}'"
+                )
+            except duckdb.Error as e:
+                logger.warning(f"Could not create a view of {dataset.item.id}: {e}")
+                continue
+            _ = connection.execute(
+                f"INSERT INTO {DATASETS} VALUES (?, ?, ?)",
+                [dataset.item.id, dataset.asset_key, view],
+            )
+            created += 1
+    _ = temporary.replace(path)
+    return created
+
+
+class Catalog:
+    """The views of an attached catalog file."""
+
+    def __init__(self, views: dict[tuple[str, str], str]) -> None:
+        self.views: dict[tuple[str, str], str] = views
+
+    @classmethod
+    def attach(cls, connection: DuckDBPyConnection, path: Path) -> Catalog:
+        """Attaches the catalog file to the connection, read-only."""
+        _ = connection.execute(f"ATTACH '{path}' AS {CATALOG} (READ_ONLY)")
+        rows = connection.sql(
+            f"SELECT item_id, asset_key, view FROM {CATALOG}.{DATASETS}"
+        ).fetchall()
+        return cls({(item_id, asset_key): view for item_id, asset_key, view in rows})
+
+    def get_view(self, dataset: Dataset) -> str | None:
+        """Returns the name of the dataset's view, if it has one."""
+        return self.views.get((dataset.item.id, dataset.asset_key))
+
+    def use(self, cursor: DuckDBPyConnection) -> None:
+        """Lets the cursor refer to the catalog's views by their bare
+        names."""
+        _ = cursor.execute(f"SET search_path = 'memory.main,{CATALOG}.main'")
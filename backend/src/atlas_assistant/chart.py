@@ -0,0 +1,428 @@
+"""Chart metadata inferred from query results, without the code model.
+
+Most charts have one obvious reading of their data, like a map of a single
+number by `iso3`, or a bar chart of a single number by a single category, and
+asking the code model for it costs a round trip. `infer_chart_metadata` fills
+in a chart's metadata from the types and names of the result's columns, with a
+confidence that falls with each other reading the columns allow.
+`ChartInference` uses it when it's confident enough, and keeps track of how
+often that is and how much time it saves.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import re
+import threading
+from collections import defaultdict
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any, Literal
+
+from pydantic import BaseModel
+
+from .state import (
+    AreaChartMetadata,
+    BarChartMetadata,
+    BeeswarmChartMetadata,
+    ChartType,
+    DotPlotMetadata,
+    HeatmapChartMetadata,
+    LineChartMetadata,
+    MapChartMetadata,
+)
+
+logger = logging.getLogger(__name__)
+
+# Names of columns of dates or times, e.g. `year` or `start_date`
+TEMPORAL_NAME = re.compile(r"(^|_)(year|date|month|timeframe|period|decade)s?$")
+
+# Values that are dates, years, or ranges of years like `2021-2040`
+TEMPORAL_VALUE = re.compile(r"^\d{4}(-\d{2}(-\d{2})?|-\d{4})?$")
+
+# The geographic identifier of each boundary level, finest first
+GEO_COLUMNS: dict[Literal["admin0", "admin1", "admin2"], str] = {
+    "admin2": "admin2_name",
+    "admin1": "admin1_name",
+    "admin0": "iso3",
+}
+
+# Columns that name places, which a map's regions already show
+PLACE_COLUMNS = frozenset(["iso3", "admin0_name", "admin1_name", "admin2_name"])
+
+# How columns are named in titles
+LABELS = {
+    "iso3": "country",
+    "admin0_name": "country",
+    "admin1_name": "region",
+    "admin2_name": "district",
+}
+
+# Approximate results have a margin of error beside each estimate
+MARGIN_SUFFIX = "_margin"
+
+
+@dataclass
+class Column:
+    """A column of a query's result"""
+
+    name: str
+    """The column's name"""
+
+    kind: Literal["number", "temporal", "category"]
+    """Whether the column holds numbers, dates or times, or anything else"""
+
+    values: list[Any]
+    """The column's values, one per row"""
+
+    @property
+    def keys(self) -> list[str]:
+        """The column's values, comparably"""
+        return [json.dumps(value, sort_keys=True) for value in self.values]
+
+    @property
+    def distinct(self) -> int:
+        """The number of distinct values in the column"""
+        return len(set(self.keys))
+
+
+@dataclass
+class Inference:
+    """Chart metadata inferred from a query's result"""
+
+    metadata: BaseModel
+    """The chart's metadata"""
+
+    confidence: float
+    """One over the number of readings of the result's columns, so 1 when
+    there's only one"""
+
+
+def infer_chart_metadata(chart_type: ChartType, data: str) -> Inference | None:
+    """Infers a chart's metadata from a query's result, as a JSON array of
+    records, or returns None if the result doesn't fit the chart."""
+    columns = get_columns(data)
+    numbers = [
+        column
+        for column in columns
+        if column.kind == "number" and not column.name.endswith(MARGIN_SUFFIX)
+    ]
+    dimensions = _group(_varying([c for c in columns if c.kind != "number"]))
+    infer = INFERRERS.get(chart_type)
+    if infer is None or not numbers:
+        return None
+    return infer(columns, numbers, dimensions)
+
+
+def get_columns(data: str) -> list[Column]:
+    """Returns the columns of a query's result, as a JSON array of records."""
+    records: list[dict[str, Any]] = json.loads(data)
+    names = list(dict.fromkeys(name for record in records for name in record))
+    columns: list[Column] = []
+    for name in names:
+        values = [record.get(name) for record in records]
+        columns.append(Column(name=name, kind=_get_kind(name, values), values=values))
+    return columns
+
+
+def _get_kind(
+    name: str, values: list[Any]
+) -> Literal["number", "temporal", "category"]:
+    """Returns the kind of a column, going by its values, and by its name for
+    years and months that are numbers."""
+    present = [value for value in values if value is not None]
+    if not present:
+        return "category"
+    if all(isinstance(value, str) and TEMPORAL_VALUE.match(value) for value in present):
+        return "temporal"
+    if not all(
+        isinstance(value, int | float) and not isinstance(value, bool)
+        for value in present
+    ):
+        return "category"
+    if TEMPORAL_NAME.search(name.lower()) and all(
+        isinstance(value, int) for value in present
+    ):
+        return "temporal"
+    return "number"
+
+
+def _infer_bar(
+    columns: list[Column], numbers: list[Column], dimensions: list[list[Column]]
+) -> Inference | None:
+    if not dimensions:
+        return None
+    # The dimension with the most values is the x-axis, and the next groups it
+    dimensions = sorted(dimensions, key=lambda group: -group[0].distinct)
+    x = _pick(dimensions[0])
+    grouping = _pick(dimensions[1]) if len(dimensions) > 1 else None
+    return Inference(
+        metadata=BarChartMetadata(
+            title=_title(numbers[0], x, grouping),
+            x_column=x.name,
+            y_column=numbers[0].name,
+            grouping_column=grouping.name if grouping else None,
+        ),
+        confidence=_arrangements(numbers, 1) * _arrangements(dimensions, 2),
+    )
+
+
+def _infer_map(
+    columns: list[Column], numbers: list[Column], dimensions: list[list[Column]]
+) -> Inference | None:
+    present = {column.name: column for column in columns}
+    levels = [level for level, name in GEO_COLUMNS.items() if name in present]
+    # The finest level whose regions differ, or else the finest level
+    levels = [
+        level for level in levels if present[GEO_COLUMNS[level]].distinct > 1
+    ] or levels
+    if not levels:
+        return None
+    level = levels[0]
+    # Anything else that varies would put several values in a region
+    others = [
+        group
+        for group in dimensions
+        if not any(column.name in PLACE_COLUMNS for column in group)
+    ]
+    return Inference(
+        metadata=MapChartMetadata(
+            title=_title(numbers[0], present[GEO_COLUMNS[level]]),
+            id_column=GEO_COLUMNS[level],
+            value_column=numbers[0].name,
+            admin_level=level,
+        ),
+        confidence=_arrangements(numbers, 1) * 0.5 ** len(others),
+    )
+
+
+def _infer_series(
+    metadata_class: type[AreaChartMetadata] | type[LineChartMetadata],
+) -> Callable[[list[Column], list[Column], list[list[Column]]], Inference | None]:
+    def infer(
+        columns: list[Column], numbers: list[Column], dimensions: list[list[Column]]
+    ) -> Inference | None:
+        times = [group for group in dimensions if group[0].kind == "temporal"]
+        if not times:
+            return None
+        x = _pick(times[0])
+        others = [group for group in dimensions if group is not times[0]]
+        grouping = _pick(others[0]) if others else None
+        return Inference(
+            metadata=metadata_class(
+                title=_title(numbers[0], x, grouping),
+                x_column=x.name,
+                y_column=numbers[0].name,
+                grouping_column=grouping.name if grouping else None,
+            ),
+            confidence=_arrangements(numbers, 1)
+            * _arrangements(times, 1)
+            * _arrangements(others, 1),
+        )
+
+    return infer
+
+
+def _infer_dot(
+    columns: list[Column], numbers: list[Column], dimensions: list[list[Column]]
+) -> Inference | None:
+    if dimensions:
+        dimensions = sorted(dimensions, key=lambda group: -group[0].distinct)
+        x = _pick(dimensions[0])
+        grouping = _pick(dimensions[1]) if len(dimensions) > 1 else None
+        y = numbers[0]
+        confidence = _arrangements(numbers, 1) * _arrangements(dimensions, 2)
+    elif len(numbers) > 1:
+        # A scatter plot of one number against another
+        x, y = numbers[:2]
+        grouping = None
+        confidence = _arrangements(numbers, 2)
+    else:
+        return None
+    return Inference(
+        metadata=DotPlotMetadata(
+            title=_title(y, x, grouping),
+            x_column=x.name,
+            y_column=y.name,
+            grouping_column=grouping.name if grouping else None,
+            size_column=None,
+        ),
+        confidence=confidence,
+    )
+
+
+def _infer_beeswarm(
+    columns: list[Column], numbers: list[Column], dimensions: list[list[Column]]
+) -> Inference | None:
+    if not dimensions:
+        return None
+    # Each category is a swarm of points, so it has the fewest values
+    category = _pick(min(dimensions, key=lambda group: group[0].distinct))
+    return Inference(
+        metadata=BeeswarmChartMetadata(
+            title=_title(numbers[0], category),
+            category_column=category.name,
+            value_column=numbers[0].name,
+            color_column=None,
+        ),
+        confidence=_arrangements(numbers, 1) * _arrangements(dimensions, 1),
+    )
+
+
+def _infer_heatmap(
+    columns: list[Column], numbers: list[Column], dimensions: list[list[Column]]
+) -> Inference | None:
+    if len(dimensions) < 2:
+        return None
+    # Dates and times read left to right, and otherwise the longer axis is x
+    dimensions = sorted(
+        dimensions,
+        key=lambda group: (group[0].kind != "temporal", -group[0].distinct),
+    )
+    x, y = _pick(dimensions[0]), _pick(dimensions[1])
+    return Inference(
+        metadata=HeatmapChartMetadata(
+            title=_title(numbers[0], x, y),
+            x_column=x.name,
+            y_column=y.name,
+            value_column=numbers[0].name,
+        ),
+        # Swapping the axes is the same reading
+        confidence=_arrangements(numbers, 1) * 2 * _arrangements(dimensions, 2),
+    )
+
+
+INFERRERS: dict[
+    ChartType,
+    Callable[[list[Column], list[Column], list[list[Column]]], Inference | None],
+] = {
+    "bar": _infer_bar,
+    "map": _infer_map,
+    "area": _infer_series(AreaChartMetadata),
+    "line": _infer_series(LineChartMetadata),
+    "dot": _infer_dot,
+    "beeswarm": _infer_beeswarm,
+    "heatmap": _infer_heatmap,
+}
+
+
+def _varying(columns: list[Column]) -> list[Column]:
+    """Returns the columns with more than one value, or else all of them,
+    e.g. when there's only one row."""
+    return [column for column in columns if column.distinct > 1] or columns
+
+
+def _group(columns: list[Column]) -> list[list[Column]]:
+    """Groups columns whose values determine each other, like `iso3` and
+    `admin0_name`, since they're the same dimension of the result."""
+    groups: list[list[Column]] = []
+    for column in columns:
+        for group in groups:
+            pairs = set(zip(group[0].keys, column.keys, strict=True))
+            if len(pairs) == group[0].distinct == column.distinct:
+                group.append(column)
+                break
+        else:
+            groups.append([column])
+    return groups
+
+
+def _pick(group: list[Column]) -> Column:
+    """Returns the most readable column of a group, preferring names to
+    codes."""
+    return next((c for c in group if c.name.endswith("_name")), group[0])
+
+
+def _arrangements(candidates: list[Any], slots: int) -> float:
+    """Returns one over the number of ways to fill the slots with candidates,
+    with optional slots left empty when there aren't enough."""
+    return 1 / math.perm(len(candidates), min(slots, len(candidates)))
+
+
+def _title(value: Column, *dimensions: Column | None) -> str:
+    """Returns a title like "Value by country and crop"."""
+    label = _label(value)
+    title = label[:1].upper() + label[1:]
+    labels = [_label(dimension) for dimension in dimensions if dimension]
+    return f"{title} by {' and '.join(labels)}" if labels else title
+
+
+def _label(column: Column) -> str:
+    return LABELS.get(column.name, column.name.replace("_", " "))
+
+
+@dataclass
+class ChartStats:
+    """Counters for a chart type's metadata"""
+
+    inferred: int = 0
+    """The number of charts whose metadata was inferred"""
+
+    generated: int = 0
+    """The number of charts whose metadata the code model generated"""
+
+    generation_seconds: float = 0.0
+    """The total time the code model took"""
+
+    @property
+    def hit_ratio(self) -> float:
+        """The fraction of charts whose metadata was inferred"""
+        charts = self.inferred + self.generated
+        return self.inferred / charts if charts else 0.0
+
+    @property
+    def seconds_saved(self) -> float:
+        """The time inference saved, going by the code model's average time"""
+        if not self.generated:
+            return 0.0
+        return self.inferred * self.generation_seconds / self.generated
+
+
+class ChartInference:
+    """Infers charts' metadata when it's confident enough to skip the code
+    model, counting how often it is for each chart type."""
+
+    def __init__(self, min_confidence: float = 0.75) -> None:
+        self.min_confidence: float = min_confidence
+        self.stats: defaultdict[ChartType, ChartStats] = defaultdict(ChartStats)
+        self._lock: threading.Lock = threading.Lock()
+
+    def infer(self, chart_type: ChartType, data: str) -> BaseModel | None:
+        """Returns a chart's inferred metadata, or None if the code model
+        should generate it."""
+        try:
+            inference = infer_chart_metadata(chart_type, data)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Could not infer {chart_type} chart metadata: {e}")
+            return None
+        if inference is None or inference.confidence < self.min_confidence:
+            return None
+        with self._lock:
+            stats = self.stats[chart_type]
+            stats.inferred += 1
+        logger.info(
+            f"Inferred {chart_type} chart metadata with confidence "
+            f"{inference.confidence:.2f}, {self._describe(chart_type)}"
+        )
+        return inference.metadata
+
+    def record(self, chart_type: ChartType, seconds: float) -> None:
+        """Records how long the code model took to generate a chart's
+        metadata."""
+        with self._lock:
+            stats = self.stats[chart_type]
+            stats.generated += 1
+            stats.generation_seconds += seconds
+        logger.info(
+            f"Generated {chart_type} chart metadata in {seconds:.2f} seconds, "
+            f"{self._describe(chart_type)}"
+        )
+
+    def _describe(self, chart_type: ChartType) -> str:
+        stats = self.stats[chart_type]
+        return (
+            f"{chart_type} hit ratio {stats.hit_ratio:.2f}, about "
+            f"{stats.seconds_saved:.1f} seconds saved"
+        )
@@ -1,6 +1,21 @@
-from dataclasses import dataclass
+import threading
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
 
-from .settings import Settings
+from langchain_core.messages import ToolMessage
+
+from .chart import ChartInference
+from .database import Database, ResultCache
+from .dataset.index import DatasetIndex
+from .dataset.lexical import LexicalIndex
+from .dataset.mirror import Mirror
+from .dataset.rollup import RollupStore
+from .dataset.sample import SampleStore
+from .dataset.scan import FooterCache
+from .dataset.version import VersionCache
+from .embeddings import VectorStore
+from .prompt import PromptCache
+from .settings import CodeClient, Settings
 
 
 @dataclass
@@ -8,3 +23,58 @@ class Context:
     """Immutable values shared between tools"""
 
     settings: Settings
+
+    database: Database
+    """The DuckDB database that tools get their cursors from"""
+
+    code_client: CodeClient | None = None
+    """The code model's client, shared between requests, which the tools that
+    call the code model need"""
+
+    charts: ChartInference | None = None
+    """Chart metadata inferred without the code model, and how often it is"""
+
+    executor: Executor | None = None
+    """The pool async tools run their blocking work on, shared between
+    requests, or else the event loop's default executor"""
+
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    """Set when the request is abandoned, e.g. when the client disconnects, to
+    interrupt any running queries"""
+
+    embeddings: VectorStore | None = None
+    """The dataset embeddings, shared between requests"""
+
+    datasets: DatasetIndex | None = None
+    """Every dataset, parsed once"""
+
+    lexical: LexicalIndex | None = None
+    """A keyword index of the datasets, searched before their embeddings"""
+
+    approximate: bool = False
+    """Whether to estimate every table from a sample of its dataset"""
+
+    refinements: list[Future[ToolMessage]] = field(default_factory=list)
+    """Exact results of approximate tables, still being computed, to stream to
+    the user once they're ready"""
+
+    versions: VersionCache | None = None
+    """Dataset versions, for checking that local copies of datasets are current"""
+
+    mirror: Mirror | None = None
+    """A local mirror of remote datasets, if mirroring is enabled"""
+
+    prompts: PromptCache | None = None
+    """Compiled SQL prompts, if prompt caching is enabled"""
+
+    results: ResultCache | None = None
+    """Cached query results, if result caching is enabled"""
+
+    rollups: RollupStore | None = None
+    """Pre-aggregated datasets that eligible queries are routed to"""
+
+    footers: FooterCache | None = None
+    """Parquet footers, for estimating how much data queries will read"""
+
+    samples: SampleStore | None = None
+    """Samples of datasets, for approximate answers"""
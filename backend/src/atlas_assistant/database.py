@@ -0,0 +1,405 @@
+"""A DuckDB database shared by all tool invocations in a worker."""
+
+from __future__ import annotations
+
+import datetime
+import decimal
+import json
+import logging
+import math
+import re
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
+from functools import cached_property
+from pathlib import Path
+from types import TracebackType
+from typing import Any
+
+import duckdb
+import pyarrow as pa
+import tabulate
+from duckdb import DuckDBPyConnection
+
+from .cache import CacheStats, LruCache
+from .catalog import Catalog
+from .dataset.version import VersionCache
+
+logger = logging.getLogger(__name__)
+
+# Matches single-quoted strings and double-quoted identifiers, including
+# escaped quotes
+QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+
+# Matches identifiers, quoted or not
+IDENTIFIER = re.compile(r'"((?:[^"]|"")*)"|\b([A-Za-z_]\w*)\b')
+
+# Matches single-quoted strings
+STRING = re.compile(r"'(?:[^']|'')*'")
+
+# The schema metadata key for the bytes read to produce a result
+BYTES_READ = b"atlas_assistant:bytes_read"
+
+# How often a waiting query checks whether it's been cancelled, in seconds
+POLL_INTERVAL = 0.1
+
+# How long an interrupted query is waited on to stop, in seconds, before it's
+# left to finish on its worker
+INTERRUPT_TIMEOUT = 5.0
+
+
+class QueryCancelledError(Exception):
+    """Raised when a query is interrupted before it finishes."""
+
+    def __init__(self, reason: str, elapsed: float) -> None:
+        super().__init__(f"Query {reason} after {elapsed:.1f} seconds")
+        self.reason: str = reason
+        self.elapsed: float = elapsed
+
+
+class Database:
+    """A configured parent DuckDB connection that hands out cursors.
+
+    DuckDB's module-level connection is shared by every caller and can't be
+    used safely from multiple threads at once. Instead, each tool invocation
+    gets its own cursor on this parent connection, so concurrent queries run
+    in parallel while still sharing the parquet and HTTP metadata caches.
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        threads: int | None = None,
+        memory_limit: str | None = None,
+        max_queries: int = 4,
+        catalog: Path | None = None,
+    ) -> None:
+        self.connection: DuckDBPyConnection = duckdb.connect(path)
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max_queries, thread_name_prefix="duckdb"
+        )
+        try:
+            _ = self.connection.execute("INSTALL httpfs")
+            _ = self.connection.execute("LOAD httpfs")
+        except duckdb.Error as e:
+            logger.warning(f"Could not load httpfs, relying on autoloading: {e}")
+        _ = self.connection.execute("SET enable_object_cache = true")
+        _ = self.connection.execute("SET enable_http_metadata_cache = true")
+        if threads is not None:
+            _ = self.connection.execute(f"SET threads = {int(threads)}")
+        if memory_limit is not None:
+            _ = self.connection.execute("SET memory_limit = ?", [memory_limit])
+        self.catalog: Catalog | None = None
+        if catalog is not None and catalog.exists():
+            self.catalog = Catalog.attach(self.connection, catalog)
+
+    def __enter__(self) -> Database:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    @contextmanager
+    def cursor(self) -> Iterator[DuckDBPyConnection]:
+        """Yields a cursor for use by a single thread, closing it afterwards."""
+        cursor = self.connection.cursor()
+        try:
+            if self.catalog:
+                self.catalog.use(cursor)
+            yield cursor
+        finally:
+            cursor.close()
+
+    def execute(
+        self,
+        query: str,
+        timeout: float | None = None,
+        cancelled: threading.Event | None = None,
+        profile: bool = False,
+    ) -> pa.Table:
+        """Executes a query on the database's executor and returns the result.
+
+        The query is interrupted if it runs past the timeout (in seconds,
+        including time spent waiting for a free worker) or if `cancelled` is
+        set, in which case a `QueryCancelledError` is raised. If it doesn't
+        stop within `INTERRUPT_TIMEOUT` seconds, the error is raised anyway.
+
+        If `profile` is set, the number of bytes DuckDB reports reading is
+        kept in the result's schema metadata, see `get_bytes_read`.
+        """
+        start = time.monotonic()
+        with (
+            self.cursor() as cursor,
+            tempfile.TemporaryDirectory() if profile else nullcontext() as directory,
+        ):
+            profile_path = Path(directory, "profile.json") if directory else None
+            future = self.executor.submit(_fetch, cursor, query, profile_path)
+            while True:
+                elapsed = time.monotonic() - start
+                if timeout is not None and elapsed >= timeout:
+                    reason = "timed out"
+                    break
+                if cancelled and cancelled.is_set():
+                    reason = "was cancelled"
+                    break
+                wait = POLL_INTERVAL
+                if timeout is not None:
+                    wait = min(wait, timeout - elapsed)
+                try:
+                    return future.result(wait)
+                except FutureTimeoutError:
+                    continue
+
+            if not future.cancel():
+                # The worker may not have started the query yet, in which case
+                # an interrupt does nothing, so keep interrupting until it stops
+                deadline = time.monotonic() + INTERRUPT_TIMEOUT
+                while time.monotonic() < deadline:
+                    cursor.interrupt()
+                    try:
+                        # The query may finish just as we interrupt it
+                        return future.result(POLL_INTERVAL)
+                    except FutureTimeoutError:
+                        continue
+                    except duckdb.InterruptException:
+                        break
+                else:
+                    logger.warning(
+                        f"Query didn't stop after {INTERRUPT_TIMEOUT:.0f} seconds of "
+                        f"interrupts, leaving it to finish: {query}"
+                    )
+            logger.warning(f"Query {reason} after {elapsed:.1f} seconds: {query}")
+            raise QueryCancelledError(reason, elapsed)
+
+    def close(self) -> None:
+        """Stops the executor and closes the parent connection, and with it
+        every cursor."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.connection.close()
+
+
+def get_bytes_read(table: pa.Table) -> int | None:
+    """Returns the bytes read to produce a profiled result, if it was
+    profiled."""
+    metadata = table.schema.metadata or {}
+    bytes_read = metadata.get(BYTES_READ)
+    return int(bytes_read) if bytes_read is not None else None
+
+
+def _fetch(
+    cursor: DuckDBPyConnection, query: str, profile_path: Path | None
+) -> pa.Table:
+    if profile_path is None:
+        return cursor.sql(query).fetch_arrow_table()
+    _ = cursor.execute("PRAGMA enable_profiling = 'json'")
+    _ = cursor.execute(f"SET profiling_output = '{profile_path}'")
+    _ = cursor.execute(
+        """SET custom_profiling_settings = '{"TOTAL_BYTES_READ": "true"}'"""
+    )
+    table = cursor.sql(query).fetch_arrow_table()
+    _ = cursor.execute("PRAGMA disable_profiling")
+    if not profile_path.exists():
+        # e.g. EXPLAIN, which isn't profiled
+        return table
+    profile = json.loads(profile_path.read_text())
+    metadata = {
+        **(table.schema.metadata or {}),
+        BYTES_READ: str(profile["total_bytes_read"]),
+    }
+    return table.replace_schema_metadata(metadata)
+
+
+class QueryResult:
+    """The result of a query, held as an Arrow table.
+
+    The markdown, JSON, and Arrow IPC forms are each produced directly from
+    the table the first time they're asked for, without going through pandas.
+    """
+
+    def __init__(self, table: pa.Table) -> None:
+        self.table: pa.Table = table
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    @cached_property
+    def markdown(self) -> str:
+        """The rows as a markdown table, for the model"""
+        columns = [column.to_pylist() for column in self.table.columns]
+        rows = zip(*columns, strict=True)
+        return tabulate.tabulate(rows, headers=self.table.column_names, tablefmt="pipe")
+
+    @cached_property
+    def json(self) -> str:
+        """The rows as a JSON array of records, for the frontend"""
+        records = [
+            {name: _to_json_value(value) for name, value in row.items()}
+            for row in self.table.to_pylist()
+        ]
+        return json.dumps(records, separators=(",", ":"), default=_json_default)
+
+    @cached_property
+    def ipc(self) -> bytes:
+        """The table in the Arrow IPC stream format"""
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, self.table.schema) as writer:
+            writer.write_table(self.table)
+        return sink.getvalue().to_pybytes()
+
+
+def _to_json_value(value: Any) -> Any:
+    # JSON has no NaN or infinity
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.date | datetime.time):
+        return value.isoformat()
+    return str(value)
+
+
+class ResultCache:
+    """Query results, keyed by normalized SQL and the version of the dataset.
+
+    Results are held as Arrow tables, bounded by their total size in memory.
+    """
+
+    def __init__(
+        self, max_bytes: int, ttl: float, versions: VersionCache | None = None
+    ) -> None:
+        self._tables: LruCache[tuple[str, str], pa.Table] = LruCache(
+            max_entries=None, max_size=max_bytes, ttl=ttl, sizeof=lambda t: t.nbytes
+        )
+        self._versions: VersionCache = versions or VersionCache()
+
+    @property
+    def stats(self) -> CacheStats:
+        """The cache's hit, miss, and eviction counts"""
+        return self._tables.stats
+
+    def get_or_execute(
+        self, query: str, href: str, execute: Callable[[], pa.Table]
+    ) -> pa.Table:
+        """Returns the cached result of the query against the dataset at the
+        href, executing and caching it if needed.
+
+        If the dataset's version can't be determined, the query is executed
+        and its result isn't cached.
+        """
+        version = self._versions.get(href)
+        if version is None:
+            return execute()
+
+        key = (normalize_sql(query), version)
+        table = self._tables.get(key)
+        logger.info(
+            f"Result cache {'hit' if table is not None else 'miss'}, hit ratio "
+            f"{self.stats.hit_ratio:.2f} "
+            f"({self.stats.hits}/{self.stats.hits + self.stats.misses})"
+        )
+        if table is None:
+            table = execute()
+            self._tables.put(key, table)
+        return table
+
+
+def normalize_sql(query: str) -> str:
+    """Normalizes a SQL query's whitespace and case, leaving quoted strings
+    and identifiers as they are."""
+    parts = QUOTED.split(query.strip().rstrip(";"))
+    return "".join(
+        part if i % 2 else re.sub(r"\s+", " ", part).lower()
+        for i, part in enumerate(parts)
+    ).strip()
+
+
+def quote_identifier(name: str) -> str:
+    """Quotes a SQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def unquote_identifier(name: str) -> str:
+    """Removes the quotes from a SQL identifier, if it has them."""
+    name = name.strip()
+    if name.startswith('"') and name.endswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+def get_identifiers(sql: str) -> set[str]:
+    """Returns every identifier-like word in some SQL, outside of strings.
+
+    Keywords and function names are included, so callers should only check
+    for the names they care about.
+    """
+    return {
+        bare or quoted.replace('""', '"')
+        for quoted, bare in IDENTIFIER.findall(STRING.sub("''", sql))
+    }
+
+
+def split_conjuncts(where: str) -> list[str]:
+    """Splits a where clause on its top-level `AND`s, or returns it whole if
+    it has a top-level `OR`."""
+    conjuncts: list[str] = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(where):
+        character = where[i]
+        if character == "'":
+            i = where.find("'", i + 1)
+            if i == -1:
+                return [where]
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif depth == 0 and (match := re.match(r"\s+(and|or)\s+", where[i:], re.I)):
+            if match.group(1).lower() == "or":
+                return [where]
+            conjuncts.append(where[start:i].strip())
+            start = i + match.end()
+            i = start
+            continue
+        i += 1
+    conjuncts.append(where[start:].strip())
+    return conjuncts
+
+
+def split_items(sql: str) -> list[str]:
+    """Splits a list of expressions, like a select clause, on its top-level
+    commas."""
+    items: list[str] = []
+    depth = 0
+    start = 0
+    i = 0
+    while i < len(sql):
+        character = sql[i]
+        if character in "'\"":
+            i = sql.find(character, i + 1)
+            if i == -1:
+                return [sql.strip()]
+        elif character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "," and depth == 0:
+            items.append(sql[start:i].strip())
+            start = i + 1
+        i += 1
+    items.append(sql[start:].strip())
+    return items
@@ -2,9 +2,17 @@
 
 from __future__ import annotations
 
+from contextlib import nullcontext
+from typing import TYPE_CHECKING
+
 import tabulate
 from pydantic import BaseModel, ConfigDict, Field
 
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+    from .mirror import Mirror
+
 
 class Item(BaseModel):
     """A STAC item, with only the fields we need."""
@@ -75,6 +83,17 @@ class TableColumn(BaseModel):
     """
 
 
+class Layout(BaseModel):
+    """A local copy of a dataset, hive-partitioned and sorted so that queries
+    can skip most of it"""
+
+    href: str
+    """A glob of the copy's parquet files"""
+
+    version: str | None
+    """The version of the dataset that was copied"""
+
+
 class Dataset(BaseModel):
     """A parquet dataset, which is an asset.
 
@@ -87,6 +106,9 @@ class Dataset(BaseModel):
     asset_key: str
     """The key of the asset"""
 
+    layout: Layout | None = None
+    """A local, partitioned copy of the asset, if one was written at ingest"""
+
     @property
     def asset(self) -> Asset:
         """The asset itself, as referenced by the key."""
@@ -109,22 +131,35 @@ class Dataset(BaseModel):
         )
         return tabulate.tabulate(rows, headers=["Name", "Type", "Description"])
 
-    # TODO cache
-    def get_head_table(self, limit: int = 5) -> str:
-        """Returns a formatted table of the first few rows."""
+    def get_head_table(
+        self,
+        limit: int = 5,
+        mirror: Mirror | None = None,
+        connection: DuckDBPyConnection | None = None,
+    ) -> str:
+        """Returns a formatted table of the first few rows.
+
+        If a mirror is provided, the rows are read from its local copy. If no
+        connection is provided, DuckDB's default connection is used.
+        """
         import duckdb
 
-        return (
-            duckdb.sql(f"SELECT * FROM '{self.href}' LIMIT {limit}")
-            .to_df()
-            .to_string(index=False)
-        )
+        href = self.asset.href
+        with mirror.resolve(href) if mirror else nullcontext(href) as source:
+            return (
+                (connection or duckdb)
+                .sql(f"SELECT * FROM '{source}' LIMIT {limit}")
+                .to_df()
+                .to_string(index=False)
+            )
 
     def to_metadata(self) -> Metadata:
         """Converts this dataset to its metadata representation, for an
         embeddings database."""
         return Metadata(
-            item=self.item.model_dump_json(exclude_none=True), asset_key=self.asset_key
+            item=self.item.model_dump_json(exclude_none=True),
+            asset_key=self.asset_key,
+            layout=self.layout.model_dump_json() if self.layout else None,
         )
 
 
@@ -140,8 +175,13 @@ class Metadata(BaseModel):
     asset_key: str
     """The asset key"""
 
+    layout: str | None = None
+    """The dataset's layout as a JSON string, if it has one"""
+
     def to_dataset(self) -> Dataset:
         """Converts these metadata to a dataset"""
         return Dataset(
-            item=Item.model_validate_json(self.item), asset_key=self.asset_key
+            item=Item.model_validate_json(self.item),
+            asset_key=self.asset_key,
+            layout=Layout.model_validate_json(self.layout) if self.layout else None,
         )
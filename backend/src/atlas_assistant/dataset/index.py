@@ -0,0 +1,117 @@
+"""An index of every dataset, parsed once per worker.
+
+The embeddings store each dataset's STAC item as a JSON string, so reading a
+dataset back from them means validating the whole item again. At ingest time,
+`scripts/embed_stac.py` writes every dataset and a short summary of it to a
+JSON file, keyed by its id in the embeddings. Workers parse that file once, or
+if it's missing, the embeddings' metadata once, and then look datasets up by
+id.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+from pydantic import BaseModel, TypeAdapter
+
+from . import Dataset, Metadata
+
+logger = logging.getLogger(__name__)
+
+# Summaries are cut at the end of the first sentence, or at this many
+# characters
+SUMMARY_LENGTH = 200
+
+
+class IndexEntry(BaseModel):
+    """A dataset in the index"""
+
+    id: str
+    """The dataset's id in the embeddings"""
+
+    dataset: Dataset
+    """The dataset"""
+
+    summary: str
+    """A short summary of the dataset's description"""
+
+
+ENTRIES = TypeAdapter(list[IndexEntry])
+
+
+class DatasetIndex:
+    """Every dataset, keyed by its id in the embeddings.
+
+    The index is loaded on first use, from the file if there is one, or else
+    from the embeddings' metadata.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        get_metadatas: Callable[[], dict[str, Metadata]] | None = None,
+    ) -> None:
+        self.path: Path = path
+        self._get_metadatas: Callable[[], dict[str, Metadata]] | None = get_metadatas
+        self._lock: threading.Lock = threading.Lock()
+        self._entries: dict[str, IndexEntry] | None = None
+
+    def get(self, id: str) -> Dataset | None:
+        """Returns the dataset with the id, if it's in the index."""
+        entry = self._load().get(id)
+        return entry.dataset if entry else None
+
+    def list(self) -> list[IndexEntry]:
+        """Returns every entry in the index."""
+        return list(self._load().values())
+
+    def reload(self) -> None:
+        """Reloads the index on next use, e.g. after it's been rebuilt."""
+        with self._lock:
+            self._entries = None
+
+    def _load(self) -> dict[str, IndexEntry]:
+        with self._lock:
+            if self._entries is None:
+                if self.path.exists():
+                    entries = ENTRIES.validate_json(self.path.read_bytes())
+                elif self._get_metadatas:
+                    logger.info(f"No dataset index at {self.path}, using embeddings")
+                    entries = [
+                        create_entry(id, metadata.to_dataset())
+                        for id, metadata in self._get_metadatas().items()
+                    ]
+                else:
+                    entries = []
+                self._entries = {entry.id: entry for entry in entries}
+            return self._entries
+
+
+def write_index(path: Path, entries: list[IndexEntry]) -> None:
+    """Writes index entries to a JSON file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _ = path.write_bytes(ENTRIES.dump_json(entries, exclude_none=True))
+
+
+def create_entry(id: str, dataset: Dataset) -> IndexEntry:
+    """Creates an index entry for a dataset, summarizing its description."""
+    return IndexEntry(id=id, dataset=dataset, summary=summarize(dataset))
+
+
+def get_document_id(dataset: Dataset) -> str:
+    """Returns the id of the dataset in the embeddings."""
+    return f"{dataset.item.id}/{dataset.asset_key}"
+
+
+def summarize(dataset: Dataset) -> str:
+    """Returns the first sentence of the dataset's description, shortened if
+    it's still too long."""
+    description = " ".join(dataset.get_description().split())
+    sentence = re.split(r"(?<=[.!?])\s", description, maxsplit=1)[0]
+    if len(sentence) <= SUMMARY_LENGTH:
+        return sentence
+    return sentence[: SUMMARY_LENGTH - 1].rsplit(" ", 1)[0] + "…"
@@ -0,0 +1,227 @@
+"""Incremental ingestion of the STAC catalog.
+
+`scripts/embed_stac.py` runs on every deploy, but the catalog rarely changes
+between deploys. Each run records a hash and version of every dataset it
+ingested in a manifest. The next run builds a new embeddings directory beside
+the current one, reusing the embeddings and hard-linking the profiles,
+prompts, rollups, samples, and layouts of the datasets that haven't changed,
+and then swaps it in.
+
+Reading the catalog needs `pystac`, which is only installed with the
+development dependencies.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from langchain_core.embeddings import Embeddings
+from pydantic import BaseModel
+
+from . import Dataset, Item
+from .profile import get_sidecar_path
+
+# The manifest of what was ingested, inside the embeddings directory
+MANIFEST = "ingest.json"
+
+# The number of descriptions sent in each request to the embeddings API
+EMBED_BATCH_SIZE = 64
+
+PARQUET = "application/vnd.apache.parquet"
+
+
+class IngestRecord(BaseModel):
+    """What was ingested for a dataset"""
+
+    hash: str
+    """A hash of the dataset's item and asset key"""
+
+    version: str | None
+    """The version of the dataset's asset"""
+
+    compiled: bool
+    """Whether the dataset's profile, prompt, rollups, and sample were all
+    built"""
+
+
+class Manifest(BaseModel):
+    """What was ingested into an embeddings directory"""
+
+    embedding_model: str
+    """The model that embedded the datasets' descriptions"""
+
+    records: dict[str, IngestRecord] = {}
+    """What was ingested for each dataset, keyed by its id in the embeddings"""
+
+    @classmethod
+    def load(cls, directory: Path) -> Manifest | None:
+        """Reads the manifest of an embeddings directory, if it has one."""
+        path = directory / MANIFEST
+        if not path.exists():
+            return None
+        return cls.model_validate_json(path.read_bytes())
+
+    def write(self, directory: Path) -> None:
+        """Writes the manifest to an embeddings directory."""
+        _ = (directory / MANIFEST).write_text(self.model_dump_json())
+
+    def is_current(self, id: str, record: IngestRecord) -> bool:
+        """Returns whether a dataset was fully ingested as it is now."""
+        previous = self.records.get(id)
+        return (
+            previous is not None
+            and previous.compiled
+            and previous.hash == record.hash
+            and record.version is not None
+            and previous.version == record.version
+        )
+
+
+def read_datasets(href: str, max_workers: int = 16) -> list[Dataset]:
+    """Reads every parquet dataset in a STAC catalog.
+
+    The catalog is walked a level at a time, fetching each level's catalogs
+    and items concurrently.
+    """
+    import pystac
+
+    datasets: list[Dataset] = []
+    with ThreadPoolExecutor(max_workers) as executor:
+        hrefs = [href]
+        while hrefs:
+            catalogs = list(executor.map(pystac.read_file, hrefs))
+            hrefs = []
+            item_hrefs: list[str] = []
+            for catalog in catalogs:
+                assert isinstance(catalog, pystac.Catalog)
+                hrefs += [
+                    link.get_absolute_href() or "" for link in catalog.get_child_links()
+                ]
+                item_hrefs += [
+                    link.get_absolute_href() or "" for link in catalog.get_item_links()
+                ]
+            for item in executor.map(pystac.read_file, item_hrefs):
+                assert isinstance(item, pystac.Item)
+                for key, asset in item.assets.items():
+                    if asset.media_type == PARQUET:
+                        pydantic_item = Item.model_validate(
+                            item.to_dict(transform_hrefs=False)
+                        )
+                        datasets.append(Dataset(item=pydantic_item, asset_key=key))
+    return datasets
+
+
+def hash_dataset(dataset: Dataset) -> str:
+    """Returns a hash of the dataset's item and asset key, which changes when
+    anything that's ingested does."""
+    json = dataset.model_dump_json(exclude={"layout"})
+    return hashlib.sha256(json.encode()).hexdigest()
+
+
+def read_embeddings(directory: Path) -> dict[str, list[float]]:
+    """Returns the embeddings of the documents in an embeddings directory,
+    keyed by the documents' text."""
+    from langchain_chroma import Chroma
+
+    from ..embeddings import DATABASE_FILE
+
+    if not (directory / DATABASE_FILE).exists():
+        return {}
+    results = Chroma(persist_directory=str(directory)).get(
+        include=["documents", "embeddings"]
+    )
+    return {
+        document: [float(value) for value in embedding]
+        for document, embedding in zip(
+            results["documents"], results["embeddings"], strict=True
+        )
+    }
+
+
+class ReusedEmbeddings(Embeddings):
+    """An embedding function that reuses known embeddings of documents, and
+    embeds the rest in batches."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        known: dict[str, list[float]],
+        batch_size: int = EMBED_BATCH_SIZE,
+    ) -> None:
+        self.embeddings: Embeddings = embeddings
+        self.known: dict[str, list[float]] = known
+        self.batch_size: int = batch_size
+        self.embedded: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        missing = list(dict.fromkeys(text for text in texts if text not in self.known))
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+            embeddings = self.embeddings.embed_documents(batch)
+            self.known.update(zip(batch, embeddings, strict=True))
+            self.embedded += len(batch)
+        return [self.known[text] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+
+def link_artifacts(
+    source: Path, destination: Path, directories: Iterable[Path], dataset: Dataset
+) -> None:
+    """Hard-links a dataset's files in each of the store directories of one
+    embeddings directory into another."""
+    for directory in directories:
+        sidecar = get_sidecar_path(
+            source / directory, dataset.item.id, dataset.asset_key
+        )
+        name = sidecar.stem
+        paths = [source / directory / name]
+        paths += (source / directory).glob(glob.escape(name) + ".*")
+        for path in paths:
+            if not path.exists() or path.suffix == ".tmp":
+                continue
+            target = destination / directory / path.name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if path.is_dir():
+                _ = shutil.copytree(path, target, copy_function=os.link)
+            else:
+                os.link(path, target)
+
+
+def create_directory(target: Path) -> Path:
+    """Creates an empty directory to build the next version of the target in,
+    beside it."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    directory = Path(tempfile.mkdtemp(prefix=f"{target.name}.", dir=target.parent))
+    # Temporary directories are only readable by their owner
+    directory.chmod(0o755)
+    return directory
+
+
+def swap_directory(directory: Path, target: Path) -> None:
+    """Makes the target a symlink to the directory, and removes the directory
+    it used to point to.
+
+    The symlink is replaced atomically, so readers of the target see either
+    the old directory or the new one. A target that's a real directory, from
+    before ingestion was incremental, is moved aside first.
+    """
+    previous = target.resolve() if target.is_symlink() else None
+    link = target.with_name(f"{target.name}.link")
+    link.unlink(missing_ok=True)
+    link.symlink_to(directory.name)
+    if target.is_dir() and not target.is_symlink():
+        previous = target.with_name(f"{target.name}.old")
+        shutil.rmtree(previous, ignore_errors=True)
+        _ = target.rename(previous)
+    _ = link.replace(target)
+    if previous and previous != directory.resolve():
+        shutil.rmtree(previous, ignore_errors=True)
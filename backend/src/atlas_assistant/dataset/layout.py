@@ -0,0 +1,89 @@
+"""Local copies of datasets, laid out so that country queries read less.
+
+Nearly every generated query filters on a country, but the Atlas parquet files
+aren't sorted by one, so every row group holds many countries and none can be
+skipped. For the items listed in `Settings.layout_item_ids`,
+`scripts/embed_stac.py` writes a local copy of each dataset that's
+hive-partitioned by `iso3` and sorted by admin1 region and crop, and records
+it on the dataset. Queries read the copy instead of the original for as long
+as the original hasn't changed.
+"""
+
+from __future__ import annotations
+
+import logging
+import shutil
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from ..database import quote_identifier
+from . import Dataset, Layout
+from .profile import get_sidecar_path
+from .version import VersionCache
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+logger = logging.getLogger(__name__)
+
+# The column each partition holds a single value of
+PARTITION_BY = "iso3"
+
+# The columns rows are sorted by within each partition
+SORT_BY = ["admin1_name", "crop"]
+
+
+def build_layout(
+    dataset: Dataset,
+    directory: Path,
+    version: str | None,
+    connection: DuckDBPyConnection | None = None,
+) -> Layout:
+    """Writes a partitioned, sorted copy of the dataset to the directory.
+
+    Raises a `ValueError` if the dataset can't be partitioned.
+    """
+    import duckdb
+
+    sql = (connection or duckdb).sql
+    source = f"'{dataset.asset.href}'"
+    columns = {
+        str(name) for name, *_ in sql(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    }
+    if PARTITION_BY not in columns:
+        raise ValueError(f"{dataset.item.id} has no {PARTITION_BY} column")
+    order_by = [PARTITION_BY, *(column for column in SORT_BY if column in columns)]
+
+    path = get_sidecar_path(directory, dataset.item.id, dataset.asset_key)
+    path = path.with_suffix("")
+    # Write the new copy beside the old one, so a failure leaves the old one.
+    # The name keeps the asset key, since an item's assets are laid out at once
+    temporary = path.with_name(f"{path.name}.tmp")
+    shutil.rmtree(temporary, ignore_errors=True)
+    directory.mkdir(parents=True, exist_ok=True)
+    _ = sql(
+        f"COPY (SELECT * FROM {source} "
+        f"ORDER BY {', '.join(quote_identifier(column) for column in order_by)}) "
+        f"TO '{temporary}' "
+        f"(FORMAT parquet, PARTITION_BY ({quote_identifier(PARTITION_BY)}))"
+    )
+    shutil.rmtree(path, ignore_errors=True)
+    _ = temporary.rename(path)
+    return Layout(href=str(path / "**" / "*.parquet"), version=version)
+
+
+def get_current_layout(
+    dataset: Dataset, versions: VersionCache | None = None
+) -> Layout | None:
+    """Returns the dataset's layout, or None if it doesn't have one or the
+    dataset has changed since it was written."""
+    layout = dataset.layout
+    if layout is None:
+        return None
+    href = dataset.asset.href
+    # A stale copy would silently return old numbers
+    version = (versions or VersionCache()).get(href)
+    if version is None or version != layout.version:
+        logger.info(f"Not using the layout of {href}, which is out of date")
+        return None
+    return layout
@@ -0,0 +1,136 @@
+"""A keyword index of the datasets, searched without the embeddings API.
+
+Selecting a dataset by its embeddings means a round trip to the embeddings API
+for every search, and when that API is slow or unreachable, so is selection.
+At ingest time, `scripts/embed_stac.py` writes a BM25 index of each dataset's
+item id, asset title, description, and column names. Searches rank datasets
+with it in-process, and when one dataset clearly stands out, the embeddings
+aren't searched at all. Otherwise, the two rankings are fused.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from . import Dataset
+
+# BM25's term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+# Reciprocal-rank fusion's damping constant, from Cormack et al.
+RRF_K = 60
+
+# A keyword match is confident enough to skip the embeddings when its score is
+# at least this high, and this many times the runner-up's
+MIN_CONFIDENT_SCORE = 5.0
+CONFIDENCE_RATIO = 2.0
+
+STOPWORDS = frozenset(
+    "a an and are as at be been being by do does for from has have how i in is "  # noqa: SIM905
+    "it me of on or show tell that the there this to was what when where which "
+    "who why will with".split()
+)
+
+
+class LexicalIndex(BaseModel):
+    """A BM25 index of documents, keyed by their ids in the embeddings"""
+
+    lengths: dict[str, int]
+    """The number of terms in each document"""
+
+    postings: dict[str, dict[str, int]]
+    """For each term, the number of times it occurs in each document"""
+
+    @classmethod
+    def build(cls, texts: dict[str, str]) -> LexicalIndex:
+        """Indexes documents' texts."""
+        lengths: dict[str, int] = {}
+        postings: dict[str, dict[str, int]] = {}
+        for id, text in texts.items():
+            terms = tokenize(text)
+            lengths[id] = len(terms)
+            for term, count in Counter(terms).items():
+                postings.setdefault(term, {})[id] = count
+        return cls(lengths=lengths, postings=postings)
+
+    @classmethod
+    def load(cls, path: Path) -> LexicalIndex | None:
+        """Reads an index from a JSON file, if there is one."""
+        if not path.exists():
+            return None
+        return cls.model_validate_json(path.read_bytes())
+
+    def write(self, path: Path) -> None:
+        """Writes the index to a JSON file."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _ = path.write_text(self.model_dump_json())
+
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """Returns the ids and BM25 scores of the documents that best match
+        the query, best first."""
+        if not self.lengths:
+            return []
+        average_length = sum(self.lengths.values()) / len(self.lengths)
+        scores: Counter[str] = Counter()
+        for term in set(tokenize(query)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            n = len(documents)
+            idf = math.log(1 + (len(self.lengths) - n + 0.5) / (n + 0.5))
+            for id, count in documents.items():
+                norm = 1 - B + B * self.lengths[id] / average_length
+                scores[id] += idf * count * (K1 + 1) / (count + K1 * norm)
+        return scores.most_common(k)
+
+
+def is_confident(results: list[tuple[str, float]]) -> bool:
+    """Returns whether the best keyword match clearly stands out from the
+    rest."""
+    if not results:
+        return False
+    best = results[0][1]
+    runner_up = results[1][1] if len(results) > 1 else 0.0
+    return best >= MIN_CONFIDENT_SCORE and best >= CONFIDENCE_RATIO * runner_up
+
+
+def fuse(*rankings: list[str]) -> list[tuple[str, float]]:
+    """Fuses rankings of ids by reciprocal rank, returning the ids and their
+    fused scores, best first."""
+    scores: Counter[str] = Counter()
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] += 1 / (RRF_K + rank)
+    return scores.most_common()
+
+
+def get_text(dataset: Dataset) -> str:
+    """Returns the text of the dataset that's indexed."""
+    return "\n".join(
+        filter(
+            None,
+            [
+                dataset.item.id,
+                dataset.asset.title,
+                dataset.get_description(),
+                *(column.name for column in dataset.item.properties.table_columns),
+            ],
+        )
+    )
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lowercase terms, dropping common words.
+
+    Underscores and hyphens split terms, so that ids and column names like
+    `admin1_name` match words in queries.
+    """
+    return [
+        term for term in re.findall(r"[a-z0-9]+", text.lower()) if term not in STOPWORDS
+    ]
@@ -0,0 +1,192 @@
+"""A local, size-bounded mirror of remote parquet datasets.
+
+Querying a remote parquet file means a footer read plus range requests for
+every column chunk, on every query. The mirror fetches each file once and
+keeps it on disk, evicting the least recently used files when the mirror
+grows past its size budget.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter, OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+
+from ..cache import CacheStats
+from .version import VersionCache
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".parquet"
+
+# Downloads are written to temporary files, and those untouched for this many
+# seconds were left by a process that stopped mid-download
+STALE_SECONDS = 3600.0
+
+
+class Mirror:
+    """A least-recently-used, on-disk mirror of remote parquet files.
+
+    Local copies are keyed by the href and its version (the ETag, or the
+    last-modified time and content length if there's no ETag), so a changed
+    remote file is fetched again instead of being served stale. Copies that
+    are in use by a query are never evicted, and concurrent requests for a
+    copy that isn't there yet share one download.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int,
+        versions: VersionCache | None = None,
+        timeout: float | None = 60.0,
+    ) -> None:
+        self.directory: Path = directory
+        self.max_bytes: int = max_bytes
+        self.timeout: float | None = timeout
+        self.stats: CacheStats = CacheStats()
+        self._lock: threading.Lock = threading.Lock()
+        self._versions: VersionCache = versions or VersionCache()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._pins: Counter[str] = Counter()
+        self._downloads: dict[str, Future[None]] = {}
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in self.directory.glob("*.tmp"):
+            try:
+                if time.time() - path.stat().st_mtime > STALE_SECONDS:
+                    path.unlink()
+            except OSError:
+                # e.g. another process removed it first
+                continue
+        paths = sorted(
+            self.directory.glob("*" + SUFFIX), key=lambda p: p.stat().st_atime
+        )
+        for path in paths:
+            self._entries[path.stem] = path.stat().st_size
+
+    @property
+    def size(self) -> int:
+        """The total size of all local copies, in bytes"""
+        with self._lock:
+            return sum(self._entries.values())
+
+    @contextmanager
+    def resolve(self, href: str) -> Iterator[str]:
+        """Yields a local path for the href, or the href itself if it can't be
+        mirrored.
+
+        The local copy won't be evicted until the context exits, so queries
+        should be run inside of it.
+        """
+        try:
+            key, path = self._acquire(href)
+        except OSError as e:
+            logger.warning(f"Could not mirror {href}, reading it remotely: {e}")
+            yield href
+            return
+        try:
+            yield str(path)
+        finally:
+            self._release(key)
+
+    def get_path(self, href: str) -> Path:
+        """Returns the path to the local copy of the href, fetching it if
+        needed.
+
+        The copy may be evicted at any time, use `resolve` to keep it around.
+        """
+        key, path = self._acquire(href)
+        self._release(key)
+        return path
+
+    def _acquire(self, href: str) -> tuple[str, Path]:
+        key = self._get_key(href)
+        path = self.directory / (key + SUFFIX)
+        while True:
+            with self._lock:
+                if key in self._entries and path.exists():
+                    self._entries.move_to_end(key)
+                    self._pins[key] += 1
+                    self.stats.hits += 1
+                    return key, path
+                download = self._downloads.get(key)
+                if download is None:
+                    self.stats.misses += 1
+                    download = self._downloads[key] = Future()
+                    break
+            # Wait for the other download, and then take its copy, or raise
+            # its error
+            download.result()
+
+        try:
+            self._download(href, path)
+            size = path.stat().st_size
+        except BaseException as e:
+            with self._lock:
+                del self._downloads[key]
+            download.set_exception(e)
+            raise
+        try:
+            with self._lock:
+                del self._downloads[key]
+                self._entries[key] = size
+                self._entries.move_to_end(key)
+                self._pins[key] += 1
+                self._evict()
+        finally:
+            download.set_result(None)
+        return key, path
+
+    def _download(self, href: str, path: Path) -> None:
+        logger.info(f"Mirroring {href} to {path}")
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        ) as f:
+            temporary_path = Path(f.name)
+            try:
+                with urllib.request.urlopen(href, timeout=self.timeout) as response:
+                    shutil.copyfileobj(response, f)
+            except BaseException:
+                f.close()
+                temporary_path.unlink(missing_ok=True)
+                raise
+        _ = temporary_path.replace(path)
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+            self._evict()
+
+    def _get_key(self, href: str) -> str:
+        version = self._versions.get(href)
+        if version is None:
+            raise OSError(f"Could not get the version of {href}")
+        return hashlib.sha256(f"{href}\n{version}".encode()).hexdigest()
+
+    def _evict(self) -> None:
+        # Never evict the most recent entry, even if it's over budget by itself.
+        # Copies in use are skipped too, so we may stay over budget until
+        # they're released.
+        total = sum(self._entries.values())
+        for key in list(self._entries)[:-1]:
+            if total <= self.max_bytes:
+                break
+            if self._pins[key]:
+                continue
+            size = self._entries.pop(key)
+            (self.directory / (key + SUFFIX)).unlink(missing_ok=True)
+            total -= size
+            self.stats.evictions += 1
+            logger.info(f"Evicted {key} from the mirror")
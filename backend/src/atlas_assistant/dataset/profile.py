@@ -0,0 +1,176 @@
+"""Column statistics for datasets, computed at ingest time.
+
+Only some STAC items list the values of their categorical columns, and without
+them the model has to guess. `scripts/embed_stac.py` profiles every dataset
+and stores the statistics in a small sidecar file, which `get_prompt` merges
+into the SQL prompt.
+"""
+
+from __future__ import annotations
+
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from . import Dataset
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+# Columns with at most this many distinct values have them listed
+MAX_VALUES = 25
+
+# Columns estimated to have at most this many distinct values have them
+# collected, with room for the estimate to be low
+MAX_APPROX_VALUES = 2 * MAX_VALUES
+
+# Types that can't be usefully summarized by a min and max
+NESTED_TYPE = re.compile(r"^(STRUCT|MAP|UNION)\b|\]$")
+
+
+class ColumnProfile(BaseModel):
+    """Statistics for a single column"""
+
+    name: str
+    """The column name"""
+
+    min: str | None
+    """The smallest value, as a string"""
+
+    max: str | None
+    """The largest value, as a string"""
+
+    null_fraction: float
+    """The fraction of rows where the column is null"""
+
+    approx_unique: int
+    """The approximate number of distinct values"""
+
+    values: list[str] | None = None
+    """The distinct values, if there are few enough of them"""
+
+
+class DatasetProfile(BaseModel):
+    """Statistics for all of a dataset's columns"""
+
+    item_id: str
+    """The id of the dataset's item"""
+
+    asset_key: str
+    """The key of the dataset's asset"""
+
+    row_count: int
+    """The number of rows in the dataset"""
+
+    columns: list[ColumnProfile]
+    """The statistics for each column"""
+
+    def get_column(self, name: str) -> ColumnProfile | None:
+        """Returns the statistics for the named column, if we have them."""
+        return next((column for column in self.columns if column.name == name), None)
+
+
+class ProfileStore:
+    """Dataset profiles, stored as JSON files in a directory."""
+
+    def __init__(self, directory: Path) -> None:
+        self.directory: Path = directory
+
+    def read(self, item_id: str, asset_key: str) -> DatasetProfile | None:
+        """Returns the profile for a dataset, or None if it hasn't been
+        profiled."""
+        path = get_sidecar_path(self.directory, item_id, asset_key)
+        if not path.exists():
+            return None
+        return DatasetProfile.model_validate_json(path.read_text())
+
+    def write(self, profile: DatasetProfile) -> None:
+        """Writes a profile to the store's directory."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = get_sidecar_path(self.directory, profile.item_id, profile.asset_key)
+        _ = path.write_text(profile.model_dump_json(exclude_none=True))
+
+
+def profile_dataset(
+    dataset: Dataset, connection: DuckDBPyConnection | None = None
+) -> DatasetProfile:
+    """Profiles each column of the dataset.
+
+    The schema comes from the parquet footer, and the statistics are
+    computed in a single scan of the file. The distinct values of text columns
+    are collected in a second scan, only for the columns estimated to have few
+    of them, so memory stays bounded however many the others have.
+    """
+    import duckdb
+
+    sql = (connection or duckdb).sql
+    source = f"'{dataset.asset.href}'"
+    schema = sql(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    columns = [
+        (str(name), str(type_))
+        for name, type_, *_ in schema
+        if not NESTED_TYPE.search(str(type_))
+    ]
+
+    expressions = ["COUNT(*)"]
+    for name, _ in columns:
+        quoted = _quote(name)
+        expressions += [
+            f"COUNT({quoted})",
+            f"approx_count_distinct({quoted})",
+            f"MIN({quoted})::VARCHAR",
+            f"MAX({quoted})::VARCHAR",
+        ]
+    row = sql(f"SELECT {', '.join(expressions)} FROM {source}").fetchone()
+    assert row
+
+    value_expressions: dict[str, str] = {}
+    for i, (name, type_) in enumerate(columns):
+        if type_ == "VARCHAR" and row[2 + 4 * i] <= MAX_APPROX_VALUES:
+            quoted = _quote(name)
+            # Keep one more than we'll list, so we know if there are too many
+            value_expressions[name] = (
+                f"list_slice(list(DISTINCT {quoted} ORDER BY {quoted}) "
+                f"FILTER (WHERE {quoted} IS NOT NULL), 1, {MAX_VALUES + 1})"
+            )
+    values_by_name: dict[str, list[str] | None] = {}
+    if value_expressions:
+        values_row = sql(
+            f"SELECT {', '.join(value_expressions.values())} FROM {source}"
+        ).fetchone()
+        assert values_row
+        values_by_name = dict(zip(value_expressions, values_row, strict=True))
+
+    row_count = int(row[0])
+    column_profiles = []
+    for i, (name, _) in enumerate(columns):
+        count, approx_unique, min_, max_ = row[1 + 4 * i : 5 + 4 * i]
+        values = values_by_name.get(name)
+        column_profiles.append(
+            ColumnProfile(
+                name=name,
+                min=min_,
+                max=max_,
+                null_fraction=1 - count / row_count if row_count else 0.0,
+                approx_unique=approx_unique,
+                values=values if values and len(values) <= MAX_VALUES else None,
+            )
+        )
+    return DatasetProfile(
+        item_id=dataset.item.id,
+        asset_key=dataset.asset_key,
+        row_count=row_count,
+        columns=column_profiles,
+    )
+
+
+def get_sidecar_path(directory: Path, item_id: str, asset_key: str) -> Path:
+    """Returns the path of a dataset's JSON sidecar file in a directory."""
+    name = re.sub(r"[^\w.-]", "_", f"{item_id}.{asset_key}")
+    return directory / (name + ".json")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,384 @@
+"""Pre-aggregated rollups of datasets, and routing of queries to them.
+
+Most questions are totals by country, by crop, or by admin1 region, and each
+of them would otherwise scan the full-resolution parquet file. At ingest time,
+`scripts/embed_stac.py` aggregates each dataset away from its finest
+geographic levels into small parquet files. Aggregate queries that only need
+the coarser levels are rewritten to read the smallest rollup that can answer
+them.
+
+A rollup keeps every other column as a dimension, so filters on scenario,
+hazard, etc. still work. For each measure column it stores the sum, minimum,
+maximum, and count of non-NaN values, so a rollup only answers queries that
+filter out NaNs, as our SQL prompt asks the model to.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import re
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pyarrow as pa
+from pydantic import BaseModel
+
+from ..database import (
+    get_identifiers,
+    quote_identifier,
+    split_conjuncts,
+    unquote_identifier,
+)
+from . import Dataset
+from .profile import get_sidecar_path
+from .version import VersionCache
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+    from ..tools.sql import SqlQueryParts
+
+logger = logging.getLogger(__name__)
+
+# Each level drops the geographic columns finer than itself
+LEVELS = {
+    "admin1": ["admin2_name", "gaul2_code"],
+    "admin0": ["admin2_name", "gaul2_code", "admin1_name", "gaul1_code"],
+}
+
+# Numeric columns that are identifiers rather than measures
+IDENTIFIER = re.compile(r"_code$")
+
+NUMERIC_TYPES = ("DOUBLE", "FLOAT", "DECIMAL", "INTEGER", "BIGINT", "HUGEINT")
+
+# A rollup isn't worth keeping unless it's at most this fraction of the rows
+MAX_ROW_FRACTION = 0.5
+
+# The count of rows that went into each rollup row
+ROWS = "__rows"
+
+AGGREGATE = re.compile(
+    r"\b(sum|min|max|avg|count)\s*\(\s*(distinct\s+)?([^()]*?)\s*\)", re.IGNORECASE
+)
+COUNT_ROWS = re.compile(r"^(\*|1)$")
+ALIAS = re.compile(r'\bas\s+("(?:[^"]|"")*"|\w+)', re.IGNORECASE)
+
+
+class Rollup(BaseModel):
+    """A single rollup of a dataset"""
+
+    level: str
+    """The geographic level the dataset was aggregated to"""
+
+    dimensions: list[str]
+    """The columns the rollup is grouped by"""
+
+    measures: list[str]
+    """The columns that were aggregated"""
+
+    float_measures: list[str]
+    """The measures that may be NaN"""
+
+    dropped: list[str]
+    """The columns that were aggregated away"""
+
+    row_count: int
+    """The number of rows in the rollup"""
+
+
+class RollupSet(BaseModel):
+    """All of the rollups of a dataset"""
+
+    item_id: str
+    """The id of the dataset's item"""
+
+    asset_key: str
+    """The key of the dataset's asset"""
+
+    version: str | None
+    """The version of the dataset's asset when the rollups were built"""
+
+    rollups: list[Rollup]
+    """The rollups, smallest first"""
+
+
+class RollupStore:
+    """Dataset rollups, stored as parquet files in a directory alongside a
+    JSON manifest for each dataset."""
+
+    def __init__(self, directory: Path, versions: VersionCache | None = None) -> None:
+        self.directory: Path = directory
+        self._versions: VersionCache = versions or VersionCache()
+        self._lock: threading.Lock = threading.Lock()
+        self._rollup_sets: dict[tuple[str, str], RollupSet | None] = {}
+
+    def build(
+        self,
+        dataset: Dataset,
+        version: str | None,
+        connection: DuckDBPyConnection | None = None,
+    ) -> RollupSet:
+        """Builds and writes every rollup that's meaningfully smaller than
+        the dataset."""
+        import duckdb
+
+        sql = (connection or duckdb).sql
+        source = f"'{dataset.asset.href}'"
+        schema = [
+            (str(name), str(type_))
+            for name, type_, *_ in sql(f"DESCRIBE SELECT * FROM {source}").fetchall()
+        ]
+        columns = [name for name, _ in schema]
+        measures = [
+            name
+            for name, type_ in schema
+            if type_.startswith(NUMERIC_TYPES) and not IDENTIFIER.search(name)
+        ]
+        float_measures = [
+            name
+            for name, type_ in schema
+            if name in measures and type_ in ("DOUBLE", "FLOAT")
+        ]
+        result = sql(f"SELECT COUNT(*) FROM {source}").fetchone()
+        assert result
+        base_row_count = int(result[0])
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        rollups: list[Rollup] = []
+        for level, finer in LEVELS.items():
+            dropped = [name for name in finer if name in columns]
+            if not dropped or not measures:
+                continue
+            dimensions = [
+                name for name in columns if name not in dropped and name not in measures
+            ]
+            aggregates = [f"COUNT(*) AS {quote_identifier(ROWS)}"]
+            for measure in measures:
+                column = quote_identifier(measure)
+                filter_ = (
+                    f" FILTER (WHERE NOT isnan({column}))"
+                    if measure in float_measures
+                    else f" FILTER (WHERE {column} IS NOT NULL)"
+                )
+                aggregates += [
+                    f"{function}({column}){filter_} AS "
+                    + quote_identifier(_stored(measure, function.lower()))
+                    for function in ("SUM", "MIN", "MAX", "COUNT")
+                ]
+            path = self._get_path(dataset, level)
+            select = ", ".join(
+                [quote_identifier(name) for name in dimensions] + aggregates
+            )
+            group_by = ", ".join(quote_identifier(name) for name in dimensions)
+            _ = sql(
+                f"COPY (SELECT {select} FROM {source} GROUP BY {group_by}) "
+                f"TO '{path}' (FORMAT parquet)"
+            )
+            result = sql(f"SELECT COUNT(*) FROM '{path}'").fetchone()
+            assert result
+            row_count = int(result[0])
+            if row_count > base_row_count * MAX_ROW_FRACTION:
+                path.unlink()
+                continue
+            rollups.append(
+                Rollup(
+                    level=level,
+                    dimensions=dimensions,
+                    measures=measures,
+                    float_measures=float_measures,
+                    dropped=dropped,
+                    row_count=row_count,
+                )
+            )
+
+        rollup_set = RollupSet(
+            item_id=dataset.item.id,
+            asset_key=dataset.asset_key,
+            version=version,
+            rollups=sorted(rollups, key=lambda rollup: rollup.row_count),
+        )
+        path = get_sidecar_path(self.directory, dataset.item.id, dataset.asset_key)
+        _ = path.write_text(rollup_set.model_dump_json())
+        with self._lock:
+            self._rollup_sets[(dataset.item.id, dataset.asset_key)] = rollup_set
+        return rollup_set
+
+    def route(self, dataset: Dataset, sql_query_parts: SqlQueryParts) -> str | None:
+        """Returns the query rewritten against the smallest rollup that can
+        answer it, or None if no rollup can."""
+        rollup_set = self._read(dataset)
+        if not rollup_set or not rollup_set.rollups:
+            return None
+        # A stale rollup would silently return old numbers
+        version = self._versions.get(dataset.asset.href)
+        if version is None or version != rollup_set.version:
+            return None
+        for rollup in rollup_set.rollups:
+            if rewritten := rewrite(sql_query_parts, rollup):
+                path = self._get_path(dataset, rollup.level)
+                logger.info(f"Routing query to the {rollup.level} rollup at {path}")
+                return rewritten.get_query(str(path)).query
+        return None
+
+    def _read(self, dataset: Dataset) -> RollupSet | None:
+        key = (dataset.item.id, dataset.asset_key)
+        with self._lock:
+            if key in self._rollup_sets:
+                return self._rollup_sets[key]
+        path = get_sidecar_path(self.directory, *key)
+        rollup_set = (
+            RollupSet.model_validate_json(path.read_text()) if path.exists() else None
+        )
+        with self._lock:
+            self._rollup_sets[key] = rollup_set
+        return rollup_set
+
+    def _get_path(self, dataset: Dataset, level: str) -> Path:
+        path = get_sidecar_path(self.directory, dataset.item.id, dataset.asset_key)
+        return path.with_suffix(f".{level}.parquet")
+
+
+def rewrite(sql_query_parts: SqlQueryParts, rollup: Rollup) -> SqlQueryParts | None:
+    """Rewrites the query parts to read from the rollup, or returns None if
+    the rollup can't give the same result.
+
+    Only grouped queries are eligible, since ungrouped rows would be
+    collapsed. Measures may only be used in `SUM`, `MIN`, `MAX`, `AVG`, or
+    `COUNT`, and NaN measures must be filtered out with a top-level
+    `NOT isnan(...)` in the where clause.
+    """
+    if not sql_query_parts.group_by:
+        return None
+
+    # A NaN filter drops whole rows, so the rollup can only stand in for it if
+    # just that measure is used, counting its non-NaN values as the rows
+    where = sql_query_parts.where
+    guarded = None
+    for measure in rollup.float_measures:
+        conjuncts = split_conjuncts(where)
+        guards = [c for c in conjuncts if _is_nan_guard(c, measure)]
+        if guards:
+            if guarded:
+                return None
+            guarded = measure
+            where = " AND ".join(c for c in conjuncts if c not in guards) or "true"
+        elif _mentions(sql_query_parts, measure):
+            return None
+    if guarded:
+        if any(
+            _mentions(sql_query_parts, measure)
+            for measure in rollup.measures
+            if measure != guarded
+        ):
+            return None
+        rows = _stored(guarded, "count")
+        where = f"({where}) AND {quote_identifier(rows)} > 0"
+    else:
+        rows = ROWS
+
+    ineligible = False
+
+    def rewrite_aggregate(match: re.Match[str]) -> str:
+        nonlocal ineligible
+        function, distinct, argument = match.groups()
+        function = function.lower()
+        column = unquote_identifier(argument)
+        if function == "count" and not distinct and COUNT_ROWS.match(argument):
+            return f"SUM({quote_identifier(rows)})"
+        if column in rollup.measures and not distinct:
+            if function == "avg":
+                return (
+                    f"(SUM({quote_identifier(_stored(column, 'sum'))}) / "
+                    f"SUM({quote_identifier(_stored(column, 'count'))}))"
+                )
+            stored = quote_identifier(_stored(column, function))
+            return f"SUM({stored})" if function == "count" else f"{function}({stored})"
+        if column in rollup.dimensions and (distinct or function in ("min", "max")):
+            return match.group(0)
+        # Anything else, e.g. summing an expression or counting a dimension,
+        # depends on the number of rows
+        ineligible = True
+        return match.group(0)
+
+    parts = {
+        "select": sql_query_parts.select,
+        "where": where,
+        "group_by": sql_query_parts.group_by,
+        "order_by": sql_query_parts.order_by,
+    }
+    rewritten = {
+        name: AGGREGATE.sub(rewrite_aggregate, value) if value else value
+        for name, value in parts.items()
+    }
+    if ineligible:
+        return None
+
+    # Whatever's left must only reference the rollup's dimensions, its stored
+    # aggregates, and the select's aliases
+    unavailable = set(rollup.dropped) | set(rollup.measures)
+    aliases = {
+        unquote_identifier(alias) for alias in ALIAS.findall(sql_query_parts.select)
+    }
+    for name, value in rewritten.items():
+        if not value:
+            continue
+        identifiers = get_identifiers(ALIAS.sub("", value))
+        if name != "where":
+            identifiers -= aliases
+        if identifiers & unavailable:
+            return None
+    return sql_query_parts.model_copy(update=rewritten)
+
+
+def results_match(rollup_table: pa.Table, base_table: pa.Table, ordered: bool) -> bool:
+    """Returns whether a rollup's result matches the base table's, allowing
+    for floating point differences from summing in a different order."""
+    if rollup_table.column_names != base_table.column_names:
+        return False
+    rollup_rows = [tuple(row.values()) for row in rollup_table.to_pylist()]
+    base_rows = [tuple(row.values()) for row in base_table.to_pylist()]
+    if not ordered:
+        rollup_rows.sort(key=repr)
+        base_rows.sort(key=repr)
+    return len(rollup_rows) == len(base_rows) and all(
+        _values_match(a, b)
+        for rollup_row, base_row in zip(rollup_rows, base_rows, strict=True)
+        for a, b in zip(rollup_row, base_row, strict=True)
+    )
+
+
+def _values_match(a: object, b: object) -> bool:
+    if isinstance(a, float) and isinstance(b, float):
+        return math.isclose(a, b, rel_tol=1e-9) or (math.isnan(a) and math.isnan(b))
+    return a == b
+
+
+def _stored(measure: str, function: str) -> str:
+    return f"__{function}_{measure}"
+
+
+def _mentions(sql_query_parts: SqlQueryParts, column: str) -> bool:
+    return any(
+        column in get_identifiers(value)
+        for value in (
+            sql_query_parts.select,
+            sql_query_parts.where,
+            sql_query_parts.group_by,
+            sql_query_parts.order_by,
+        )
+        if value
+    )
+
+
+def _is_nan_guard(conjunct: str, measure: str) -> bool:
+    column = rf'(?:{re.escape(measure)}|"{re.escape(measure)}")'
+    return bool(
+        re.fullmatch(
+            rf"\(?\s*not\s+isnan\s*\(\s*{column}\s*\)\s*\)?"
+            rf"|\(?\s*isnan\s*\(\s*{column}\s*\)\s*=\s*false\s*\)?",
+            conjunct.strip(),
+            re.IGNORECASE,
+        )
+    )
@@ -0,0 +1,320 @@
+"""Approximate answers to aggregate queries, from samples of datasets.
+
+Exploratory questions, like roughly how much maize is exposed across a region,
+don't need an exact scan of the whole dataset. In approximate mode, an
+aggregate query is rewritten to weigh each sampled row by the number of rows
+it stands for, and is run over a sample instead of the dataset.
+
+At ingest time, `scripts/embed_stac.py` writes a sample of each dataset,
+stratified by country so that small countries aren't left out. Datasets
+without a current sample are sampled on the fly, which still reads the whole
+file but aggregates far fewer rows.
+
+Each sampled row is also assigned to one of a few random replicates. The query
+is run once more per replicate, and the spread of the replicates' estimates
+gives a margin of error for each aggregate, without any knowledge of what the
+query computes.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import statistics
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Self
+
+import pyarrow as pa
+from pydantic import BaseModel
+
+from ..database import quote_identifier, split_items
+from . import Dataset
+from .profile import get_sidecar_path
+from .rollup import AGGREGATE, COUNT_ROWS
+from .version import VersionCache
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+    from ..tools.sql import SqlQueryParts
+
+# The number of rows each sampled row stands for
+WEIGHT = "__weight"
+
+# The random replicate each sampled row belongs to
+REPLICATE = "__replicate"
+
+REPLICATES = 10
+
+# The 97.5th percentile of Student's t distribution with `REPLICATES - 1`
+# degrees of freedom, for 95% margins of error
+T_VALUE = 2.262
+
+# Countries with few rows are sampled more heavily, up to all of their rows
+STRATIFY_BY = "iso3"
+MIN_STRATUM_ROWS = 100
+
+# Aggregates that can't be estimated from a sample
+OTHER_AGGREGATE = re.compile(
+    r"\b(min|max|median|mode|quantile\w*|stddev\w*|var_\w+|variance|first|last|"
+    r"any_value|arg_\w+|list|string_agg|approx_\w+|bit_\w+|bool_\w+|product)"
+    r"\s*\(",
+    re.IGNORECASE,
+)
+
+
+class Sample(BaseModel):
+    """A sample of a dataset, written at ingest"""
+
+    item_id: str
+    """The id of the dataset's item"""
+
+    asset_key: str
+    """The key of the dataset's asset"""
+
+    version: str | None
+    """The version of the dataset's asset when it was sampled"""
+
+    fraction: float
+    """The fraction of each country's rows that were sampled, at least"""
+
+    row_count: int
+    """The number of rows in the sample"""
+
+
+class SampleStore:
+    """Dataset samples, stored as parquet files in a directory alongside a
+    JSON manifest for each dataset."""
+
+    def __init__(self, directory: Path, versions: VersionCache | None = None) -> None:
+        self.directory: Path = directory
+        self._versions: VersionCache = versions or VersionCache()
+        self._lock: threading.Lock = threading.Lock()
+        self._samples: dict[tuple[str, str], Sample | None] = {}
+
+    def build(
+        self,
+        dataset: Dataset,
+        version: str | None,
+        fraction: float,
+        connection: DuckDBPyConnection | None = None,
+    ) -> Sample:
+        """Samples the dataset, writing the sample and its manifest to the
+        store's directory."""
+        import duckdb
+
+        sql = (connection or duckdb).sql
+        source = f"'{dataset.asset.href}'"
+        columns = {
+            str(name) for name, *_ in sql(f"DESCRIBE SELECT * FROM {source}").fetchall()
+        }
+        partition = (
+            f"PARTITION BY {quote_identifier(STRATIFY_BY)}"
+            if STRATIFY_BY in columns
+            else ""
+        )
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._get_path(dataset)
+        _ = sql(
+            f"""COPY (
+                SELECT
+                    * EXCLUDE (__fraction),
+                    1 / __fraction AS {WEIGHT},
+                    floor(random() * {REPLICATES})::INTEGER AS {REPLICATE}
+                FROM (
+                    SELECT
+                        *,
+                        greatest(
+                            {fraction},
+                            least(1.0, {MIN_STRATUM_ROWS} / COUNT(*) OVER ({partition}))
+                        ) AS __fraction
+                    FROM {source}
+                )
+                WHERE random() < __fraction
+            ) TO '{path}' (FORMAT parquet)"""
+        )
+        row = sql(f"SELECT COUNT(*) FROM '{path}'").fetchone()
+        assert row
+        sample = Sample(
+            item_id=dataset.item.id,
+            asset_key=dataset.asset_key,
+            version=version,
+            fraction=fraction,
+            row_count=row[0],
+        )
+        manifest = get_sidecar_path(self.directory, dataset.item.id, dataset.asset_key)
+        _ = manifest.write_text(sample.model_dump_json())
+        with self._lock:
+            self._samples[(dataset.item.id, dataset.asset_key)] = sample
+        return sample
+
+    def get(self, dataset: Dataset) -> tuple[Path, Sample] | None:
+        """Returns the path and manifest of the dataset's sample, or None if
+        it hasn't been sampled since it last changed."""
+        key = (dataset.item.id, dataset.asset_key)
+        with self._lock:
+            cached = key in self._samples
+            sample = self._samples.get(key)
+        if not cached:
+            manifest = get_sidecar_path(self.directory, *key)
+            if manifest.exists():
+                sample = Sample.model_validate_json(manifest.read_text())
+            with self._lock:
+                self._samples[key] = sample
+        if sample is None:
+            return None
+        # A stale sample would estimate old numbers
+        version = self._versions.get(dataset.asset.href)
+        if version is None or version != sample.version:
+            return None
+        return self._get_path(dataset), sample
+
+    def _get_path(self, dataset: Dataset) -> Path:
+        path = get_sidecar_path(self.directory, dataset.item.id, dataset.asset_key)
+        return path.with_suffix(".sample.parquet")
+
+
+def sample_relation(relation: str, fraction: float) -> str:
+    """Returns a relation that samples another one on the fly, with the
+    weights and replicates that approximations need."""
+    return (
+        f"(SELECT *, {1 / fraction}::DOUBLE AS {WEIGHT}, "
+        f"floor(random() * {REPLICATES})::INTEGER AS {REPLICATE} "
+        f"FROM {relation} USING SAMPLE {fraction * 100}% (bernoulli))"
+    )
+
+
+class Approximation:
+    """An aggregate query, rewritten to be estimated from a sample."""
+
+    def __init__(
+        self,
+        estimate: SqlQueryParts,
+        replicates: SqlQueryParts,
+        measures: list[bool],
+        additive: list[bool],
+    ) -> None:
+        self.estimate: SqlQueryParts = estimate
+        self.replicates: SqlQueryParts = replicates
+        self.measures: list[bool] = measures
+        self.additive: list[bool] = additive
+
+    @classmethod
+    def from_query_parts(cls, sql_query_parts: SqlQueryParts) -> Self | None:
+        """Rewrites the query parts, or returns None if their result can't be
+        estimated.
+
+        Only queries whose aggregates are all `SUM`, `COUNT`, or `AVG` of
+        non-distinct values are eligible. Other aggregates, like `MIN` and
+        `MAX`, and row-level results depend on rows that may not have been
+        sampled.
+        """
+        items = split_items(sql_query_parts.select)
+        measures = [bool(AGGREGATE.search(item)) for item in items]
+        if not any(measures) or any(
+            re.fullmatch(r"(\w+\.)?\*|columns\s*\(.*", item, re.IGNORECASE | re.DOTALL)
+            for item in items
+        ):
+            return None
+        parts = [
+            sql_query_parts.select,
+            sql_query_parts.where,
+            sql_query_parts.group_by or "",
+            sql_query_parts.order_by or "",
+        ]
+        if any(OTHER_AGGREGATE.search(AGGREGATE.sub("", part)) for part in parts):
+            return None
+        if any(
+            distinct or function.lower() in ("min", "max")
+            for part in parts
+            for function, distinct, _ in AGGREGATE.findall(part)
+        ):
+            return None
+
+        replicates = sql_query_parts.model_copy(
+            update={
+                "select": f"{REPLICATE}, {_weigh(sql_query_parts.select, REPLICATES)}",
+                "group_by": ", ".join(
+                    filter(None, [REPLICATE, sql_query_parts.group_by])
+                ),
+                "order_by": None,
+                "limit": None,
+            }
+        )
+        estimate = sql_query_parts.model_copy(
+            update={
+                "select": _weigh(sql_query_parts.select, 1),
+                "order_by": sql_query_parts.order_by
+                and _weigh(sql_query_parts.order_by, 1),
+            }
+        )
+        additive = [
+            measure
+            and all(
+                function.lower() in ("sum", "count")
+                for function, _, _ in AGGREGATE.findall(item)
+            )
+            for item, measure in zip(items, measures, strict=True)
+        ]
+        return cls(estimate, replicates, measures, additive)
+
+    def add_margins(self, table: pa.Table, replicates: pa.Table) -> pa.Table:
+        """Adds a 95% margin of error after each estimated column of the
+        table, from the estimates of each replicate."""
+        if table.num_columns != len(self.measures):
+            raise ValueError("The query's columns don't match its select")
+        keys = [i for i, measure in enumerate(self.measures) if not measure]
+        rows = table.to_pylist()
+        by_key: dict[tuple[object, ...], list[list[object]]] = {}
+        for row in replicates.to_pylist():
+            values = list(row.values())[1:]
+            key = tuple(values[i] for i in keys)
+            by_key.setdefault(key, []).append(values)
+
+        columns: list[pa.Array] = []
+        names: list[str] = []
+        for i, name in enumerate(table.column_names):
+            columns.append(table.column(i))
+            names.append(name)
+            if not self.measures[i]:
+                continue
+            margins: list[float | None] = []
+            for row in rows:
+                values = list(row.values())
+                estimates = [
+                    float(value)
+                    for replicate in by_key.get(tuple(values[j] for j in keys), [])
+                    if isinstance(value := replicate[i], int | float)
+                ]
+                if self.additive[i]:
+                    # A replicate without any of the group's rows estimates 0
+                    estimates += [0.0] * (REPLICATES - len(estimates))
+                margins.append(
+                    T_VALUE * statistics.stdev(estimates) / math.sqrt(REPLICATES)
+                    if len(estimates) > 1
+                    else None
+                )
+            columns.append(pa.array(margins, pa.float64()))
+            names.append(f"{name}_margin")
+        return pa.Table.from_arrays(columns, names=names)
+
+
+def _weigh(sql: str, scale: int) -> str:
+    # Replicates hold a tenth of the sample each, so their rows weigh more
+    weight = WEIGHT if scale == 1 else f"({WEIGHT} * {scale})"
+
+    def weigh(match: re.Match[str]) -> str:
+        function, _, argument = match.groups()
+        function = function.lower()
+        if function == "count" and COUNT_ROWS.match(argument):
+            return f"SUM({weight})"
+        weighted_count = f"SUM(CASE WHEN ({argument}) IS NOT NULL THEN {weight} END)"
+        if function == "count":
+            return f"COALESCE({weighted_count}, 0)"
+        weighted_sum = f"SUM(({argument}) * {weight})"
+        if function == "avg":
+            return f"({weighted_sum} / {weighted_count})"
+        return weighted_sum
+
+    return AGGREGATE.sub(weigh, sql)
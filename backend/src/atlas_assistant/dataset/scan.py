@@ -0,0 +1,288 @@
+"""Estimates of how much of a parquet file a query will read.
+
+A parquet footer lists each row group's size per column and the min and max
+of each column in it. That's enough to tell which row groups a simple where
+clause, like `iso3 = 'KEN'`, can skip and which columns are read at all,
+without reading any data.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from ..cache import LruCache
+from ..database import STRING, get_identifiers, split_conjuncts, unquote_identifier
+from .version import VersionCache
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+    from ..tools.sql import SqlQueryParts
+
+NUMERIC_TYPES = {"INT32", "INT64", "FLOAT", "DOUBLE"}
+
+COLUMN = r'("(?:[^"]|"")*"|[A-Za-z_]\w*)'
+LITERAL = r"('(?:[^']|'')*'|-?\d+(?:\.\d+)?)"
+COMPARISON = re.compile(rf"^{COLUMN}\s*(=|<=|>=|<|>)\s*{LITERAL}$")
+IN_LIST = re.compile(rf"^{COLUMN}\s+IN\s*\(([^()]*)\)$", re.IGNORECASE)
+LITERALS = re.compile(rf"^\s*{LITERAL}\s*(,\s*{LITERAL}\s*)*$")
+HIVE_PARTITION = re.compile(r"([^/\\=]+)=([^/\\]*)[/\\]")
+
+
+@dataclass
+class RowGroup:
+    """A row group's size and statistics, from the footer"""
+
+    num_rows: int
+    """The number of rows in the row group"""
+
+    sizes: dict[str, int] = field(default_factory=dict)
+    """The compressed size of each column, in bytes"""
+
+    bounds: dict[str, tuple[str | float, str | float]] = field(default_factory=dict)
+    """The min and max of each column that has statistics"""
+
+
+class ScanEstimate(BaseModel):
+    """How much of a parquet file a query is expected to read"""
+
+    bytes: int
+    """The compressed bytes of the columns read, in row groups that can't be
+    skipped"""
+
+    row_groups: int
+    """The number of row groups that can't be skipped"""
+
+    total_bytes: int
+    """The compressed bytes of every column in every row group"""
+
+    total_row_groups: int
+    """The number of row groups in the file"""
+
+    bytes_read: int | None = None
+    """The bytes DuckDB reported reading when the query ran, if it did"""
+
+
+class Footer:
+    """The row groups of a parquet file."""
+
+    def __init__(self, row_groups: list[RowGroup]) -> None:
+        self.row_groups: list[RowGroup] = row_groups
+
+    @classmethod
+    def read(
+        cls,
+        source: str,
+        connection: DuckDBPyConnection | None = None,
+        hive_partitioning: bool = False,
+    ) -> Footer:
+        """Reads the footer of the parquet file at the source.
+
+        If `hive_partitioning` is set, the source is a partitioned layout, and
+        the `key=value` directories in its file names bound its row groups.
+        """
+        import duckdb
+
+        rows = (
+            (connection or duckdb)
+            .sql(
+                "SELECT file_name, row_group_id, row_group_num_rows, path_in_schema, "
+                "type, total_compressed_size, stats_min_value, stats_max_value "
+                f"FROM parquet_metadata('{source}') ORDER BY file_name, row_group_id"
+            )
+            .fetchall()
+        )
+        row_groups: dict[tuple[str, int], RowGroup] = {}
+        for file_name, id_, num_rows, column, type_, size, min_, max_ in rows:
+            row_group = row_groups.get((file_name, id_))
+            if row_group is None:
+                row_group = row_groups[(file_name, id_)] = RowGroup(num_rows=num_rows)
+                # Hive partition values are in the path rather than the file
+                partitions = (
+                    HIVE_PARTITION.findall(file_name) if hive_partitioning else []
+                )
+                for key, value in partitions:
+                    if value != "NULL":
+                        row_group.bounds[key.lower()] = (value, value)
+            column = str(column).lower()
+            row_group.sizes[column] = int(size)
+            if min_ is None or max_ is None:
+                continue
+            if type_ in NUMERIC_TYPES:
+                try:
+                    row_group.bounds[column] = (float(min_), float(max_))
+                except ValueError:
+                    # e.g. dates, which are stored as integers
+                    continue
+            elif type_ == "BYTE_ARRAY":
+                row_group.bounds[column] = (str(min_), str(max_))
+        return cls(list(row_groups.values()))
+
+    def estimate(self, sql_query_parts: SqlQueryParts) -> ScanEstimate:
+        """Estimates how much of the file the query will read.
+
+        Only simple comparisons against literals that are top-level `AND`s of
+        the where clause are used to skip row groups. Anything else is assumed
+        to match every row group.
+        """
+        columns = {name for row_group in self.row_groups for name in row_group.sizes}
+        parts = [
+            sql_query_parts.select,
+            sql_query_parts.where,
+            sql_query_parts.group_by or "",
+            sql_query_parts.order_by or "",
+        ]
+        if re.search(r"(^|,)\s*\*", sql_query_parts.select):
+            read = columns
+        else:
+            read = {name.lower() for part in parts for name in get_identifiers(part)}
+            read &= columns
+
+        predicates = [
+            predicate
+            for conjunct in split_conjuncts(sql_query_parts.where)
+            if (predicate := parse_predicate(conjunct))
+        ]
+        touched = [
+            row_group
+            for row_group in self.row_groups
+            if all(predicate.may_match(row_group) for predicate in predicates)
+        ]
+        return ScanEstimate(
+            bytes=sum(
+                size
+                for row_group in touched
+                for name, size in row_group.sizes.items()
+                if name in read
+            ),
+            row_groups=len(touched),
+            total_bytes=sum(
+                sum(row_group.sizes.values()) for row_group in self.row_groups
+            ),
+            total_row_groups=len(self.row_groups),
+        )
+
+
+@dataclass
+class Predicate:
+    """A comparison of a column against one or more literals"""
+
+    column: str
+    """The column, in lower case"""
+
+    operator: str
+    """One of `=`, `<`, `<=`, `>`, `>=`, or `in`"""
+
+    values: list[str | float]
+    """The literals"""
+
+    def may_match(self, row_group: RowGroup) -> bool:
+        """Returns whether any row in the row group may match."""
+        bounds = row_group.bounds.get(self.column)
+        if bounds is None:
+            return True
+        low, high = bounds
+        for value in self.values:
+            from_low = _compare(value, low)
+            from_high = _compare(value, high)
+            if from_low is None or from_high is None:
+                # e.g. a string compared to a number column
+                return True
+            match self.operator:
+                case "=" | "in":
+                    matches = from_low >= 0 and from_high <= 0
+                case "<":
+                    matches = from_low > 0
+                case "<=":
+                    matches = from_low >= 0
+                case ">":
+                    matches = from_high < 0
+                case ">=":
+                    matches = from_high <= 0
+                case _:
+                    matches = True
+            if matches:
+                return True
+        return False
+
+
+def parse_predicate(conjunct: str) -> Predicate | None:
+    """Parses a simple comparison, or returns None if it's anything else."""
+    conjunct = conjunct.strip()
+    while _is_wrapped(conjunct):
+        conjunct = conjunct[1:-1].strip()
+    if match := COMPARISON.match(conjunct):
+        column, operator, literal = match.groups()
+        return Predicate(
+            unquote_identifier(column).lower(), operator, [_parse_literal(literal)]
+        )
+    if match := IN_LIST.match(conjunct):
+        column, literals = match.groups()
+        if not LITERALS.match(literals):
+            return None
+        values = [_parse_literal(literal) for literal in re.findall(LITERAL, literals)]
+        return Predicate(unquote_identifier(column).lower(), "in", values)
+    return None
+
+
+def _is_wrapped(sql: str) -> bool:
+    # Whether the outer parentheses belong together, unlike in `(a) OR (b)`
+    if not (sql.startswith("(") and sql.endswith(")")):
+        return False
+    sql = STRING.sub("''", sql)
+    depth = 0
+    for i, character in enumerate(sql):
+        depth += {"(": 1, ")": -1}.get(character, 0)
+        if depth == 0 and i < len(sql) - 1:
+            return False
+    return True
+
+
+def _compare(a: str | float, b: str | float) -> int | None:
+    if isinstance(a, str) and isinstance(b, str):
+        return (a > b) - (a < b)
+    if isinstance(a, float) and isinstance(b, float):
+        return (a > b) - (a < b)
+    return None
+
+
+def _parse_literal(literal: str) -> str | float:
+    if literal.startswith("'"):
+        return literal[1:-1].replace("''", "'")
+    return float(literal)
+
+
+class FooterCache:
+    """Parquet footers, keyed by href, version, and source, so each is read
+    once."""
+
+    def __init__(
+        self, max_entries: int = 256, versions: VersionCache | None = None
+    ) -> None:
+        self._footers: LruCache[tuple[str, str | None, str | None], Footer] = LruCache(
+            max_entries
+        )
+        self._versions: VersionCache = versions or VersionCache()
+
+    def get(
+        self,
+        href: str,
+        source: str | None = None,
+        connection: DuckDBPyConnection | None = None,
+        hive_partitioning: bool = False,
+    ) -> Footer:
+        """Returns the footer of the parquet file at the href, reading it
+        from the source (e.g. a mirrored copy or a partitioned layout) if it
+        isn't cached."""
+        version = self._versions.get(href)
+
+        def read() -> Footer:
+            return Footer.read(source or href, connection, hive_partitioning)
+
+        if version is None:
+            return read()
+        return self._footers.get_or_create((href, version, source), read)
@@ -0,0 +1,51 @@
+"""Versions of remote dataset files, used to key caches of their contents."""
+
+from __future__ import annotations
+
+import logging
+import urllib.request
+
+from ..cache import LruCache
+
+logger = logging.getLogger(__name__)
+
+
+class VersionCache:
+    """Remembers the versions of hrefs for a while, so we don't make a request
+    for every lookup.
+
+    One of these is shared by every cache in a worker, so a dataset's version
+    is looked up once per `ttl` rather than once per cache.
+    """
+
+    def __init__(
+        self, ttl: float = 300.0, max_entries: int = 1024, timeout: float = 10.0
+    ) -> None:
+        self.timeout: float = timeout
+        self._versions: LruCache[str, str] = LruCache(max_entries, ttl=ttl)
+
+    def get(self, href: str) -> str | None:
+        """Returns the version of the href, or None if it can't be determined."""
+        if version := self._versions.get(href):
+            return version
+        try:
+            version = get_version(href, timeout=self.timeout)
+        except OSError as e:
+            logger.warning(f"Could not get the version of {href}: {e}")
+            return None
+        self._versions.put(href, version)
+        return version
+
+
+def get_version(href: str, timeout: float = 10.0) -> str:
+    """Returns a string that changes when the content at the href changes.
+
+    This is the ETag if there is one, otherwise the last-modified time and
+    content length.
+    """
+    request = urllib.request.Request(href, method="HEAD")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        headers = response.headers
+        if etag := headers.get("ETag"):
+            return etag
+        return f"{headers.get('Last-Modified')}:{headers.get('Content-Length')}"
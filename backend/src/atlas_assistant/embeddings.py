@@ -0,0 +1,303 @@
+"""A long-lived handle on the dataset embeddings, and a cache of the
+embeddings of search queries."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+from array import array
+from collections.abc import Callable
+from pathlib import Path
+from typing import Literal
+
+from chromadb.api.client import SharedSystemClient
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+from .cache import CacheStats, LruCache
+from .matrix import MATRIX_FILE, MatrixStore
+
+logger = logging.getLogger(__name__)
+
+# The file Chroma persists its collections to, inside the persist directory
+DATABASE_FILE = "chroma.sqlite3"
+
+# The vector stores that can be searched
+type Backend = Literal["chroma", "numpy"]
+
+
+class VectorStore:
+    """The embeddings database, opened once and shared between threads.
+
+    Opening the database and creating the embedding function's HTTP client
+    are both deferred until the first search. When `scripts/embed_stac.py`
+    replaces the embeddings directory, the next search reopens it.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        get_embedding_function: Callable[[], Embeddings],
+        backend: Backend = "chroma",
+    ) -> None:
+        self.directory: Path = directory
+        self.backend: Backend = backend
+        self._get_embedding_function: Callable[[], Embeddings] = get_embedding_function
+        self._embedding_function: Embeddings | None = None
+        self._lock: threading.Lock = threading.Lock()
+        self._store: Chroma | MatrixStore | None = None
+        self._stamp: tuple[int, int] | None = None
+
+    def get(self) -> Chroma | MatrixStore:
+        """Returns the embeddings database, reopening it if it's changed."""
+        with self._lock:
+            stamp = self._get_stamp()
+            if self._store is None or stamp != self._stamp:
+                self._open(stamp)
+            assert self._store
+            return self._store
+
+    def reload(self) -> None:
+        """Reopens the embeddings database, e.g. after it's been rebuilt."""
+        with self._lock:
+            self._open(self._get_stamp())
+
+    def _open(self, stamp: tuple[int, int] | None) -> None:
+        if self._store is not None:
+            logger.info(f"Reopening the embeddings database in {self.directory}")
+        if self._embedding_function is None:
+            self._embedding_function = self._get_embedding_function()
+        if self.backend == "numpy":
+            self._store = MatrixStore.load(self.directory, self._embedding_function)
+        else:
+            if self._store is not None:
+                # Chroma keeps one system per directory, which would keep
+                # reading the old database
+                SharedSystemClient.clear_system_cache()
+            self._store = Chroma(
+                persist_directory=str(self.directory),
+                embedding_function=self._embedding_function,
+            )
+        self._stamp = stamp
+
+    def _get_stamp(self) -> tuple[int, int] | None:
+        file = MATRIX_FILE if self.backend == "numpy" else DATABASE_FILE
+        try:
+            stat = (self.directory / file).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+
+class CachedEmbeddings(Embeddings):
+    """An embedding function that caches the embeddings of queries.
+
+    The agent searches for datasets with the same few phrases again and again,
+    and each search would otherwise wait on the embeddings API. Query
+    embeddings are kept in memory, and, if `path` is set, in a SQLite file
+    that outlives the process. Both are keyed by the model's name and the
+    normalized query, and the normalized query is what gets embedded, so a hit
+    returns exactly what a miss would have. Documents aren't cached.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        path: Path | None = None,
+        max_entries: int = 1024,
+    ) -> None:
+        self.embeddings: Embeddings = embeddings
+        self.model: str = model
+        self.path: Path | None = path
+        self._memory: LruCache[tuple[str, str], list[float]] = LruCache(max_entries)
+        self.disk_stats: CacheStats = CacheStats()
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    @property
+    def stats(self) -> CacheStats:
+        """The in-memory cache's hit, miss, and eviction counts"""
+        return self._memory.stats
+
+    def embed_query(self, text: str) -> list[float]:
+        """Returns the embedding of the query, from the cache if possible."""
+        text = normalize_query(text)
+        key = (self.model, text)
+        embedding = self._lookup(key)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            self._write(key, embedding)
+            self._memory.put(key, embedding)
+        self._log()
+        return embedding
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Returns the embeddings of several queries, embedding the ones that
+        aren't cached in a single request."""
+        keys, embeddings, missing = self._lookup_queries(texts)
+        missing = self._read_queries(missing, embeddings)
+        if missing:
+            embedded = self.embeddings.embed_documents([text for _, text in missing])
+            self._add(missing, embedded, embeddings)
+        self._log()
+        return [embeddings[key] for key in keys]
+
+    async def aembed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Returns the embeddings of several queries like `embed_queries`,
+        awaiting the embeddings API.
+
+        The in-memory cache is read in place, and the file on a thread, so the
+        event loop doesn't wait on it.
+        """
+        keys, embeddings, missing = self._lookup_queries(texts)
+        if missing and self.path is not None:
+            missing = await asyncio.to_thread(self._read_queries, missing, embeddings)
+        if missing:
+            embedded = await self.embeddings.aembed_documents(
+                [text for _, text in missing]
+            )
+            if self.path is not None:
+                await asyncio.to_thread(self._add, missing, embedded, embeddings)
+            else:
+                self._add(missing, embedded, embeddings)
+        self._log()
+        return [embeddings[key] for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def _lookup_queries(
+        self, texts: list[str]
+    ) -> tuple[
+        list[tuple[str, str]],
+        dict[tuple[str, str], list[float]],
+        list[tuple[str, str]],
+    ]:
+        keys = [(self.model, normalize_query(text)) for text in texts]
+        embeddings: dict[tuple[str, str], list[float]] = {}
+        for key in dict.fromkeys(keys):
+            if (embedding := self._memory.get(key)) is not None:
+                embeddings[key] = embedding
+        missing = [key for key in dict.fromkeys(keys) if key not in embeddings]
+        return keys, embeddings, missing
+
+    def _read_queries(
+        self,
+        keys: list[tuple[str, str]],
+        embeddings: dict[tuple[str, str], list[float]],
+    ) -> list[tuple[str, str]]:
+        """Reads the queries' embeddings from the file, returning the keys of
+        those that aren't there."""
+        missing: list[tuple[str, str]] = []
+        for key in keys:
+            if (embedding := self._read(key)) is not None:
+                self._memory.put(key, embedding)
+                embeddings[key] = embedding
+            else:
+                missing.append(key)
+        return missing
+
+    def _add(
+        self,
+        keys: list[tuple[str, str]],
+        embedded: list[list[float]],
+        embeddings: dict[tuple[str, str], list[float]],
+    ) -> None:
+        for key, embedding in zip(keys, embedded, strict=True):
+            self._write(key, embedding)
+            self._memory.put(key, embedding)
+            embeddings[key] = embedding
+
+    def _lookup(self, key: tuple[str, str]) -> list[float] | None:
+        embedding = self._memory.get(key)
+        if embedding is None:
+            embedding = self._read(key)
+            if embedding is not None:
+                self._memory.put(key, embedding)
+        return embedding
+
+    def _log(self) -> None:
+        logger.info(
+            f"Query embedding cache hit ratio {self.stats.hit_ratio:.2f} in "
+            f"memory, {self.disk_stats.hit_ratio:.2f} on disk"
+        )
+
+    def _read(self, key: tuple[str, str]) -> list[float] | None:
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return None
+            try:
+                row = connection.execute(
+                    "SELECT embedding FROM query_embeddings "
+                    "WHERE model = ? AND text = ?",
+                    key,
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not read a cached query embedding: {e}")
+                row = None
+            if row is None:
+                self.disk_stats.misses += 1
+                return None
+            self.disk_stats.hits += 1
+        return array("d", row[0]).tolist()
+
+    def _write(self, key: tuple[str, str], embedding: list[float]) -> None:
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return
+            try:
+                with connection:
+                    _ = connection.execute(
+                        "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?)",
+                        (*key, array("d", embedding).tobytes()),
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Could not cache a query embedding: {e}")
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self._connection is None and self.path is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(self.path, check_same_thread=False)
+                _ = connection.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings "
+                    "(model TEXT, text TEXT, embedding BLOB, PRIMARY KEY (model, text))"
+                )
+            except (OSError, sqlite3.Error) as e:
+                # The in-memory cache still works without the file
+                logger.warning(f"Could not open the query embedding cache: {e}")
+                self.path = None
+                return None
+            self._connection = connection
+        return self._connection
+
+
+def embed_queries(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """Embeds several search queries, in a single request if there's more than
+    one to embed."""
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_queries(texts)
+    if len(texts) == 1:
+        return [embeddings.embed_query(texts[0])]
+    return embeddings.embed_documents(texts)
+
+
+async def aembed_queries(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """Embeds several search queries like `embed_queries`, awaiting the
+    embeddings API."""
+    if isinstance(embeddings, CachedEmbeddings):
+        return await embeddings.aembed_queries(texts)
+    if len(texts) == 1:
+        return [await embeddings.aembed_query(texts[0])]
+    return await embeddings.aembed_documents(texts)
+
+
+def normalize_query(text: str) -> str:
+    """Normalizes a search query's whitespace and case."""
+    return re.sub(r"\s+", " ", text).strip().lower()
@@ -0,0 +1,175 @@
+"""A vector store that's a matrix of embeddings in a NumPy file.
+
+The catalog has hundreds of datasets, not millions, so searching every
+embedding takes one small matrix product. That's faster than Chroma's index,
+and loading a memory-mapped `.npy` file is faster than opening Chroma's SQLite
+database. `scripts/embed_stac.py` writes the matrix alongside Chroma's
+database, and `Settings.vector_backend` picks which one is searched.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Any, Self, override
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from pydantic import BaseModel
+
+# The matrix, one row per document
+MATRIX_FILE = "vectors.npy"
+
+# The ids, texts, and metadata of the matrix's rows
+DOCUMENTS_FILE = "vectors.json"
+
+
+class Rows(BaseModel):
+    """The documents in a matrix's rows"""
+
+    ids: list[str]
+    """The documents' ids"""
+
+    texts: list[str]
+    """The documents' texts"""
+
+    metadatas: list[dict[str, Any]]
+    """The documents' metadata"""
+
+
+class MatrixStore(VectorStore):
+    """Embeddings in a float32 matrix, searched by brute force.
+
+    Search scores are squared Euclidean distances, like those of Chroma's
+    default index, so lower is better.
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray[Any, np.dtype[np.float32]],
+        rows: Rows,
+        embedding_function: Embeddings | None = None,
+    ) -> None:
+        self.matrix: np.ndarray[Any, np.dtype[np.float32]] = matrix
+        self.rows: Rows = rows
+        self._embedding_function: Embeddings | None = embedding_function
+        self._norms: np.ndarray[Any, np.dtype[np.float32]] = np.einsum(
+            "ij,ij->i", matrix, matrix
+        )
+
+    @property
+    @override
+    def embeddings(self) -> Embeddings | None:
+        return self._embedding_function
+
+    @classmethod
+    def load(
+        cls, directory: Path, embedding_function: Embeddings | None = None
+    ) -> Self:
+        """Memory-maps a matrix written to a directory."""
+        rows = Rows.model_validate_json((directory / DOCUMENTS_FILE).read_bytes())
+        matrix = np.load(directory / MATRIX_FILE, mmap_mode="r")
+        return cls(matrix, rows, embedding_function)
+
+    def write(self, directory: Path) -> None:
+        """Writes the matrix to a directory.
+
+        The rows are written first, since a new matrix is how readers know
+        there's something new to load. Both are moved into place, because
+        overwriting a memory-mapped file would change it under its readers.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        temporary = directory / f"{DOCUMENTS_FILE}.tmp"
+        _ = temporary.write_text(self.rows.model_dump_json())
+        _ = temporary.replace(directory / DOCUMENTS_FILE)
+        temporary = directory / f"{MATRIX_FILE}.tmp"
+        with open(temporary, "wb") as f:
+            np.save(f, self.matrix)
+        _ = temporary.replace(directory / MATRIX_FILE)
+
+    @classmethod
+    @override
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: list[dict[Any, Any]] | None = None,
+        *,
+        ids: list[str] | None = None,
+        persist_directory: str | None = None,
+        **kwargs: Any,
+    ) -> Self:
+        """Embeds texts, writing their matrix to `persist_directory` if it's
+        set."""
+        matrix = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        rows = Rows(
+            ids=ids or [str(i) for i in range(len(texts))],
+            texts=texts,
+            metadatas=metadatas or [{} for _ in texts],
+        )
+        store = cls(matrix, rows, embedding)
+        if persist_directory:
+            store.write(Path(persist_directory))
+        return store
+
+    @override
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict[Any, Any]] | None = None,
+        *,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        raise NotImplementedError("Matrices are written whole, at ingest")
+
+    @override
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    @override
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        if self._embedding_function is None:
+            raise ValueError("Searching by text needs an embedding function")
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_relevance_scores(embedding, k)
+
+    def similarity_search_by_vector_with_relevance_scores(
+        self, embedding: Sequence[float], k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        """Returns the k documents nearest to the embedding, and their
+        distances, nearest first, like Chroma's method of the same name."""
+        k = min(k, len(self.rows.ids))
+        if k <= 0:
+            return []
+        vector = np.asarray(embedding, dtype=np.float32)
+        distances = self._norms - 2 * (self.matrix @ vector) + vector @ vector
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [
+            (
+                Document(
+                    id=self.rows.ids[i],
+                    page_content=self.rows.texts[i],
+                    metadata=self.rows.metadatas[i],
+                ),
+                float(distances[i]),
+            )
+            for i in nearest
+        ]
+
+    def get(self, include: list[str] | None = None) -> dict[str, Any]:
+        """Returns every document, like `Chroma.get`."""
+        include = include or ["documents", "metadatas"]
+        return {
+            "ids": self.rows.ids,
+            "documents": self.rows.texts if "documents" in include else None,
+            "metadatas": self.rows.metadatas if "metadatas" in include else None,
+            "embeddings": self.matrix if "embeddings" in include else None,
+        }
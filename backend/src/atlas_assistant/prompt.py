@@ -0,0 +1,217 @@
+"""The system prompt used to generate SQL for a dataset."""
+
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import tabulate
+from pydantic import BaseModel
+
+from .cache import LruCache
+from .dataset import Dataset
+from .dataset.mirror import Mirror
+from .dataset.profile import DatasetProfile, ProfileStore, get_sidecar_path
+from .dataset.version import VersionCache, get_version
+
+if TYPE_CHECKING:
+    from duckdb import DuckDBPyConnection
+
+logger = logging.getLogger(__name__)
+
+
+def get_prompt(
+    dataset: Dataset,
+    mirror: Mirror | None = None,
+    connection: DuckDBPyConnection | None = None,
+    profile: DatasetProfile | None = None,
+    view: str | None = None,
+) -> str:
+    prompt = f"""I want you to act like a data scientist.
+
+You will generate:
+
+   - A SQL select statement
+   - A SQL where statement
+   - An optional SQL group by statement
+   - An optional SQL order by statement
+   - An optional SQL limit statement
+   - A brief explanation of why you chose what you did, which should include a
+     description of each output column
+
+The SQL should be valid DuckDB SQL.
+
+The dataset schema that the SQL will be used against is:
+
+{dataset.get_schema_table()}
+
+The first few rows of the table look like:
+
+{dataset.get_head_table(mirror=mirror, connection=connection)}
+
+Other instructions:
+
+   - If aggregating data, limit to 1 non-aggregated field and its aggregated value
+   - If aggregating data, non-aggregated fields must be in the GROUP BY clause
+   - If aggregating data, order by the aggregated field in most relevant order
+   - If aggregating data, limit to n results
+    - When aggregating numeric values, you must include a `where` clause
+      that removes all `nan` values using the DuckDB `isnan` function
+   - When grouping by country (admin0_name or similar), ALWAYS also include
+     the `iso3` column in the SELECT and GROUP BY clauses for geographic
+     mapping purposes
+"""
+
+    for table_column in dataset.item.properties.table_columns:
+        values = table_column.values
+        if not values and profile and (column := profile.get_column(table_column.name)):
+            values = column.values
+        if values:
+            prompt += f"""The `{table_column.name}` column has the following values:
+
+{"\n".join("- " + str(value) for value in values)}
+
+"""
+
+    if profile:
+        rows = [
+            [column.name, column.min, column.max, f"{column.null_fraction:.0%}"]
+            for column in profile.columns
+        ]
+        prompt += f"""The dataset has {profile.row_count} rows. Column statistics:
+
+{tabulate.tabulate(rows, headers=["Name", "Min", "Max", "Nulls"])}
+
+"""
+
+    if sql_instructions := dataset.item.properties.sql_instructions:
+        prompt += f"""Additional instructions:
+
+{"\n".join("- " + sql_instruction for sql_instruction in sql_instructions)}
+
+"""
+
+    return add_view(prompt, view)
+
+
+def add_view(prompt: str, view: str | None) -> str:
+    """Adds the name of the dataset's view to the prompt, if it has one.
+
+    Only datasets in the database's catalog have a view, and the catalog is
+    built after prompts are compiled, so compiled prompts don't name it.
+    """
+    if view is None:
+        return prompt
+    return (
+        prompt
+        + f"""The dataset is also a table named `{view}`, e.g. for use in
+subqueries.
+"""
+    )
+
+
+class CompiledPrompt(BaseModel):
+    """A SQL prompt for a dataset, compiled ahead of time"""
+
+    item_id: str
+    """The id of the dataset's item"""
+
+    asset_key: str
+    """The key of the dataset's asset"""
+
+    version: str | None
+    """The version of the dataset's asset when the prompt was compiled"""
+
+    prompt: str
+    """The prompt itself"""
+
+
+class PromptCache:
+    """Compiled SQL prompts, keyed by item id, asset key, and asset version.
+
+    Compiling a prompt reads the first few rows of the dataset, so prompts are
+    compiled at ingest time by `scripts/embed_stac.py` and stored in
+    `directory`. Recently used prompts are also kept in memory.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_entries: int = 64,
+        versions: VersionCache | None = None,
+        profiles: ProfileStore | None = None,
+    ) -> None:
+        self.directory: Path = directory
+        self.profiles: ProfileStore | None = profiles
+        self._prompts: LruCache[tuple[str, str, str | None], str] = LruCache(
+            max_entries
+        )
+        self._versions: VersionCache = versions or VersionCache()
+
+    def get(
+        self,
+        dataset: Dataset,
+        mirror: Mirror | None = None,
+        connection: DuckDBPyConnection | None = None,
+        view: str | None = None,
+    ) -> str:
+        """Returns the prompt for the dataset, compiling it if needed, which
+        names the dataset's view if it has one."""
+        # If we can't get the version, fall back to whatever prompt we have
+        version = self._versions.get(dataset.asset.href)
+        key = (dataset.item.id, dataset.asset_key, version)
+        if prompt := self._prompts.get(key):
+            return add_view(prompt, view)
+
+        compiled_prompt = self._read(dataset.item.id, dataset.asset_key)
+        if compiled_prompt and (version is None or compiled_prompt.version == version):
+            prompt = compiled_prompt.prompt
+        else:
+            logger.info(f"Compiling SQL prompt for {dataset.item.id}")
+            profile = (
+                self.profiles.read(dataset.item.id, dataset.asset_key)
+                if self.profiles
+                else None
+            )
+            prompt = get_prompt(dataset, mirror, connection, profile)
+        self._prompts.put(key, prompt)
+        return add_view(prompt, view)
+
+    def write(self, compiled_prompt: CompiledPrompt) -> None:
+        """Writes a compiled prompt to the cache directory."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._get_path(compiled_prompt.item_id, compiled_prompt.asset_key)
+        _ = path.write_text(compiled_prompt.model_dump_json())
+
+    def _read(self, item_id: str, asset_key: str) -> CompiledPrompt | None:
+        path = self._get_path(item_id, asset_key)
+        if not path.exists():
+            return None
+        return CompiledPrompt.model_validate_json(path.read_text())
+
+    def _get_path(self, item_id: str, asset_key: str) -> Path:
+        return get_sidecar_path(self.directory, item_id, asset_key)
+
+
+def compile_prompt(
+    dataset: Dataset,
+    connection: DuckDBPyConnection | None = None,
+    profile: DatasetProfile | None = None,
+) -> CompiledPrompt:
+    """Compiles the SQL prompt for a dataset.
+
+    If the asset's version can't be determined, the prompt is stored without
+    one and is used for any version.
+    """
+    try:
+        version = get_version(dataset.asset.href)
+    except OSError as e:
+        logger.warning(f"Could not get the version of {dataset.asset.href}: {e}")
+        version = None
+    return CompiledPrompt(
+        item_id=dataset.item.id,
+        asset_key=dataset.asset_key,
+        version=version,
+        prompt=get_prompt(dataset, connection=connection, profile=profile),
+    )
@@ -1,21 +1,53 @@
 from __future__ import annotations
 
+import asyncio
+import importlib.util
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from functools import lru_cache
 from pathlib import Path
 from typing import Literal, TypeVar, override
 
+import httpx
 from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_mistralai import ChatMistralAI, MistralAIEmbeddings
 from mistralai import Mistral
 from pydantic import BaseModel, Field, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from .cache import ResponseCache, get_response_key
+from .chart import ChartInference
+from .database import Database, ResultCache
+from .dataset import Metadata
+from .dataset.index import DatasetIndex
+from .dataset.lexical import LexicalIndex
+from .dataset.mirror import Mirror
+from .dataset.profile import ProfileStore
+from .dataset.rollup import RollupStore
+from .dataset.sample import SampleStore
+from .dataset.scan import FooterCache
+from .dataset.version import VersionCache
+from .embeddings import Backend, CachedEmbeddings, VectorStore
+from .matrix import MatrixStore
+from .prompt import PromptCache
+
 PydanticModel = TypeVar("PydanticModel", bound=BaseModel)
 
 Message = dict[str, str]
 
+# The model that embeds dataset descriptions and search queries
+EMBEDDING_MODEL = "mistral-embed"
+
+# The model that writes SQL and chart metadata
+CODE_MODEL = "codestral-latest"
+
+# Whether the last chat in the current context was answered from the response
+# cache, rather than by the code model
+response_cached: ContextVar[bool] = ContextVar("response_cached", default=False)
+
 
 class MistralConfig(BaseModel):
     type: Literal["mistral"] = "mistral"
@@ -30,6 +62,41 @@ class Settings(BaseSettings):
     stac_catalog_href: str = (
         "https://digital-atlas.s3.amazonaws.com/stac/AtlasV3/catalog.json"
     )
+    stac_max_workers: int = 16
+    mirror_directory: Path | None = None
+    mirror_max_bytes: int = 2 * 1024**3
+    mirror_timeout: float = 60.0
+    prompt_cache_size: int = 64
+    vector_backend: Backend = "chroma"
+    select_margin: float = 0.5
+    query_embedding_cache_size: int = 1024
+    query_embedding_cache_path: Path | None = (
+        Path(__file__).parents[2] / "data" / "query_embeddings.sqlite3"
+    )
+    duckdb_threads: int | None = None
+    duckdb_memory_limit: str | None = None
+    duckdb_max_queries: int = 4
+    tool_max_workers: int = 16
+    code_client_max_connections: int = 100
+    code_client_max_keepalive_connections: int = 20
+    code_client_keepalive_expiry: float = 30.0
+    code_cache_size: int = 256
+    code_cache_ttl: float | None = 7 * 24 * 3600.0
+    code_cache_path: Path | None = (
+        Path(__file__).parents[2] / "data" / "code_responses.sqlite3"
+    )
+    chart_min_confidence: float = 0.75
+    query_timeout: float = 60.0
+    result_cache_max_bytes: int = 256 * 1024**2
+    result_cache_ttl: float = 3600.0
+    rollup_verify: bool = False
+    scan_budget_bytes: int | None = None
+    scan_report: bool = False
+    layout_item_ids: list[str] = []
+    sample_fraction: float = 0.01
+    approximate_refine: bool = False
+    version_ttl: float = 300.0
+    version_timeout: float = 10.0
     cors_origins: list[str] = ["http://localhost:5173"]
     oidc_url: str | None = None
     oauth_client_id: str | None = None
@@ -49,25 +116,185 @@ class Settings(BaseSettings):
         else:
             raise ValueError(f"Unsupported chat model type: {type(self.chat_model)}")
 
-    def get_embeddings(self) -> Chroma:
+    def get_embedding_function(self) -> Embeddings:
+        """Returns the model that embeds dataset descriptions and queries."""
         if isinstance(self.chat_model, MistralConfig):
-            embedding_function = MistralAIEmbeddings(
-                model="mistral-embed", api_key=self.chat_model.api_key
+            return MistralAIEmbeddings(
+                model=EMBEDDING_MODEL, api_key=self.chat_model.api_key
             )
         else:
             raise ValueError(f"Unsupported chat model type: {type(self.chat_model)}")
 
+    def get_query_embedding_function(self) -> CachedEmbeddings:
+        """Returns the embedding function, with its query embeddings cached."""
+        return CachedEmbeddings(
+            self.get_embedding_function(),
+            EMBEDDING_MODEL,
+            path=self.query_embedding_cache_path,
+            max_entries=self.query_embedding_cache_size,
+        )
+
+    def get_embeddings(self) -> Chroma | MatrixStore:
+        """Returns the dataset embeddings, in the configured vector store."""
+        if self.vector_backend == "numpy":
+            return MatrixStore.load(
+                self.embeddings_directory, self.get_embedding_function()
+            )
         return Chroma(
             persist_directory=str(self.embeddings_directory),
-            embedding_function=embedding_function,
+            embedding_function=self.get_embedding_function(),
+        )
+
+    def get_vector_store(self) -> VectorStore:
+        """Returns a long-lived handle on the embeddings, to be shared by
+        every request."""
+        return VectorStore(
+            self.embeddings_directory,
+            self.get_query_embedding_function,
+            backend=self.vector_backend,
+        )
+
+    def get_dataset_index(
+        self, vector_store: VectorStore | None = None
+    ) -> DatasetIndex:
+        """Returns the index of datasets written by `scripts/embed_stac.py`,
+        falling back to the embeddings' metadata if there isn't one."""
+
+        def get_metadatas() -> dict[str, Metadata]:
+            embeddings = vector_store.get() if vector_store else self.get_embeddings()
+            results = embeddings.get(include=["metadatas"])
+            return {
+                id: Metadata.model_validate(metadata)
+                for id, metadata in zip(
+                    results["ids"], results["metadatas"], strict=True
+                )
+            }
+
+        return DatasetIndex(self.get_dataset_index_path(), get_metadatas)
+
+    def get_dataset_index_path(self) -> Path:
+        """Returns the path of the index of datasets written by
+        `scripts/embed_stac.py`."""
+        return self.embeddings_directory / "datasets.json"
+
+    def get_lexical_index(self) -> LexicalIndex | None:
+        """Returns the keyword index of datasets written by
+        `scripts/embed_stac.py`, or None if there isn't one."""
+        return LexicalIndex.load(self.get_lexical_index_path())
+
+    def get_lexical_index_path(self) -> Path:
+        """Returns the path of the keyword index of datasets."""
+        return self.embeddings_directory / "lexical.json"
+
+    def get_version_cache(self) -> VersionCache:
+        """Returns a cache of dataset versions, to be shared by the other
+        caches."""
+        return VersionCache(ttl=self.version_ttl, timeout=self.version_timeout)
+
+    def get_mirror(self, versions: VersionCache | None = None) -> Mirror | None:
+        """Returns a local dataset mirror, or None if mirroring is disabled."""
+        if self.mirror_directory is None:
+            return None
+        return Mirror(
+            self.mirror_directory,
+            max_bytes=self.mirror_max_bytes,
+            versions=versions,
+            timeout=self.mirror_timeout,
+        )
+
+    def get_database(self) -> Database:
+        """Returns a new DuckDB database, configured by these settings."""
+        return Database(
+            threads=self.duckdb_threads,
+            memory_limit=self.duckdb_memory_limit,
+            max_queries=self.duckdb_max_queries,
+            catalog=self.get_catalog_path(),
+        )
+
+    def get_catalog_path(self) -> Path:
+        """Returns the path of the catalog of dataset views written by
+        `scripts/embed_stac.py`."""
+        return self.embeddings_directory / "catalog.duckdb"
+
+    def get_result_cache(
+        self, versions: VersionCache | None = None
+    ) -> ResultCache | None:
+        """Returns a cache for query results, or None if it's disabled."""
+        if self.result_cache_max_bytes <= 0:
+            return None
+        return ResultCache(
+            max_bytes=self.result_cache_max_bytes,
+            ttl=self.result_cache_ttl,
+            versions=versions,
+        )
+
+    def get_prompt_cache(self, versions: VersionCache | None = None) -> PromptCache:
+        """Returns a cache of the SQL prompts compiled by `scripts/embed_stac.py`."""
+        return PromptCache(
+            self.embeddings_directory / "prompts",
+            max_entries=self.prompt_cache_size,
+            versions=versions,
+            profiles=self.get_profile_store(),
         )
 
+    def get_rollup_store(self, versions: VersionCache | None = None) -> RollupStore:
+        """Returns the dataset rollups built by `scripts/embed_stac.py`."""
+        return RollupStore(self.embeddings_directory / "rollups", versions=versions)
+
+    def get_sample_store(self, versions: VersionCache | None = None) -> SampleStore:
+        """Returns the dataset samples written by `scripts/embed_stac.py`."""
+        return SampleStore(self.embeddings_directory / "samples", versions=versions)
+
+    def get_footer_cache(
+        self, versions: VersionCache | None = None
+    ) -> FooterCache | None:
+        """Returns a cache of parquet footers, for estimating scan costs, or
+        None if there's no budget to check and nothing to report, since
+        queries are profiled when footers are read."""
+        if self.scan_budget_bytes is None and not self.scan_report:
+            return None
+        return FooterCache(versions=versions)
+
+    def get_profile_store(self) -> ProfileStore:
+        """Returns the dataset profiles computed by `scripts/embed_stac.py`."""
+        return ProfileStore(self.embeddings_directory / "profiles")
+
+    def get_tool_executor(self) -> ThreadPoolExecutor:
+        """Returns a pool for the blocking work of async tools, like reading
+        DuckDB results, so that the event loop never waits on it."""
+        return ThreadPoolExecutor(self.tool_max_workers, thread_name_prefix="tool")
+
     def get_code_client(self) -> CodeClient:
+        """Returns a new client for the code model, with its own pool of
+        connections and its responses cached. The API creates one, and shares
+        it between requests."""
         if isinstance(self.chat_model, MistralConfig):
-            return CodestralClient(self.chat_model)
+            limits = httpx.Limits(
+                max_connections=self.code_client_max_connections,
+                max_keepalive_connections=self.code_client_max_keepalive_connections,
+                keepalive_expiry=self.code_client_keepalive_expiry,
+            )
+            return CachedCodeClient(
+                CodestralClient(self.chat_model, limits),
+                CODE_MODEL,
+                self.get_response_cache(),
+            )
         else:
             raise ValueError(f"Unsupported chat model type: {type(self.chat_model)}")
 
+    def get_chart_inference(self) -> ChartInference:
+        """Returns the rule-based inference of chart metadata, which skips the
+        code model when it's confident."""
+        return ChartInference(self.chart_min_confidence)
+
+    def get_response_cache(self) -> ResponseCache:
+        """Returns a cache of the code model's responses."""
+        return ResponseCache(
+            max_entries=self.code_cache_size,
+            ttl=self.code_cache_ttl,
+            path=self.code_cache_path,
+        )
+
 
 class CodeClient(ABC):
     @abstractmethod
@@ -75,11 +302,43 @@ class CodeClient(ABC):
         self, messages: list[Message], response_format: type[PydanticModel]
     ) -> PydanticModel: ...
 
+    async def achat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        """Chats without blocking the event loop, by default by chatting on
+        the event loop's default executor."""
+        return await asyncio.to_thread(self.chat, messages, response_format)
+
+    async def aclose(self) -> None:  # noqa: B027
+        """Closes the client's connections."""
+
 
 class CodestralClient(CodeClient):
-    def __init__(self, mistral_config: MistralConfig):
+    """Chats with Codestral.
+
+    Chats share a pool of connections, which are kept alive between them, so
+    only the first pays for the TCP and TLS handshakes. Connections use
+    HTTP/2 if `h2` is installed.
+    """
+
+    def __init__(
+        self,
+        mistral_config: MistralConfig,
+        limits: httpx.Limits | None = None,
+        server_url: str | None = None,
+    ):
+        limits = limits or httpx.Limits()
+        http2 = importlib.util.find_spec("h2") is not None
+        self.http_client: httpx.Client = httpx.Client(limits=limits, http2=http2)
+        self.async_http_client: httpx.AsyncClient = httpx.AsyncClient(
+            limits=limits, http2=http2
+        )
+        self.temperature: float = mistral_config.temperature
         self.client: Mistral = Mistral(
-            api_key=(mistral_config.api_key.get_secret_value())
+            api_key=(mistral_config.api_key.get_secret_value()),
+            server_url=server_url,
+            client=self.http_client,
+            async_client=self.async_http_client,
         )
 
     @override
@@ -87,8 +346,24 @@ class CodestralClient(CodeClient):
         self, messages: list[Message], response_format: type[PydanticModel]
     ) -> PydanticModel:
         response = self.client.chat.parse(
-            model="codestral-latest",
+            model=CODE_MODEL,
+            messages=messages,
+            temperature=self.temperature,
+            response_format=response_format,
+        )
+        assert response.choices and response.choices[0] and response.choices[0].message
+        parsed = response.choices[0].message.parsed
+        assert parsed
+        return parsed
+
+    @override
+    async def achat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        response = await self.client.chat.parse_async(
+            model=CODE_MODEL,
             messages=messages,
+            temperature=self.temperature,
             response_format=response_format,
         )
         assert response.choices and response.choices[0] and response.choices[0].message
@@ -96,6 +371,53 @@ class CodestralClient(CodeClient):
         assert parsed
         return parsed
 
+    @override
+    async def aclose(self) -> None:
+        self.http_client.close()
+        await self.async_http_client.aclose()
+
+
+class CachedCodeClient(CodeClient):
+    """A code model client whose responses are cached, keyed by the model,
+    the messages, and the schema of the response.
+
+    Each chat sets `response_cached`, so callers can tell a cached response
+    from the code model's.
+    """
+
+    def __init__(self, client: CodeClient, model: str, cache: ResponseCache):
+        self.client: CodeClient = client
+        self.model: str = model
+        self.cache: ResponseCache = cache
+
+    @override
+    def chat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        key = get_response_key(self.model, messages, response_format)
+        response = self.cache.get(key, response_format)
+        _ = response_cached.set(response is not None)
+        if response is None:
+            response = self.client.chat(messages, response_format)
+            self.cache.put(key, response)
+        return response
+
+    @override
+    async def achat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        key = get_response_key(self.model, messages, response_format)
+        response = await self.cache.aget(key, response_format)
+        _ = response_cached.set(response is not None)
+        if response is None:
+            response = await self.client.achat(messages, response_format)
+            await self.cache.aput(key, response)
+        return response
+
+    @override
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -0,0 +1,47 @@
+"""Tools the agent calls.
+
+Each tool has a sync function, and a coroutine that the agent awaits when it's
+streamed. The coroutines await the chat and embeddings APIs, and run their
+blocking work, like DuckDB queries, on a bounded executor, so a request only
+holds a thread while it's actually reading data.
+"""
+
+import asyncio
+import contextvars
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Executor
+from typing import Any
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from ..context import Context
+from ..settings import CodeClient
+
+
+def with_coroutine(
+    coroutine: Callable[..., Awaitable[Any]],
+) -> Callable[[Callable[..., Any]], BaseTool]:
+    """Makes a tool of a function, like `@tool`, that awaits the coroutine
+    when it's called asynchronously."""
+
+    def decorator(func: Callable[..., Any]) -> BaseTool:
+        return StructuredTool.from_function(func=func, coroutine=coroutine)
+
+    return decorator
+
+
+async def run_blocking[T](executor: Executor | None, func: Callable[[], T]) -> T:
+    """Runs blocking work on an executor, or else the event loop's default
+    executor, in the current context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func)
+
+
+def get_code_client(context: Context) -> CodeClient:
+    """Returns the code model client that the host shares between requests.
+
+    Clients own pools of connections, so tools never create their own.
+    """
+    if context.code_client is None:
+        raise ValueError("The context has no code model client")
+    return context.code_client
@@ -1,39 +1,82 @@
+import logging
+from collections import Counter
+from concurrent.futures import Executor
+
 from langchain.tools import ToolRuntime, tool
+from langchain_chroma import Chroma
 from langchain_core.messages import ToolMessage
 from langgraph.types import Command
 from pydantic import BaseModel
 
 from ..context import Context
 from ..dataset import Dataset, Metadata
+from ..dataset.index import DatasetIndex, summarize
+from ..dataset.lexical import LexicalIndex, fuse, is_confident
+from ..embeddings import VectorStore, aembed_queries, embed_queries
+from ..matrix import MatrixStore
 from ..settings import Settings
 from ..state import State
+from . import run_blocking, with_coroutine
+
+logger = logging.getLogger(__name__)
+
+# The number of candidates each search method ranks for fusion
+CANDIDATES = 10
+
+
+# The number of candidates a search returns by default
+SHORTLIST = 3
 
 
 class SearchResult(BaseModel):
-    """The result of an embeddings search"""
+    """A dataset found by a search"""
+
+    id: str
+    """The dataset's id in the embeddings"""
 
     dataset: Dataset
     """The dataset"""
 
     score: float
-    """The search score"""
+    """The dataset's reciprocal-rank fusion score, higher is better"""
+
+
+class SearchResults(BaseModel):
+    """The datasets found by a search, best first"""
+
+    candidates: list[SearchResult]
+    """The datasets, best first"""
+
+    margin: float
+    """The fraction of rankings that put the best dataset first, less the
+    fraction that put the runner-up first. Near 1 the choice is clear, and
+    near 0 it's a toss-up."""
 
 
 @tool
 def list_datasets(runtime: ToolRuntime[Context, State]) -> Command[None]:
     """Lists all datasets available to the assistant."""
-    settings = runtime.context.settings
-    embeddings = settings.get_embeddings()
-    dataset_descriptions = [
-        Metadata.model_validate(d).to_dataset().get_description()
-        for d in embeddings.get(include=["metadatas"])["metadatas"]
-    ]
+    context = runtime.context
+    if context.datasets:
+        entries = context.datasets.list()
+        content = f"Got {len(entries)} datasets with these summaries:\n\n" + "\n".join(
+            f"- {entry.dataset.item.id}: {entry.summary}" for entry in entries
+        )
+    else:
+        embeddings = get_embeddings(context)
+        dataset_descriptions = [
+            Metadata.model_validate(d).to_dataset().get_description()
+            for d in embeddings.get(include=["metadatas"])["metadatas"]
+        ]
+        content = (
+            f"Got {len(dataset_descriptions)} with these descriptions:"
+            "\n\n" + "- \n".join(dataset_descriptions)
+        )
     return Command(
         update={
             "messages": [
                 ToolMessage(
-                    content=f"Got {len(dataset_descriptions)} with these descriptions:"
-                    "\n\n" + "- \n".join(dataset_descriptions),
+                    content=content,
                     tool_call_id=runtime.tool_call_id,
                 )
             ],
@@ -41,19 +84,62 @@ def list_datasets(runtime: ToolRuntime[Context, State]) -> Command[None]:
     )
 
 
-@tool
-def select_dataset(query: str, runtime: ToolRuntime[Context, State]) -> Command[None]:
+async def aselect_dataset(
+    queries: list[str], runtime: ToolRuntime[Context, State]
+) -> Command[None]:
+    context = runtime.context
+    search_results = await asearch_candidates(
+        queries,
+        context.settings,
+        context.embeddings,
+        context.datasets,
+        context.lexical,
+        executor=context.executor,
+    )
+    return selection_command(search_results, runtime)
+
+
+@with_coroutine(aselect_dataset)
+def select_dataset(
+    queries: list[str], runtime: ToolRuntime[Context, State]
+) -> Command[None]:
     """Selects a dataset based on a user's query.
 
     Args:
-        query: Search terms to select the dataset
+        queries: Search terms to select the dataset, e.g. the user's question
+            and a few rewordings of it
     """
-    settings = runtime.context.settings
-    search_result = search(query, settings)
-    content = (
-        f"Selected dataset with id={search_result.dataset.item.id}:\n\n"
-        + search_result.dataset.get_description()
+    context = runtime.context
+    search_results = search_candidates(
+        queries,
+        context.settings,
+        context.embeddings,
+        context.datasets,
+        context.lexical,
+    )
+    return selection_command(search_results, runtime)
+
+
+def selection_command(
+    search_results: SearchResults, runtime: ToolRuntime[Context, State]
+) -> Command[None]:
+    """Returns the tool's answer, selecting the best dataset that was found."""
+    dataset = search_results.candidates[0].dataset
+    content = f"Selected dataset with id={dataset.item.id}:\n\n" + (
+        dataset.get_description()
     )
+    if (
+        len(search_results.candidates) > 1
+        and search_results.margin < runtime.context.settings.select_margin
+    ):
+        content += (
+            "\n\nThese datasets matched almost as well. If the selected dataset "
+            "doesn't fit the question, select one of these by its id instead:\n\n"
+            + "\n".join(
+                f"- {candidate.dataset.item.id}: {summarize(candidate.dataset)}"
+                for candidate in search_results.candidates[1:]
+            )
+        )
 
     return Command(
         update={
@@ -61,17 +147,165 @@ def select_dataset(query: str, runtime: ToolRuntime[Context, State]) -> Command[
                 ToolMessage(
                     content=content,
                     tool_call_id=runtime.tool_call_id,
-                    artifact=search_result.dataset,
+                    artifact=dataset,
                 )
             ],
-            "dataset": search_result.dataset,
+            "dataset": dataset,
         }
     )
 
 
-def search(query: str, settings: Settings) -> SearchResult:
-    """Search the embeddings for datasets that match the query"""
-    embeddings = settings.get_embeddings()
-    results = embeddings.similarity_search_with_score(query, k=1)
-    dataset = Metadata.model_validate(results[0][0].metadata).to_dataset()
-    return SearchResult(dataset=dataset, score=results[0][1])
+def search(
+    query: str,
+    settings: Settings,
+    vector_store: VectorStore | None = None,
+    index: DatasetIndex | None = None,
+    lexical: LexicalIndex | None = None,
+) -> SearchResult:
+    """Search for the dataset that best matches the query"""
+    return search_candidates(
+        [query], settings, vector_store, index, lexical, k=1
+    ).candidates[0]
+
+
+def search_candidates(
+    queries: list[str],
+    settings: Settings,
+    vector_store: VectorStore | None = None,
+    index: DatasetIndex | None = None,
+    lexical: LexicalIndex | None = None,
+    k: int = SHORTLIST,
+) -> SearchResults:
+    """Search for the k datasets that best match any of the queries.
+
+    If there's a keyword index, and the dataset index to look its results up
+    in, each query is first matched against it. If every query confidently
+    matches the same dataset, the embeddings aren't searched. Otherwise, the
+    queries are embedded in a single request, and every query's keyword and
+    vector rankings are fused. If the embeddings can't be searched, e.g. when
+    offline, the keyword rankings are used on their own.
+    """
+    rankings, results = _search_keywords(queries, index, lexical, k)
+    if results:
+        return results
+
+    metadatas: dict[str, dict[str, object]] = {}
+    try:
+        embeddings = vector_store.get() if vector_store else settings.get_embeddings()
+        assert embeddings.embeddings, "The embeddings have no embedding function"
+        vectors = embed_queries(embeddings.embeddings, queries)
+        _search_vectors(embeddings, vectors, rankings, metadatas)
+    except Exception as e:
+        if not any(rankings):
+            raise
+        logger.warning(f"Could not search the embeddings, using keywords: {e}")
+    return _get_results(rankings, index, metadatas, k)
+
+
+async def asearch_candidates(
+    queries: list[str],
+    settings: Settings,
+    vector_store: VectorStore | None = None,
+    index: DatasetIndex | None = None,
+    lexical: LexicalIndex | None = None,
+    k: int = SHORTLIST,
+    executor: Executor | None = None,
+) -> SearchResults:
+    """Search for the k datasets that best match any of the queries, like
+    `search_candidates`, awaiting the embeddings API and opening and searching
+    the embeddings on the executor."""
+    rankings, results = _search_keywords(queries, index, lexical, k)
+    if results:
+        return results
+
+    metadatas: dict[str, dict[str, object]] = {}
+    try:
+        embeddings = await run_blocking(
+            executor,
+            lambda: vector_store.get() if vector_store else settings.get_embeddings(),
+        )
+        assert embeddings.embeddings, "The embeddings have no embedding function"
+        vectors = await aembed_queries(embeddings.embeddings, queries)
+        await run_blocking(
+            executor,
+            lambda: _search_vectors(embeddings, vectors, rankings, metadatas),
+        )
+    except Exception as e:
+        if not any(rankings):
+            raise
+        logger.warning(f"Could not search the embeddings, using keywords: {e}")
+    return _get_results(rankings, index, metadatas, k)
+
+
+def _search_keywords(
+    queries: list[str],
+    index: DatasetIndex | None,
+    lexical: LexicalIndex | None,
+    k: int,
+) -> tuple[list[list[str]], SearchResults | None]:
+    """Returns each query's keyword ranking, and the results if they're
+    confident enough to skip the embeddings."""
+    rankings: list[list[str]] = []
+    if lexical and index:
+        keyword_results = [lexical.search(query, k=CANDIDATES) for query in queries]
+        rankings += [[id for id, _ in results] for results in keyword_results]
+        if (
+            all(is_confident(results) for results in keyword_results)
+            and len({results[0][0] for results in keyword_results}) == 1
+        ):
+            logger.info(f"Selected {rankings[0][0]} by keywords alone")
+            return rankings, _get_results(rankings, index, {}, k)
+    return rankings, None
+
+
+def _search_vectors(
+    embeddings: Chroma | MatrixStore,
+    vectors: list[list[float]],
+    rankings: list[list[str]],
+    metadatas: dict[str, dict[str, object]],
+) -> None:
+    """Appends each query vector's ranking, and records the metadata of the
+    documents it ranks."""
+    for vector in vectors:
+        documents = embeddings.similarity_search_by_vector_with_relevance_scores(
+            vector, k=CANDIDATES
+        )
+        rankings.append([])
+        for document, _ in documents:
+            if document.id:
+                metadatas[document.id] = document.metadata
+                rankings[-1].append(document.id)
+
+
+def _get_results(
+    rankings: list[list[str]],
+    index: DatasetIndex | None,
+    metadatas: dict[str, dict[str, object]],
+    k: int,
+) -> SearchResults:
+    candidates: list[SearchResult] = []
+    for id, score in fuse(*rankings):
+        dataset = index.get(id) if index else None
+        if dataset is None and id in metadatas:
+            dataset = Metadata.model_validate(metadatas[id]).to_dataset()
+        if dataset:
+            candidates.append(SearchResult(id=id, dataset=dataset, score=score))
+        if len(candidates) == k:
+            break
+    if not candidates:
+        raise ValueError("No dataset matches the search")
+    # How much more often the best candidate was ranked first than the next
+    firsts = Counter(ranking[0] for ranking in rankings if ranking)
+    margin = firsts[candidates[0].id] - (
+        firsts[candidates[1].id] if len(candidates) > 1 else 0
+    )
+    return SearchResults(
+        candidates=candidates, margin=margin / max(1, sum(firsts.values()))
+    )
+
+
+def get_embeddings(context: Context) -> Chroma | MatrixStore:
+    """Returns the shared embeddings, or opens them if there aren't any."""
+    if context.embeddings:
+        return context.embeddings.get()
+    return context.settings.get_embeddings()
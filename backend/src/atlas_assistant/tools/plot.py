@@ -1,12 +1,15 @@
 import json
+import time
 from collections.abc import Callable
 
-from langchain.tools import ToolRuntime, tool
+from langchain.tools import ToolRuntime
 from langchain_core.messages import ToolMessage
 from langgraph.types import Command
 from pydantic import BaseModel
 
+from ..chart import ChartInference
 from ..context import Context
+from ..settings import Message, response_cached
 from ..state import (
     AreaChartMetadata,
     BarChartMetadata,
@@ -18,6 +21,7 @@ from ..state import (
     MapChartMetadata,
     State,
 )
+from . import get_code_client, with_coroutine
 
 # Type alias for prompt functions
 PromptFunc = Callable[[str], str]
@@ -253,7 +257,30 @@ CHART_REGISTRY: dict[ChartType, tuple[type[BaseModel], PromptFunc]] = {
 }
 
 
-@tool
+async def agenerate_chart_metadata(
+    chart_type: ChartType, runtime: ToolRuntime[Context, State]
+) -> Command[None]:
+    data = runtime.state.get("data")
+    if error := check_chart_request(chart_type, data, runtime):
+        return error
+    assert data
+    charts = get_chart_inference(runtime.context)
+    chart_metadata = charts.infer(chart_type, data)
+    if chart_metadata is None:
+        metadata_class, prompt_func = CHART_REGISTRY[chart_type]
+        client = get_code_client(runtime.context)
+        _ = response_cached.set(False)
+        start = time.monotonic()
+        chart_metadata = await client.achat(
+            messages=get_messages(prompt_func, data), response_format=metadata_class
+        )
+        # Only the code model's own answers say how long inference saves
+        if not response_cached.get():
+            charts.record(chart_type, time.monotonic() - start)
+    return chart_metadata_command(chart_type, chart_metadata, data, runtime)
+
+
+@with_coroutine(agenerate_chart_metadata)
 def generate_chart_metadata(
     chart_type: ChartType, runtime: ToolRuntime[Context, State]
 ) -> Command[None]:
@@ -268,6 +295,36 @@ def generate_chart_metadata(
             "heatmap". Selection rules are in your system instructions.
     """
     data = runtime.state.get("data")
+    if error := check_chart_request(chart_type, data, runtime):
+        return error
+    assert data
+    charts = get_chart_inference(runtime.context)
+    chart_metadata = charts.infer(chart_type, data)
+    if chart_metadata is None:
+        metadata_class, prompt_func = CHART_REGISTRY[chart_type]
+        client = get_code_client(runtime.context)
+        _ = response_cached.set(False)
+        start = time.monotonic()
+        chart_metadata = client.chat(
+            messages=get_messages(prompt_func, data), response_format=metadata_class
+        )
+        # Only the code model's own answers say how long inference saves
+        if not response_cached.get():
+            charts.record(chart_type, time.monotonic() - start)
+    return chart_metadata_command(chart_type, chart_metadata, data, runtime)
+
+
+def get_chart_inference(context: Context) -> ChartInference:
+    """Returns the shared chart metadata inference, or creates one if there
+    isn't one."""
+    return context.charts or context.settings.get_chart_inference()
+
+
+def check_chart_request(
+    chart_type: ChartType, data: str | None, runtime: ToolRuntime[Context, State]
+) -> Command[None] | None:
+    """Returns the tool's answer if there's no data to chart, or the chart type
+    isn't known."""
     if not data:
         return Command(
             update={
@@ -293,21 +350,26 @@ def generate_chart_metadata(
                 ]
             }
         )
+    return None
 
-    metadata_class, prompt_func = CHART_REGISTRY[chart_type]
 
-    settings = runtime.context.settings
-    client = settings.get_code_client()
-    chart_metadata = client.chat(
-        messages=[
-            {
-                "role": "system",
-                "content": prompt_func(data),
-            }
-        ],
-        response_format=metadata_class,
-    )
+def get_messages(prompt_func: PromptFunc, data: str) -> list[Message]:
+    """Returns the messages that ask the code model for a chart's metadata."""
+    return [
+        {
+            "role": "system",
+            "content": prompt_func(data),
+        }
+    ]
 
+
+def chart_metadata_command(
+    chart_type: ChartType,
+    chart_metadata: BaseModel,
+    data: str,
+    runtime: ToolRuntime[Context, State],
+) -> Command[None]:
+    """Returns the tool's answer with a chart's metadata."""
     return Command(
         update={
             "messages": [
@@ -1,16 +1,35 @@
-from typing import cast
-
-from langchain.tools import ToolRuntime, tool
+import difflib
+import logging
+import re
+from collections.abc import Callable
+from contextlib import AbstractContextManager, nullcontext
+from typing import Self, cast
+
+import duckdb
+import pyarrow as pa
+from langchain.tools import ToolRuntime
 from langchain_core.messages import ToolMessage
 from langgraph.types import Command
 from pydantic import BaseModel
 
 from ..context import Context
+from ..database import QueryCancelledError, QueryResult, get_bytes_read
 from ..dataset import Dataset
+from ..dataset.layout import get_current_layout
+from ..dataset.rollup import results_match
+from ..dataset.sample import Approximation, sample_relation
+from ..dataset.scan import ScanEstimate
+from ..prompt import get_prompt
+from ..settings import Message
 from ..state import SqlQuery, State
+from . import get_code_client, run_blocking, with_coroutine
+
+logger = logging.getLogger(__name__)
 
 MAX_DATA_FRAME_LENGTH = 50
 
+UNKNOWN_COLUMN = re.compile(r'Referenced column "((?:[^"]|"")*)" not found')
+
 
 class SqlQueryParts(BaseModel):
     select: str
@@ -31,9 +50,18 @@ class SqlQueryParts(BaseModel):
     explanation: str
     """An explanation of why the model generated this query"""
 
-    def get_query(self, href: str) -> SqlQuery:
-        """Gets the full SQL query"""
-        parts = [f"SELECT {self.select} FROM '{href}' WHERE {self.where}"]
+    def get_query(self, href: str, hive_partitioning: bool = False) -> SqlQuery:
+        """Gets the full SQL query
+
+        If `hive_partitioning` is set, the href is a glob of hive-partitioned
+        files, whose partition values are read from their paths.
+        """
+        return self.get_query_from(get_relation(href, hive_partitioning))
+
+    def get_query_from(self, relation: str) -> SqlQuery:
+        """Gets the full SQL query, reading from any relation, e.g. a
+        subquery"""
+        parts = [f"SELECT {self.select} FROM {relation} WHERE {self.where}"]
         if self.group_by:
             parts.append(f"GROUP BY {self.group_by}")
         if self.order_by:
@@ -43,45 +71,369 @@ class SqlQueryParts(BaseModel):
         return SqlQuery(query=" ".join(parts), explanation=self.explanation)
 
 
-@tool
-def generate_table(query: str, runtime: ToolRuntime[Context, State]) -> Command[None]:
+def get_relation(href: str, hive_partitioning: bool = False) -> str:
+    """Returns the relation that reads the parquet file(s) at the href."""
+    if hive_partitioning:
+        # Keep partition values as strings, like the columns they came from
+        return (
+            f"read_parquet('{href}', hive_partitioning = true, "
+            "hive_types_autocast = false)"
+        )
+    return f"'{href}'"
+
+
+def limit_query(query: str) -> str:
+    """Wraps a query so it returns at most one row more than we'll show, which
+    is enough to tell if there are too many."""
+    return f"SELECT * FROM ({query}) LIMIT {MAX_DATA_FRAME_LENGTH + 1}"
+
+
+def count_query(query: str) -> str:
+    """Wraps a query so it returns its number of rows."""
+    return f"SELECT COUNT(*) FROM ({query})"
+
+
+def explain_query(query: str) -> str:
+    """Wraps a query so it's only parsed, bound, and planned, which reads the
+    parquet footer but none of the data."""
+    return f"EXPLAIN {query}"
+
+
+class SqlValidationError(Exception):
+    """Raised when generated SQL can't be bound against its dataset."""
+
+    def __init__(
+        self,
+        message: str,
+        column: str | None = None,
+        suggestions: list[str] | None = None,
+    ) -> None:
+        super().__init__(message)
+        self.message: str = message
+        self.column: str | None = column
+        self.suggestions: list[str] = suggestions or []
+
+    @classmethod
+    def from_duckdb(cls, error: duckdb.Error, dataset: Dataset) -> Self:
+        """Creates a validation error from DuckDB's, suggesting the dataset's
+        nearest column names if a column wasn't found."""
+        # Drop the echoed query, and DuckDB's own suggestions for columns
+        message = str(error).split("\n\n")[0]
+        message = re.sub(r"\nCandidate bindings:.*", "", message, flags=re.DOTALL)
+        match = UNKNOWN_COLUMN.search(message)
+        if not match:
+            return cls(message)
+        column = match.group(1).replace('""', '"')
+        names = [column.name for column in dataset.item.properties.table_columns]
+        suggestions = difflib.get_close_matches(column, names, n=3, cutoff=0.5)
+        return cls(message, column, suggestions)
+
+    def get_content(self) -> str:
+        """Returns a description of the error for the model."""
+        content = f"The SQL is invalid, so it wasn't run: {self.message}"
+        if self.suggestions:
+            names = " or ".join(f"`{name}`" for name in self.suggestions)
+            content += f"\n\nDid you mean {names}?"
+        return content + "\n\nRe-generate the SQL using the dataset's columns."
+
+
+class ScanBudgetError(Exception):
+    """Raised when generated SQL is expected to read more than the budget."""
+
+    def __init__(self, estimate: ScanEstimate, budget: int) -> None:
+        super().__init__(f"Query would read {estimate.bytes} bytes")
+        self.estimate: ScanEstimate = estimate
+        self.budget: int = budget
+
+    def get_content(self) -> str:
+        """Returns a description of the error for the model."""
+        estimate = self.estimate
+        return (
+            f"The SQL query would read about {estimate.bytes / 1024**2:.0f} MB "
+            f"from {estimate.row_groups} of the dataset's "
+            f"{estimate.total_row_groups} row groups, which is over the budget "
+            f"of {self.budget / 1024**2:.0f} MB, so it wasn't run. Re-generate "
+            "the SQL so it reads less data, e.g. by filtering on `iso3` or "
+            "selecting fewer columns."
+        )
+
+
+async def agenerate_table(
+    query: str, runtime: ToolRuntime[Context, State], approximate: bool = False
+) -> Command[None]:
+    dataset = runtime.state["dataset"]
+    if not dataset:
+        return no_dataset(runtime)
+    context = runtime.context
+    messages = await run_blocking(
+        context.executor, lambda: get_messages(query, dataset, context)
+    )
+    client = get_code_client(context)
+    sql_query_parts = await client.achat(
+        messages=messages, response_format=SqlQueryParts
+    )
+    return await run_blocking(
+        context.executor,
+        lambda: run_query(sql_query_parts, dataset, runtime, approximate),
+    )
+
+
+@with_coroutine(agenerate_table)
+def generate_table(
+    query: str, runtime: ToolRuntime[Context, State], approximate: bool = False
+) -> Command[None]:
     """Generates SQL to return a table of data and then executes that SQL
 
     Before generating SQL, you must select a dataset.
 
     Args:
         query: The question that we're going to answer with the SQL query.
+        approximate: Whether rough totals, counts, or averages are enough, e.g.
+            for exploratory questions. These are estimated from a sample of the
+            dataset, with margins of error, and are much faster.
     """
     dataset = runtime.state["dataset"]
     if not dataset:
+        return no_dataset(runtime)
+    context = runtime.context
+    client = get_code_client(context)
+    sql_query_parts = client.chat(
+        messages=get_messages(query, dataset, context),
+        response_format=SqlQueryParts,
+    )
+    return run_query(sql_query_parts, dataset, runtime, approximate)
+
+
+def no_dataset(runtime: ToolRuntime[Context, State]) -> Command[None]:
+    """Returns the tool's answer when no dataset has been selected."""
+    return Command(
+        update={
+            "messages": [
+                ToolMessage(
+                    content="No dataset selected", tool_call_id=runtime.tool_call_id
+                )
+            ]
+        }
+    )
+
+
+def get_messages(query: str, dataset: Dataset, context: Context) -> list[Message]:
+    """Returns the messages that ask the code model for SQL that answers the
+    query."""
+    catalog = context.database.catalog
+    view = catalog.get_view(dataset) if catalog else None
+    with context.database.cursor() as connection:
+        if context.prompts:
+            prompt = context.prompts.get(dataset, context.mirror, connection, view)
+        else:
+            prompt = get_prompt(dataset, context.mirror, connection, view=view)
+    return [
+        {
+            "role": "system",
+            "content": prompt,
+        },
+        {"role": "user", "content": query},
+    ]
+
+
+def run_query(
+    sql_query_parts: SqlQueryParts,
+    dataset: Dataset,
+    runtime: ToolRuntime[Context, State],
+    approximate: bool,
+) -> Command[None]:
+    """Runs generated SQL against the dataset, returning the tool's answer."""
+    context = runtime.context
+    settings = context.settings
+    # Show the user the query against the dataset's view, or else its href
+    catalog = context.database.catalog
+    view = catalog.get_view(dataset) if catalog else None
+    if view:
+        sql_query = sql_query_parts.get_query_from(view)
+    else:
+        sql_query = sql_query_parts.get_query(dataset.asset.href)
+
+    rollup_query: str | None = None
+    layout = get_current_layout(dataset, context.versions)
+    approximation = None
+    sample = None
+    if approximate or context.approximate:
+        approximation = Approximation.from_query_parts(sql_query_parts)
+        if approximation and context.samples:
+            sample = context.samples.get(dataset)
+
+    def resolve() -> AbstractContextManager[str]:
+        # Read the partitioned copy if it's current, or else the mirrored copy,
+        # keeping it in the mirror until the query finishes
+        href = dataset.asset.href
+        if layout:
+            return nullcontext(layout.href)
+        if context.mirror:
+            return context.mirror.resolve(href)
+        return nullcontext(href)
+
+    def get_source_relation(source: str) -> str:
+        if layout:
+            return get_relation(source, hive_partitioning=True)
+        if view and source == dataset.asset.href:
+            return view
+        return get_relation(source)
+
+    def execute_base(wrap: Callable[[str], str]) -> pa.Table:
+        with resolve() as source:
+            query = sql_query_parts.get_query_from(get_source_relation(source)).query
+            return context.database.execute(
+                wrap(query),
+                timeout=settings.query_timeout,
+                cancelled=context.cancelled,
+                profile=context.footers is not None,
+            )
+
+    def execute(wrap: Callable[[str], str]) -> pa.Table:
+        if rollup_query is None:
+            return execute_base(wrap)
+        table = context.database.execute(
+            wrap(rollup_query),
+            timeout=settings.query_timeout,
+            cancelled=context.cancelled,
+        )
+        # Without an ORDER BY, a LIMIT may keep any of the rows, so results
+        # are only compared if they're ordered or complete
+        ordered = bool(sql_query_parts.order_by)
+        complete = (
+            sql_query_parts.limit is None and table.num_rows <= MAX_DATA_FRAME_LENGTH
+        )
+        if settings.rollup_verify and (ordered or complete):
+            base_table = execute_base(wrap)
+            if not results_match(table, base_table, ordered):
+                logger.warning(
+                    f"Rollup result doesn't match the dataset for {sql_query.query}"
+                )
+                return base_table
+        return table
+
+    def fetch(wrap: Callable[[str], str]) -> pa.Table:
+        if context.results:
+            return context.results.get_or_execute(
+                wrap(sql_query.query), dataset.asset.href, lambda: execute(wrap)
+            )
+        return execute(wrap)
+
+    def fetch_exact() -> tuple[pa.Table, int]:
+        table = fetch(limit_query)
+        row_count = table.num_rows
+        if row_count > MAX_DATA_FRAME_LENGTH:
+            row_count = cast(int, fetch(count_query).column(0)[0].as_py())
+        return table, row_count
+
+    def refine() -> ToolMessage:
+        table, row_count = fetch_exact()
+        content_parts, data = describe_result(QueryResult(table), row_count)
+        return ToolMessage(
+            content="\n\n".join(
+                ["The exact result of the approximate query:", *content_parts]
+            ),
+            name="generate_table",
+            tool_call_id=runtime.tool_call_id,
+            artifact={"data": data, "sql_query": sql_query.query, "approximate": False},
+        )
+
+    def execute_sample(
+        parts: SqlQueryParts, wrap: Callable[[str], str] = lambda query: query
+    ) -> pa.Table:
+        # Read the sample written at ingest, or else sample the dataset
+        with nullcontext(str(sample[0])) if sample else resolve() as source:
+            if sample:
+                relation = get_relation(source)
+            else:
+                relation = sample_relation(
+                    get_source_relation(source), settings.sample_fraction
+                )
+            return context.database.execute(
+                wrap(parts.get_query_from(relation).query),
+                timeout=settings.query_timeout,
+                cancelled=context.cancelled,
+            )
+
+    try:
+        # Catch bad column names and types before any data is read
+        try:
+            _ = execute_base(explain_query)
+        except (
+            duckdb.BinderException,
+            duckdb.CatalogException,
+            duckdb.ParserException,
+        ) as e:
+            raise SqlValidationError.from_duckdb(e, dataset) from e
+        if context.rollups:
+            rollup_query = context.rollups.route(dataset, sql_query_parts)
+        if rollup_query is not None:
+            # A rollup gives the exact result at least as quickly as a sample
+            approximation = None
+        # Refuse queries that would read too much of the dataset, going by its
+        # parquet footer. A stored sample is read instead of the dataset, but
+        # refining its estimate reads the dataset, so that's refused instead.
+        estimate = None
+        refinable = settings.approximate_refine and context.executor is not None
+        if context.footers and rollup_query is None and (sample is None or refinable):
+            with resolve() as source, context.database.cursor() as connection:
+                footer = context.footers.get(
+                    dataset.asset.href, source, connection, layout is not None
+                )
+            scan = footer.estimate(sql_query_parts)
+            budget = settings.scan_budget_bytes
+            if budget is not None and scan.bytes > budget:
+                if sample is None:
+                    raise ScanBudgetError(scan, budget)
+                refinable = False
+            if sample is None:
+                estimate = scan
+        # Never materialize more rows than we'd show, and only count them all
+        # if there are too many
+        if approximation:
+            table = execute_sample(approximation.estimate, limit_query)
+            row_count = table.num_rows
+            if row_count > MAX_DATA_FRAME_LENGTH:
+                table = execute_sample(approximation.estimate, count_query)
+                row_count = cast(int, table.column(0)[0].as_py())
+            else:
+                replicates = execute_sample(approximation.replicates)
+                table = approximation.add_margins(table, replicates)
+        else:
+            table, row_count = fetch_exact()
+        result = QueryResult(table)
+        if estimate:
+            estimate.bytes_read = get_bytes_read(table)
+            logger.info(
+                f"Estimated {estimate.bytes} bytes from {estimate.row_groups} of "
+                f"{estimate.total_row_groups} row groups, read {estimate.bytes_read}"
+            )
+    except (SqlValidationError, ScanBudgetError) as e:
         return Command(
             update={
                 "messages": [
                     ToolMessage(
-                        content="No dataset selected", tool_call_id=runtime.tool_call_id
+                        content=e.get_content(), tool_call_id=runtime.tool_call_id
                     )
-                ]
+                ],
+                "sql_query": None,
+            }
+        )
+    except QueryCancelledError as e:
+        return Command(
+            update={
+                "messages": [
+                    ToolMessage(
+                        content=f"The SQL query {e.reason} after {e.elapsed:.0f} "
+                        "seconds, so no data was returned. Re-generate the SQL "
+                        "so it reads less data, e.g. by filtering on `iso3` or "
+                        "summarizing with `group by`.",
+                        tool_call_id=runtime.tool_call_id,
+                    )
+                ],
+                "sql_query": None,
             }
         )
-
-    settings = runtime.context.settings
-    client = settings.get_code_client()
-    sql_query_parts = client.chat(
-        messages=[
-            {
-                "role": "system",
-                "content": get_prompt(dataset),
-            },
-            {"role": "user", "content": query},
-        ],
-        response_format=SqlQueryParts,
-    )
-    sql_query = sql_query_parts.get_query(dataset.asset.href)
-
-    import duckdb
-
-    try:
-        data_frame = duckdb.sql(sql_query.query).to_df()
     except Exception as e:
         return Command(
             update={
@@ -100,23 +452,22 @@ def generate_table(query: str, runtime: ToolRuntime[Context, State]) -> Command[
         f"```sql\n{sql_query.query}\n```",
         sql_query.explanation,
     ]
-    if len(data_frame) > MAX_DATA_FRAME_LENGTH:
+    if approximation:
+        fraction = sample[1].fraction if sample else settings.sample_fraction
         content_parts.append(
-            f"Returned data had {len(data_frame)} rows. Summarize the data by "
-            "re-generating the SQL with `group by` or `distinct`."
+            f"These are estimates from a sample of about {fraction * 100:g}% of "
+            "the dataset. Each `_margin` column is the 95% margin of error of "
+            "the column before it. Say that the numbers are approximate."
         )
-        data = None
-    elif len(data_frame) == 0:
+        if refinable and context.executor:
+            # The exact result is streamed to the user when it's ready
+            context.refinements.append(context.executor.submit(refine))
+    elif approximate or context.approximate:
         content_parts.append(
-            f"Returned data had {len(data_frame)} rows. No data was returned."
+            "This query can't be estimated from a sample, so it was run exactly."
         )
-        data = None
-    else:
-        content_parts += [
-            "Data returned:",
-            cast(str, data_frame.to_markdown(index=False)),
-        ]
-        data = data_frame.to_json(orient="records")
+    described, data = describe_result(result, row_count)
+    content_parts += described
     return Command(
         update={
             "messages": [
@@ -126,6 +477,8 @@ def generate_table(query: str, runtime: ToolRuntime[Context, State]) -> Command[
                     artifact={
                         "data": data,
                         "sql_query": sql_query.query,
+                        "scan": estimate.model_dump() if estimate else None,
+                        "approximate": approximation is not None,
                     },
                 ),
             ],
@@ -135,55 +488,17 @@ def generate_table(query: str, runtime: ToolRuntime[Context, State]) -> Command[
     )
 
 
-def get_prompt(dataset: Dataset) -> str:
-    prompt = f"""I want you to act like a data scientist.
-
-You will generate:
-
-   - A SQL select statement
-   - A SQL where statement
-   - An optional SQL group by statement
-   - An optional SQL order by statement
-   - An optional SQL limit statement
-   - A brief explanation of why you chose what you did, which should include a
-     description of each output column
-
-The SQL should be valid DuckDB SQL.
-
-The dataset schema that the SQL will be used against is:
-
-{dataset.get_schema_table()}
-
-The first few rows of the table look like:
-
-{dataset.get_head_table()}
-
-Other instructions:
-
-   - If aggregating data, limit to 1 non-aggregated field and its aggregated value
-   - If aggregating data, non-aggregated fields must be in the GROUP BY clause
-   - If aggregating data, order by the aggregated field in most relevant order
-   - If aggregating data, limit to n results
-    - When aggregating numeric values, you must include a `where` clause
-      that removes all `nan` values using the DuckDB `isnan` function
-   - When grouping by country (admin0_name or similar), ALWAYS also include
-     the `iso3` column in the SELECT and GROUP BY clauses for geographic
-     mapping purposes
-"""
-
-    for table_column in dataset.item.properties.table_columns:
-        if table_column.values:
-            prompt += f"""The `{table_column.name}` column has the following values:
-
-{"\n".join("- " + str(value) for value in table_column.values)}
-
-"""
-
-    if sql_instructions := dataset.item.properties.sql_instructions:
-        prompt += f"""Additional instructions:
-
-{"\n".join("- " + sql_instruction for sql_instruction in sql_instructions)}
-
-"""
-
-    return prompt
+def describe_result(
+    result: QueryResult, row_count: int
+) -> tuple[list[str], str | None]:
+    """Describes a query's result for the model, returning the description and
+    the result's data, if there are few enough rows to return."""
+    if row_count > MAX_DATA_FRAME_LENGTH:
+        content_parts = [
+            f"Returned data had {row_count} rows. Summarize the data by "
+            "re-generating the SQL with `group by` or `distinct`."
+        ]
+        return content_parts, None
+    if row_count == 0:
+        return ["Returned data had 0 rows. No data was returned."], None
+    return ["Data returned:", result.markdown], result.json
@@ -8,6 +8,7 @@ from pytest import Config, Parser
 
 import atlas_assistant.api
 import atlas_assistant.settings
+from atlas_assistant.database import Database
 from atlas_assistant.dataset import Dataset, Item
 from atlas_assistant.settings import Settings
 
@@ -17,6 +18,12 @@ def settings() -> Settings:
     return atlas_assistant.settings.get_settings()
 
 
+@pytest.fixture
+def database() -> Iterator[Database]:
+    with Database() as database:
+        yield database
+
+
 @pytest.fixture
 def client() -> Iterator[TestClient]:
     def override_oidc() -> str:
@@ -41,6 +48,57 @@ def dataset() -> Dataset:
     return Dataset(item=item, asset_key="data")
 
 
+@pytest.fixture
+def parquet_path(tmp_path: Path) -> Path:
+    """A small, local stand-in for a hazard exposure parquet file."""
+    import duckdb
+
+    path = tmp_path / "data.parquet"
+    duckdb.sql(
+        f"""COPY (
+            SELECT * FROM (VALUES
+                ('KEN', 'Kenya', 'Nairobi', 'maize', 'dry', 1.0),
+                ('KEN', 'Kenya', 'Mombasa', 'maize', 'heat', 2.0),
+                ('KEN', 'Kenya', 'Mombasa', 'coffee', 'dry', 3.0),
+                ('TZA', 'Tanzania', 'Arusha', 'maize', 'dry', 4.0),
+                ('TZA', 'Tanzania', 'Dodoma', 'sorghum', 'heat', 5.0)
+            ) t(iso3, admin0_name, admin1_name, crop, hazard, value)
+        ) TO '{path}' (FORMAT parquet)"""
+    )
+    return path
+
+
+@pytest.fixture
+def local_dataset(dataset: Dataset, parquet_path: Path) -> Dataset:
+    """The fixture dataset, with its asset pointing at a local file:// href."""
+    local_dataset = dataset.model_copy(deep=True)
+    local_dataset.item.assets["data"].href = parquet_path.as_uri()
+    return local_dataset
+
+
+@pytest.fixture
+def admin2_dataset(tmp_path: Path, local_dataset: Dataset) -> Dataset:
+    """A dataset with many admin2 rows per admin1 region, and some NaNs."""
+    import duckdb
+
+    path = tmp_path / "admin2.parquet"
+    duckdb.sql(
+        f"""COPY (
+            SELECT
+                ['KEN', 'TZA'][i % 2 + 1] AS iso3,
+                ['Kenya', 'Tanzania'][i % 2 + 1] AS admin0_name,
+                'Region ' || (i % 4) AS admin1_name,
+                'District ' || i AS admin2_name,
+                ['maize', 'coffee', 'sorghum'][i % 3 + 1] AS crop,
+                CASE WHEN i % 10 = 0 THEN 'NaN'::DOUBLE ELSE i::DOUBLE END AS value
+            FROM range(200) t(i)
+        ) TO '{path}' (FORMAT parquet)"""
+    )
+    dataset = local_dataset.model_copy(deep=True)
+    dataset.item.assets["data"].href = path.as_uri()
+    return dataset
+
+
 def pytest_addoption(parser: Parser) -> None:
     parser.addoption(
         "--integration",
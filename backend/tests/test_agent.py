@@ -3,6 +3,7 @@ from langchain_core.messages import HumanMessage
 
 import atlas_assistant.agent
 from atlas_assistant.context import Context
+from atlas_assistant.database import Database
 from atlas_assistant.settings import Settings
 
 
@@ -10,12 +11,12 @@ from atlas_assistant.settings import Settings
     "query", ("What crops are being grown in Kenya?", "What datasets are available?")
 )
 @pytest.mark.integration
-def test_query(query: str, settings: Settings) -> None:
+def test_query(query: str, settings: Settings, database: Database) -> None:
     agent = atlas_assistant.agent.create_agent(settings)
     _ = agent.invoke(
         {
             "messages": [HumanMessage(query)],
         },
         config={"configurable": {"thread_id": "test"}},
-        context=Context(settings=settings),
+        context=Context(settings=settings, database=database),
     )
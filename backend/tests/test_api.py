@@ -1,3 +1,7 @@
+import asyncio
+from collections.abc import AsyncIterator
+from typing import Any
+
 import pytest
 from fastapi.testclient import TestClient
 from langchain.messages import ToolMessage
@@ -5,7 +9,10 @@ from langgraph.graph.message import BaseMessage
 from pytest import FixtureRequest
 
 import atlas_assistant.api
+from atlas_assistant.context import Context
+from atlas_assistant.database import Database
 from atlas_assistant.dataset import Dataset
+from atlas_assistant.settings import Settings
 from atlas_assistant.state import BarChartMetadata, MapChartMetadata
 
 
@@ -108,3 +115,40 @@ def test_chat_two_responses(
         json={"query": "Can you make a bar chart out of that?"},
     )
     _ = response.raise_for_status()
+
+
+class HangingAgent:
+    """An agent that sends one message and then waits forever"""
+
+    class _State:
+        values: dict[str, Any] = {}
+
+    def get_state(self, _config: Any) -> _State:
+        return self._State()
+
+    async def astream(self, *_args: Any, **_kwargs: Any) -> AsyncIterator[Any]:
+        yield {
+            "tools": {
+                "messages": [
+                    ToolMessage(content="Working", name="a_tool", tool_call_id="foo")
+                ]
+            }
+        }
+        _ = await asyncio.Event().wait()
+
+
+@pytest.mark.asyncio
+async def test_query_agent_disconnect(settings: Settings, database: Database) -> None:
+    context = Context(settings=settings, database=database)
+    stream = atlas_assistant.api.query_agent(
+        HangingAgent(),  # pyright: ignore[reportArgumentType]
+        "A question",
+        "a-thread-id",
+        context,
+        event_stream=False,
+    )
+    _ = await anext(stream)
+    assert not context.cancelled.is_set()
+    # This is what Starlette does when the client goes away
+    await stream.aclose()
+    assert context.cancelled.is_set()
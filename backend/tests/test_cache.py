@@ -0,0 +1,136 @@
+import asyncio
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+from pydantic import BaseModel
+
+from atlas_assistant.cache import LruCache, ResponseCache, get_response_key
+
+
+def test_max_entries() -> None:
+    cache: LruCache[str, int] = LruCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats.evictions == 1
+
+
+def test_max_size() -> None:
+    cache: LruCache[str, str] = LruCache(max_entries=None, max_size=5, sizeof=len)
+    cache.put("a", "abc")
+    cache.put("b", "de")
+    assert cache.size == 5
+    cache.put("c", "f")
+    assert "a" not in cache
+    assert cache.size == 3
+    cache.put("d", "too long")
+    assert "d" not in cache
+
+
+def test_ttl() -> None:
+    cache: LruCache[str, int] = LruCache(ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_stats() -> None:
+    cache: LruCache[str, int] = LruCache()
+    assert cache.get_or_create("a", lambda: 1) == 1
+    assert cache.get_or_create("a", lambda: 2) == 1
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.hit_ratio == 0.5
+
+
+def test_max_size_requires_sizeof() -> None:
+    with pytest.raises(ValueError):
+        _ = LruCache(max_size=1)
+
+
+class Answer(BaseModel):
+    answer: str
+
+
+class OtherAnswer(BaseModel):
+    answer: str
+    explanation: str
+
+
+def test_response_key() -> None:
+    messages = [{"role": "user", "content": "A question"}]
+    key = get_response_key("a-model", messages, Answer)
+    assert key == get_response_key("a-model", [dict(messages[0])], Answer)
+    assert key != get_response_key("another-model", messages, Answer)
+    assert key != get_response_key(
+        "a-model", [{"role": "user", "content": "Another question"}], Answer
+    )
+    assert key != get_response_key("a-model", messages, OtherAnswer)
+
+
+def test_response_cache(tmp_path: Path) -> None:
+    path = tmp_path / "responses.sqlite3"
+    cache = ResponseCache(path=path)
+    assert cache.get("a-key", Answer) is None
+    cache.put("a-key", Answer(answer="42"))
+    response = cache.get("a-key", Answer)
+    assert response == Answer(answer="42")
+    # Callers get copies, so they can't change what's cached
+    assert response is not cache.get("a-key", Answer)
+    assert cache.stats.hits == 2
+
+    # Another process reads the file
+    other = ResponseCache(path=path)
+    assert other.get("a-key", Answer) == Answer(answer="42")
+    assert other.disk_stats.hits == 1
+    assert other.get("a-key", Answer) == Answer(answer="42")
+    assert other.stats.hits == 1
+
+
+def test_response_cache_ttl(tmp_path: Path) -> None:
+    path = tmp_path / "responses.sqlite3"
+    cache = ResponseCache(ttl=0.01, path=path)
+    cache.put("a-key", Answer(answer="42"))
+    time.sleep(0.02)
+    assert cache.get("a-key", Answer) is None
+    assert ResponseCache(ttl=0.01, path=path).get("a-key", Answer) is None
+    assert ResponseCache(path=path).get("a-key", Answer) == Answer(answer="42")
+
+
+def test_response_cache_async(tmp_path: Path) -> None:
+    path = tmp_path / "responses.sqlite3"
+
+    async def cache_and_read() -> Answer | None:
+        await ResponseCache(path=path).aput("a-key", Answer(answer="42"))
+        return await ResponseCache(path=path).aget("a-key", Answer)
+
+    assert asyncio.run(cache_and_read()) == Answer(answer="42")
+
+
+def test_response_cache_unreadable(tmp_path: Path) -> None:
+    path = tmp_path / "responses.sqlite3"
+    cache = ResponseCache(path=path)
+    assert cache.get("a-key", Answer) is None
+    with sqlite3.connect(path) as connection:
+        _ = connection.execute("DROP TABLE responses")
+    # A file that can't be read is a miss, rather than an error
+    assert cache.get("a-key", Answer) is None
+    assert cache.disk_stats.misses == 2
+
+
+def test_response_cache_prunes(tmp_path: Path) -> None:
+    path = tmp_path / "responses.sqlite3"
+    cache = ResponseCache(ttl=0.01, path=path)
+    cache.put("a-key", Answer(answer="42"))
+    time.sleep(0.02)
+    # Expired responses are only removed once in a while
+    cache.put("another-key", Answer(answer="43"))
+    with sqlite3.connect(path) as connection:
+        (count,) = connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+    assert count == 2
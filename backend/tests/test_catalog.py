@@ -0,0 +1,33 @@
+from pathlib import Path
+
+import pytest
+
+from atlas_assistant.catalog import build_catalog, get_view_name
+from atlas_assistant.database import Database
+from atlas_assistant.dataset import Dataset
+
+
+@pytest.fixture
+def catalog_path(tmp_path: Path, local_dataset: Dataset) -> Path:
+    missing = local_dataset.model_copy(deep=True)
+    missing.item.id = "missing"
+    missing.item.assets["data"].href = str(tmp_path / "missing.parquet")
+    catalog_path = tmp_path / "catalog.duckdb"
+    assert build_catalog(catalog_path, [local_dataset, missing]) == 1
+    return catalog_path
+
+
+def test_get_view_name(dataset: Dataset) -> None:
+    assert (
+        get_view_name(dataset)
+        == "haz_exposure_cmip6_ssa_jagermeyr_historic_severe_int_data"
+    )
+
+
+def test_catalog(catalog_path: Path, local_dataset: Dataset) -> None:
+    with Database(catalog=catalog_path) as database:
+        assert database.catalog
+        view = database.catalog.get_view(local_dataset)
+        assert view == get_view_name(local_dataset)
+        with database.cursor() as cursor:
+            assert cursor.sql(f"SELECT COUNT(*) FROM {view}").fetchall() == [(5,)]
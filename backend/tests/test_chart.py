@@ -0,0 +1,191 @@
+import json
+from typing import Any
+
+import pytest
+
+from atlas_assistant.chart import ChartInference, get_columns, infer_chart_metadata
+from atlas_assistant.state import (
+    BarChartMetadata,
+    BeeswarmChartMetadata,
+    ChartType,
+    DotPlotMetadata,
+    HeatmapChartMetadata,
+    LineChartMetadata,
+    MapChartMetadata,
+)
+
+COUNTRIES = json.dumps(
+    [
+        {"iso3": "KEN", "admin0_name": "Kenya", "crop": "maize", "value": 3.0},
+        {"iso3": "TZA", "admin0_name": "Tanzania", "crop": "maize", "value": 4.0},
+        {"iso3": "UGA", "admin0_name": "Uganda", "crop": "maize", "value": 1.0},
+    ]
+)
+
+REGIONS = json.dumps(
+    [
+        {"iso3": "KEN", "admin1_name": "Nairobi", "value": 1.0},
+        {"iso3": "KEN", "admin1_name": "Mombasa", "value": 2.0},
+        {"iso3": "TZA", "admin1_name": "Arusha", "value": 4.0},
+    ]
+)
+
+CROPS_BY_COUNTRY = json.dumps(
+    [
+        {"iso3": "KEN", "crop": "maize", "value": 3.0},
+        {"iso3": "KEN", "crop": "coffee", "value": 3.0},
+        {"iso3": "TZA", "crop": "maize", "value": 4.0},
+        {"iso3": "TZA", "crop": "sorghum", "value": 5.0},
+        {"iso3": "UGA", "crop": "maize", "value": 1.0},
+    ]
+)
+
+YEARS = json.dumps(
+    [
+        {"year": 2020, "crop": "maize", "value": 1.0, "value_margin": 0.1},
+        {"year": 2021, "crop": "maize", "value": 2.0, "value_margin": 0.1},
+        {"year": 2020, "crop": "coffee", "value": 3.0, "value_margin": 0.2},
+        {"year": 2021, "crop": "coffee", "value": 4.0, "value_margin": 0.2},
+    ]
+)
+
+
+def test_get_columns() -> None:
+    columns = get_columns(
+        json.dumps(
+            [
+                {"year": 2020, "timeframe": "2021-2040", "iso3": "KEN", "n": 1},
+                {"year": 2021, "timeframe": "2041-2060", "iso3": None, "n": 2.5},
+            ]
+        )
+    )
+    assert [(column.name, column.kind) for column in columns] == [
+        ("year", "temporal"),
+        ("timeframe", "temporal"),
+        ("iso3", "category"),
+        ("n", "number"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "chart_type,data,metadata",
+    [
+        (
+            "bar",
+            COUNTRIES,
+            BarChartMetadata(
+                title="Value by country",
+                x_column="admin0_name",
+                y_column="value",
+                grouping_column=None,
+            ),
+        ),
+        (
+            "map",
+            COUNTRIES,
+            MapChartMetadata(
+                title="Value by country",
+                id_column="iso3",
+                value_column="value",
+                admin_level="admin0",
+            ),
+        ),
+        (
+            "map",
+            REGIONS,
+            MapChartMetadata(
+                title="Value by region",
+                id_column="admin1_name",
+                value_column="value",
+                admin_level="admin1",
+            ),
+        ),
+        (
+            "line",
+            YEARS,
+            LineChartMetadata(
+                title="Value by year and crop",
+                x_column="year",
+                y_column="value",
+                grouping_column="crop",
+            ),
+        ),
+        (
+            "heatmap",
+            YEARS,
+            HeatmapChartMetadata(
+                title="Value by year and crop",
+                x_column="year",
+                y_column="crop",
+                value_column="value",
+            ),
+        ),
+        (
+            "beeswarm",
+            COUNTRIES,
+            BeeswarmChartMetadata(
+                title="Value by country",
+                category_column="admin0_name",
+                value_column="value",
+                color_column=None,
+            ),
+        ),
+        (
+            "dot",
+            COUNTRIES,
+            DotPlotMetadata(
+                title="Value by country",
+                x_column="admin0_name",
+                y_column="value",
+                grouping_column=None,
+                size_column=None,
+            ),
+        ),
+    ],
+)
+def test_infer_chart_metadata(chart_type: ChartType, data: str, metadata: Any) -> None:
+    inference = infer_chart_metadata(chart_type, data)
+    assert inference
+    assert inference.metadata == metadata
+    assert inference.confidence == 1
+
+
+@pytest.mark.parametrize(
+    "chart_type,data,confidence",
+    [
+        # Either column could be the x-axis
+        ("bar", CROPS_BY_COUNTRY, 0.5),
+        # There are several crops in each country
+        ("map", CROPS_BY_COUNTRY, 0.5),
+        ("beeswarm", CROPS_BY_COUNTRY, 0.5),
+        # There are no dates or times
+        ("line", COUNTRIES, None),
+        # There's only one dimension
+        ("heatmap", COUNTRIES, None),
+        # There are no geographic identifiers
+        ("map", YEARS, None),
+    ],
+)
+def test_infer_chart_metadata_ambiguous(
+    chart_type: ChartType, data: str, confidence: float | None
+) -> None:
+    inference = infer_chart_metadata(chart_type, data)
+    if confidence is None:
+        assert inference is None
+    else:
+        assert inference
+        assert inference.confidence == confidence
+
+
+def test_chart_inference() -> None:
+    charts = ChartInference(min_confidence=0.75)
+    assert charts.infer("map", COUNTRIES) == MapChartMetadata(
+        title="Value by country", id_column="iso3", value_column="value"
+    )
+    assert charts.infer("bar", CROPS_BY_COUNTRY) is None
+    charts.record("bar", 2.0)
+    assert charts.infer("bar", COUNTRIES)
+    assert charts.infer("bar", "not JSON") is None
+    assert charts.stats["map"].hit_ratio == 1
+    assert charts.stats["bar"].hit_ratio == 0.5
+    assert charts.stats["bar"].seconds_saved == 2.0
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+import duckdb
+import pyarrow as pa
+import pytest
+
+import atlas_assistant.database
+from atlas_assistant.database import (
+    Database,
+    QueryCancelledError,
+    QueryResult,
+    ResultCache,
+    normalize_sql,
+)
+
+
+def test_settings() -> None:
+    with Database(threads=2, memory_limit="1GB") as database:
+        settings = dict(
+            database.connection.sql(
+                "SELECT name, value FROM duckdb_settings() WHERE name IN "
+                "('enable_object_cache', 'enable_http_metadata_cache', 'threads')"
+            ).fetchall()
+        )
+    assert settings == {
+        "enable_object_cache": "true",
+        "enable_http_metadata_cache": "true",
+        "threads": "2",
+    }
+
+
+def test_concurrent_cursors(parquet_path: Path) -> None:
+    def query(crop: str) -> float:
+        with database.cursor() as connection:
+            result = connection.sql(
+                f"SELECT SUM(value) FROM '{parquet_path}' WHERE crop = ?",
+                params=[crop],
+            ).fetchone()
+            assert result
+            return result[0]
+
+    with Database() as database, ThreadPoolExecutor(4) as executor:
+        totals = list(executor.map(query, ["maize", "coffee", "sorghum"] * 10))
+    assert totals == [7.0, 3.0, 5.0] * 10
+
+
+def test_normalize_sql() -> None:
+    assert normalize_sql(
+        "SELECT  iso3\n FROM 'Data.parquet'\tWHERE crop = 'Maize';"
+    ) == normalize_sql("select iso3 from 'Data.parquet' where CROP = 'Maize'")
+    assert normalize_sql("SELECT 'A'") != normalize_sql("SELECT 'a'")
+    assert normalize_sql('SELECT "It""s  A"') == 'select "It""s  A"'
+
+
+def test_result_cache(parquet_path: Path) -> None:
+    href = parquet_path.as_uri()
+    result_cache = ResultCache(max_bytes=2**20, ttl=60)
+    executions = []
+
+    def execute() -> pa.Table:
+        executions.append(1)
+        return duckdb.sql(f"SELECT * FROM '{parquet_path}'").fetch_arrow_table()
+
+    first = result_cache.get_or_execute("SELECT * FROM data", href, execute)
+    second = result_cache.get_or_execute("select *  from DATA", href, execute)
+    assert first is second
+    assert len(executions) == 1
+    assert result_cache.stats.hit_ratio == 0.5
+
+
+def test_query_result() -> None:
+    result = QueryResult(
+        duckdb.sql(
+            "SELECT * FROM (VALUES "
+            "('KEN', 1.5, DATE '2024-01-02', 2.50::DECIMAL(4, 2)), "
+            "('TZA', 'NaN'::DOUBLE, NULL, NULL)) t(iso3, value, day, price)"
+        ).fetch_arrow_table()
+    )
+    assert len(result) == 2
+    assert result.json == (
+        '[{"iso3":"KEN","value":1.5,"day":"2024-01-02","price":2.5},'
+        '{"iso3":"TZA","value":null,"day":null,"price":null}]'
+    )
+    assert result.markdown.splitlines()[0].split("|")[1].strip() == "iso3"
+    assert "KEN" in result.markdown
+    table = pa.ipc.open_stream(result.ipc).read_all()
+    assert table.schema == result.table.schema
+    assert table.column("iso3").to_pylist() == ["KEN", "TZA"]
+
+
+SLOW_QUERY = "SELECT COUNT(*) FROM range(1000000000000) a WHERE a.range % 7 = 3"
+
+
+def test_execute() -> None:
+    with Database() as database:
+        assert database.execute("SELECT 42 AS answer").to_pylist() == [{"answer": 42}]
+
+
+def test_execute_timeout() -> None:
+    with Database() as database:
+        with pytest.raises(QueryCancelledError) as e:
+            _ = database.execute(SLOW_QUERY, timeout=0.2)
+        assert e.value.reason == "timed out"
+        # The database is still usable after an interrupted query
+        assert database.execute("SELECT 1 AS one").num_rows == 1
+
+
+def test_execute_cancelled() -> None:
+    cancelled = threading.Event()
+    timer = threading.Timer(0.2, cancelled.set)
+    timer.start()
+    with Database() as database, pytest.raises(QueryCancelledError) as e:
+        _ = database.execute(SLOW_QUERY, timeout=30, cancelled=cancelled)
+    assert e.value.reason == "was cancelled"
+    assert e.value.elapsed < 30
+
+
+class UninterruptibleCursor:
+    """A cursor whose queries take a second and can't be interrupted"""
+
+    def __init__(self, cursor: duckdb.DuckDBPyConnection) -> None:
+        self.cursor: duckdb.DuckDBPyConnection = cursor
+
+    def sql(self, query: str) -> duckdb.DuckDBPyRelation:
+        time.sleep(1)
+        return self.cursor.sql(query)
+
+    def interrupt(self) -> None:
+        pass
+
+
+def test_execute_uninterruptible(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(atlas_assistant.database, "INTERRUPT_TIMEOUT", 0.2)
+    with Database() as database:
+        cursor = database.cursor
+
+        @contextmanager
+        def uninterruptible_cursor() -> Iterator[Any]:
+            with cursor() as connection:
+                yield UninterruptibleCursor(connection)
+
+        monkeypatch.setattr(database, "cursor", uninterruptible_cursor)
+        start = time.monotonic()
+        # The error is raised without waiting for the query to finish
+        with pytest.raises(QueryCancelledError):
+            _ = database.execute("SELECT 1", timeout=0.1)
+        assert time.monotonic() - start < 0.9
@@ -0,0 +1,128 @@
+import asyncio
+import shutil
+import sqlite3
+from pathlib import Path
+
+from chromadb.api.client import SharedSystemClient
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+
+from atlas_assistant.embeddings import (
+    CachedEmbeddings,
+    VectorStore,
+    aembed_queries,
+    embed_queries,
+)
+
+
+def build(directory: Path, texts: list[str]) -> None:
+    if directory.exists():
+        shutil.rmtree(directory)
+    SharedSystemClient.clear_system_cache()
+    _ = Chroma.from_texts(
+        texts=texts,
+        embedding=DeterministicFakeEmbedding(size=8),
+        persist_directory=str(directory),
+    )
+
+
+def test_vector_store(tmp_path: Path) -> None:
+    directory = tmp_path / "embeddings"
+    build(directory, ["maize"])
+    created: list[Embeddings] = []
+
+    def get_embedding_function() -> Embeddings:
+        created.append(DeterministicFakeEmbedding(size=8))
+        return created[-1]
+
+    vector_store = VectorStore(directory, get_embedding_function)
+    chroma = vector_store.get()
+    assert vector_store.get() is chroma
+    assert chroma.get()["documents"] == ["maize"]
+
+    # Rebuilding the embeddings reopens them on the next search
+    build(directory, ["maize", "sorghum"])
+    reopened = vector_store.get()
+    assert reopened is not chroma
+    assert sorted(reopened.get()["documents"]) == ["maize", "sorghum"]
+
+    vector_store.reload()
+    assert vector_store.get() is not reopened
+    assert len(created) == 1
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    queries: list[str] = []
+
+    def embed_query(self, text: str) -> list[float]:
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def test_cached_embeddings(tmp_path: Path) -> None:
+    path = tmp_path / "query_embeddings.sqlite3"
+    embeddings = CountingEmbeddings(size=8, queries=[])
+    cached = CachedEmbeddings(embeddings, "fake", path=path)
+    embedding = cached.embed_query("Crop hazard  exposure Kenya")
+    assert embedding == embeddings.embed_query("crop hazard exposure kenya")
+    embeddings.queries.clear()
+
+    assert cached.embed_query(" crop hazard exposure kenya") == embedding
+    assert cached.stats.hits == 1
+    assert cached.stats.misses == 1
+
+    # A new process reads the embedding from disk
+    restarted = CachedEmbeddings(embeddings, "fake", path=path)
+    assert restarted.embed_query("crop hazard exposure Kenya") == embedding
+    assert restarted.disk_stats.hits == 1
+    assert embeddings.queries == []
+
+    # Other models' embeddings aren't reused
+    other = CachedEmbeddings(embeddings, "other", path=path)
+    _ = other.embed_query("crop hazard exposure kenya")
+    assert other.disk_stats.misses == 1
+    assert embeddings.queries == ["crop hazard exposure kenya"]
+
+
+def test_embed_queries() -> None:
+    embeddings = CountingEmbeddings(size=8, queries=[])
+    cached = CachedEmbeddings(embeddings, "fake")
+    first = cached.embed_query("maize")
+    assert cached.embed_queries(["Maize", "sorghum", "cassava", "sorghum"]) == [
+        first,
+        *embeddings.embed_documents(["sorghum", "cassava", "sorghum"]),
+    ]
+    assert embed_queries(cached, ["cassava"]) == [embeddings.embed_query("cassava")]
+    assert cached.stats.hits == 2
+    # Awaiting the embeddings API shares the same caches
+    assert asyncio.run(aembed_queries(cached, ["sorghum", "millet"])) == [
+        embeddings.embed_query("sorghum"),
+        embeddings.embed_query("millet"),
+    ]
+    assert cached.stats.hits == 3
+    assert asyncio.run(aembed_queries(cached, ["millet"])) == [
+        embeddings.embed_query("millet")
+    ]
+    assert cached.stats.hits == 4
+
+
+def test_aembed_queries_from_disk(tmp_path: Path) -> None:
+    path = tmp_path / "query_embeddings.sqlite3"
+    embeddings = CountingEmbeddings(size=8, queries=[])
+    cached = CachedEmbeddings(embeddings, "fake", path=path)
+    first = asyncio.run(cached.aembed_queries(["maize", "sorghum"]))
+    restarted = CachedEmbeddings(embeddings, "fake", path=path)
+    assert asyncio.run(restarted.aembed_queries(["sorghum", "maize"])) == first[::-1]
+    assert restarted.disk_stats.hits == 2
+
+
+def test_cached_embeddings_unreadable(tmp_path: Path) -> None:
+    path = tmp_path / "query_embeddings.sqlite3"
+    embeddings = CountingEmbeddings(size=8, queries=[])
+    cached = CachedEmbeddings(embeddings, "fake", path=path)
+    _ = cached.embed_query("maize")
+    with sqlite3.connect(path) as connection:
+        _ = connection.execute("DROP TABLE query_embeddings")
+    # A file that can't be read is a miss, rather than an error
+    assert cached.embed_query("sorghum") == embeddings.embed_query("sorghum")
+    assert cached.disk_stats.misses == 2
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from atlas_assistant.dataset import Dataset, Metadata
+from atlas_assistant.dataset.index import (
+    SUMMARY_LENGTH,
+    DatasetIndex,
+    create_entry,
+    get_document_id,
+    summarize,
+    write_index,
+)
+
+
+def test_summarize(dataset: Dataset) -> None:
+    summary = summarize(dataset)
+    assert summary
+    assert len(summary) <= SUMMARY_LENGTH
+    assert dataset.get_description().startswith(summary.rstrip("…"))
+
+
+def test_index(tmp_path: Path, dataset: Dataset) -> None:
+    path = tmp_path / "datasets.json"
+    id = get_document_id(dataset)
+    write_index(path, [create_entry(id, dataset)])
+
+    index = DatasetIndex(path)
+    assert index.get(id) == dataset
+    assert index.get("missing") is None
+    assert [entry.id for entry in index.list()] == [id]
+
+
+def test_index_from_metadatas(tmp_path: Path, dataset: Dataset) -> None:
+    id = get_document_id(dataset)
+    calls: list[None] = []
+
+    def get_metadatas() -> dict[str, Metadata]:
+        calls.append(None)
+        return {id: dataset.to_metadata()}
+
+    index = DatasetIndex(tmp_path / "datasets.json", get_metadatas)
+    assert index.get(id) == dataset
+    assert len(index.list()) == 1
+    assert len(calls) == 1
+
+    index.reload()
+    _ = index.list()
+    assert len(calls) == 2
@@ -0,0 +1,126 @@
+import os
+from pathlib import Path
+
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.ingest import (
+    IngestRecord,
+    Manifest,
+    ReusedEmbeddings,
+    create_directory,
+    hash_dataset,
+    link_artifacts,
+    read_datasets,
+    read_embeddings,
+    swap_directory,
+)
+
+CATALOG = Path(__file__).parent / "data" / "stac" / "catalog.json"
+
+
+@pytest.fixture
+def datasets() -> list[Dataset]:
+    return read_datasets(CATALOG.as_uri())
+
+
+def test_read_datasets(datasets: list[Dataset]) -> None:
+    assert [dataset.item.id for dataset in datasets] == [
+        "haz_exposure_cmip6_ssa_jagermeyr_historic_severe_int",
+        "haz_exposure_cmip6_ssa_jagermeyr_historic_moderate_int",
+        "haz_exposure_cmip6_ssa_jagermeyr_historic_extreme_int",
+    ]
+    assert datasets[0].asset.href.startswith("https://")
+
+
+def test_manifest(tmp_path: Path, datasets: list[Dataset]) -> None:
+    record = IngestRecord(hash=hash_dataset(datasets[0]), version="1", compiled=True)
+    manifest = Manifest(embedding_model="fake", records={"a": record})
+    manifest.write(tmp_path)
+    loaded = Manifest.load(tmp_path)
+    assert loaded == manifest
+    assert Manifest.load(tmp_path / "missing") is None
+
+    assert manifest.is_current("a", record.model_copy(update={"compiled": False}))
+    assert not manifest.is_current("b", record)
+    assert not manifest.is_current("a", record.model_copy(update={"version": "2"}))
+    assert not manifest.is_current("a", record.model_copy(update={"version": None}))
+    assert not manifest.is_current(
+        "a", record.model_copy(update={"hash": hash_dataset(datasets[1])})
+    )
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    batches: list[list[str]] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.batches.append(texts)
+        return super().embed_documents(texts)
+
+
+def test_reused_embeddings(tmp_path: Path) -> None:
+    _ = Chroma.from_texts(
+        texts=["maize", "sorghum"],
+        embedding=DeterministicFakeEmbedding(size=8),
+        persist_directory=str(tmp_path),
+    )
+    known = read_embeddings(tmp_path)
+    assert sorted(known) == ["maize", "sorghum"]
+    assert read_embeddings(tmp_path / "missing") == {}
+
+    counting = CountingEmbeddings(size=8, batches=[])
+    embeddings = ReusedEmbeddings(counting, known, batch_size=2)
+    texts = ["maize", "cassava", "millet", "sorghum", "teff", "cassava"]
+    assert embeddings.embed_documents(texts) == [
+        pytest.approx(embedding) for embedding in counting.embed_documents(texts)
+    ]
+    assert counting.batches[:2] == [["cassava", "millet"], ["teff"]]
+    assert embeddings.embedded == 3
+
+
+def test_link_artifacts(tmp_path: Path, datasets: list[Dataset]) -> None:
+    source = tmp_path / "source"
+    name = f"{datasets[0].item.id}.data"
+    for path in [
+        f"samples/{name}.json",
+        f"samples/{name}.sample.parquet",
+        f"layouts/{name}/iso3=KEN/data_0.parquet",
+        f"samples/{datasets[1].item.id}.data.json",
+    ]:
+        (source / path).parent.mkdir(parents=True, exist_ok=True)
+        _ = (source / path).write_text(path)
+
+    destination = tmp_path / "destination"
+    link_artifacts(source, destination, [Path("samples"), Path("layouts")], datasets[0])
+    assert sorted(
+        str(path.relative_to(destination))
+        for path in destination.rglob("*")
+        if path.is_file()
+    ) == [
+        f"layouts/{name}/iso3=KEN/data_0.parquet",
+        f"samples/{name}.json",
+        f"samples/{name}.sample.parquet",
+    ]
+    assert os.path.samefile(
+        source / "samples" / f"{name}.json", destination / "samples" / f"{name}.json"
+    )
+
+
+def test_swap_directory(tmp_path: Path) -> None:
+    target = tmp_path / "embeddings"
+    target.mkdir()
+    _ = (target / "version").write_text("0")
+
+    for version in ["1", "2"]:
+        directory = create_directory(target)
+        _ = (directory / "version").write_text(version)
+        swap_directory(directory, target)
+        assert target.is_symlink()
+        assert (target / "version").read_text() == version
+    # Only the current directory is left
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "embeddings",
+        target.resolve().name,
+    ]
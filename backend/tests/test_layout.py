@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.layout import build_layout, get_current_layout
+from atlas_assistant.dataset.scan import Footer
+from atlas_assistant.dataset.version import get_version
+from atlas_assistant.tools.sql import SqlQueryParts
+
+
+@pytest.fixture
+def laid_out_dataset(tmp_path: Path, admin2_dataset: Dataset) -> Dataset:
+    dataset = admin2_dataset.model_copy(deep=True)
+    dataset.layout = build_layout(
+        dataset, tmp_path / "layouts", get_version(dataset.asset.href)
+    )
+    return dataset
+
+
+def test_build_layout(laid_out_dataset: Dataset) -> None:
+    assert laid_out_dataset.layout
+    directory = Path(laid_out_dataset.layout.href).parents[1]
+    assert sorted(path.name for path in directory.iterdir()) == [
+        "iso3=KEN",
+        "iso3=TZA",
+    ]
+    rows = duckdb.sql(
+        f"SELECT admin1_name, crop FROM '{directory}/iso3=KEN/*.parquet'"
+    ).fetchall()
+    assert rows == sorted(rows)
+
+
+def test_build_layouts_of_one_item(tmp_path: Path, admin2_dataset: Dataset) -> None:
+    path = tmp_path / "kenya.parquet"
+    _ = duckdb.sql(
+        f"COPY (SELECT * FROM '{admin2_dataset.asset.href}' WHERE iso3 = 'KEN') "
+        f"TO '{path}' (FORMAT parquet)"
+    )
+    dataset = admin2_dataset.model_copy(deep=True)
+    dataset.item.assets["kenya"] = dataset.asset.model_copy(update={"href": str(path)})
+    datasets = [
+        dataset,
+        Dataset(item=dataset.item, asset_key="kenya"),
+    ]
+    directory = tmp_path / "layouts"
+    # The assets are laid out at once, as they are at ingest
+    with ThreadPoolExecutor(2) as executor:
+        layouts = list(
+            executor.map(
+                lambda d: build_layout(d, directory, None, duckdb.connect()), datasets
+            )
+        )
+    assert len({layout.href for layout in layouts}) == 2
+    assert [
+        sorted(path.name for path in Path(layout.href).parents[1].iterdir())
+        for layout in layouts
+    ] == [["iso3=KEN", "iso3=TZA"], ["iso3=KEN"]]
+    assert not list(directory.glob("*.tmp"))
+
+
+def test_query_layout(laid_out_dataset: Dataset) -> None:
+    assert laid_out_dataset.layout
+    sql_query_parts = SqlQueryParts(
+        select="iso3, admin1_name, crop, SUM(value) AS total",
+        where="iso3 = 'KEN' AND NOT isnan(value)",
+        group_by="iso3, admin1_name, crop",
+        order_by="iso3, admin1_name, crop",
+        limit=None,
+        explanation="Totals in Kenya",
+    )
+    base_query = sql_query_parts.get_query(laid_out_dataset.asset.href)
+    layout_query = sql_query_parts.get_query(
+        laid_out_dataset.layout.href, hive_partitioning=True
+    )
+    assert (
+        duckdb.sql(layout_query.query).fetchall()
+        == duckdb.sql(base_query.query).fetchall()
+    )
+
+    footer = Footer.read(laid_out_dataset.layout.href, hive_partitioning=True)
+    estimate = footer.estimate(sql_query_parts)
+    assert (estimate.row_groups, estimate.total_row_groups) == (1, 2)
+
+
+def test_get_current_layout(laid_out_dataset: Dataset) -> None:
+    assert get_current_layout(laid_out_dataset) == laid_out_dataset.layout
+    assert laid_out_dataset.layout
+    laid_out_dataset.layout.version = "stale"
+    assert get_current_layout(laid_out_dataset) is None
+
+
+def test_metadata(laid_out_dataset: Dataset) -> None:
+    dataset = laid_out_dataset.to_metadata().to_dataset()
+    assert dataset.layout == laid_out_dataset.layout
+
+
+def test_no_partition_column(tmp_path: Path, admin2_dataset: Dataset) -> None:
+    path = tmp_path / "no-iso3.parquet"
+    _ = duckdb.sql(f"COPY (SELECT 1 AS value) TO '{path}' (FORMAT parquet)")
+    dataset = admin2_dataset.model_copy(deep=True)
+    dataset.item.assets["data"].href = str(path)
+    with pytest.raises(ValueError):
+        _ = build_layout(dataset, tmp_path / "layouts", None)
@@ -0,0 +1,227 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.index import (
+    DatasetIndex,
+    create_entry,
+    get_document_id,
+    write_index,
+)
+from atlas_assistant.dataset.lexical import (
+    LexicalIndex,
+    fuse,
+    get_text,
+    is_confident,
+    tokenize,
+)
+from atlas_assistant.embeddings import VectorStore
+from atlas_assistant.settings import Settings
+from atlas_assistant.tools.dataset import asearch_candidates, search, search_candidates
+
+
+@pytest.fixture
+def datasets(dataset: Dataset) -> list[Dataset]:
+    livestock = dataset.model_copy(deep=True)
+    livestock.item.id = "livestock_heads"
+    livestock.item.properties.description = (
+        "The number of cattle, goats and sheep in each admin2 region."
+    )
+    return [dataset, livestock]
+
+
+@pytest.fixture
+def lexical(datasets: list[Dataset]) -> LexicalIndex:
+    texts = {get_document_id(d): get_text(d) for d in datasets}
+    # Other datasets, so that rare terms stand out like they would in the catalog
+    columns = " ".join(c.name for c in datasets[0].item.properties.table_columns)
+    texts.update({f"other_{i}/data": f"Dataset {i}\n{columns}" for i in range(20)})
+    return LexicalIndex.build(texts)
+
+
+def test_tokenize() -> None:
+    assert tokenize("What is the admin1_name of Haz-Exposure?") == [
+        "admin1",
+        "name",
+        "haz",
+        "exposure",
+    ]
+
+
+def test_lexical_index(
+    tmp_path: Path, lexical: LexicalIndex, datasets: list[Dataset]
+) -> None:
+    path = tmp_path / "lexical.json"
+    lexical.write(path)
+    loaded = LexicalIndex.load(path)
+    assert loaded == lexical
+    assert LexicalIndex.load(tmp_path / "missing.json") is None
+
+    results = lexical.search("goats and sheep")
+    assert [id for id, _ in results] == [get_document_id(datasets[1])]
+    assert is_confident(results)
+    assert not is_confident(lexical.search("admin2 region"))
+    assert lexical.search("nothing matches") == []
+
+
+def test_fuse() -> None:
+    assert [id for id, _ in fuse(["a", "b"], ["b", "c"])] == ["b", "a", "c"]
+
+
+def search_offline(
+    query: str, tmp_path: Path, datasets: list[Dataset], lexical: LexicalIndex
+) -> Dataset:
+    path = tmp_path / "datasets.json"
+    write_index(path, [create_entry(get_document_id(d), d) for d in datasets])
+
+    def get_embedding_function() -> Embeddings:
+        raise ConnectionError("offline")
+
+    return search(
+        query,
+        Settings(),
+        VectorStore(tmp_path / "embeddings", get_embedding_function),
+        DatasetIndex(path),
+        lexical,
+    ).dataset
+
+
+def test_search_confident(
+    tmp_path: Path, datasets: list[Dataset], lexical: LexicalIndex
+) -> None:
+    assert search_offline("goats", tmp_path, datasets, lexical) == datasets[1]
+
+
+def test_search_offline(
+    tmp_path: Path, datasets: list[Dataset], lexical: LexicalIndex
+) -> None:
+    # Not confident, but the embeddings can't be searched
+    assert not is_confident(lexical.search("hazard exposure of crops"))
+    assert (
+        search_offline("hazard exposure of crops", tmp_path, datasets, lexical)
+        == datasets[0]
+    )
+    with pytest.raises(ConnectionError):
+        _ = search_offline("nothing matches", tmp_path, datasets, lexical)
+
+
+def test_search_fused(
+    tmp_path: Path, datasets: list[Dataset], lexical: LexicalIndex
+) -> None:
+    from langchain_chroma import Chroma
+
+    ids = [get_document_id(d) for d in datasets]
+    _ = Chroma.from_texts(
+        texts=[d.get_description() for d in datasets],
+        ids=ids,
+        embedding=DeterministicFakeEmbedding(size=8),
+        persist_directory=str(tmp_path / "embeddings"),
+    )
+    path = tmp_path / "datasets.json"
+    write_index(
+        path, [create_entry(id, d) for id, d in zip(ids, datasets, strict=True)]
+    )
+    result = search(
+        "admin2 region",
+        Settings(),
+        VectorStore(
+            tmp_path / "embeddings", lambda: DeterministicFakeEmbedding(size=8)
+        ),
+        DatasetIndex(path),
+        lexical,
+    )
+    assert result.dataset in datasets
+    assert 0 < result.score <= 2 / 61
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: list[list[str]] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls.append(texts)
+        return super().embed_documents(texts)
+
+
+def test_search_candidates(
+    tmp_path: Path, datasets: list[Dataset], lexical: LexicalIndex
+) -> None:
+    from langchain_chroma import Chroma
+
+    ids = [get_document_id(d) for d in datasets]
+    _ = Chroma.from_texts(
+        texts=[d.get_description() for d in datasets],
+        ids=ids,
+        embedding=DeterministicFakeEmbedding(size=8),
+        persist_directory=str(tmp_path / "embeddings"),
+    )
+    path = tmp_path / "datasets.json"
+    write_index(
+        path, [create_entry(id, d) for id, d in zip(ids, datasets, strict=True)]
+    )
+    embeddings = CountingEmbeddings(size=8, calls=[])
+    results = search_candidates(
+        ["cattle and goats", "livestock in admin2 regions"],
+        Settings(),
+        VectorStore(tmp_path / "embeddings", lambda: embeddings),
+        DatasetIndex(path),
+        lexical,
+        k=2,
+    )
+    # Both queries are embedded in one request
+    assert embeddings.calls == [["cattle and goats", "livestock in admin2 regions"]]
+    assert [candidate.id for candidate in results.candidates] == [ids[1], ids[0]]
+    assert results.candidates[0].score > results.candidates[1].score
+    assert 0 < results.margin <= 1
+
+    # Confident keyword matches don't need the embeddings
+    results = search_candidates(
+        ["goats and sheep", "sheep and goats"],
+        Settings(),
+        VectorStore(tmp_path / "embeddings", lambda: embeddings),
+        DatasetIndex(path),
+        lexical,
+    )
+    assert len(embeddings.calls) == 1
+    assert results.candidates[0].dataset == datasets[1]
+    assert results.margin == 1
+
+
+def test_asearch_candidates(
+    tmp_path: Path, datasets: list[Dataset], lexical: LexicalIndex
+) -> None:
+    from langchain_chroma import Chroma
+
+    ids = [get_document_id(d) for d in datasets]
+    _ = Chroma.from_texts(
+        texts=[d.get_description() for d in datasets],
+        ids=ids,
+        embedding=DeterministicFakeEmbedding(size=8),
+        persist_directory=str(tmp_path / "embeddings"),
+    )
+    path = tmp_path / "datasets.json"
+    write_index(
+        path, [create_entry(id, d) for id, d in zip(ids, datasets, strict=True)]
+    )
+    queries = ["cattle and goats", "livestock in admin2 regions"]
+    vector_store = VectorStore(
+        tmp_path / "embeddings", lambda: DeterministicFakeEmbedding(size=8)
+    )
+    expected = search_candidates(
+        queries, Settings(), vector_store, DatasetIndex(path), lexical
+    )
+    with ThreadPoolExecutor(1) as executor:
+        results = asyncio.run(
+            asearch_candidates(
+                queries,
+                Settings(),
+                vector_store,
+                DatasetIndex(path),
+                lexical,
+                executor=executor,
+            )
+        )
+    assert results == expected
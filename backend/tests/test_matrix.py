@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from atlas_assistant.embeddings import VectorStore
+from atlas_assistant.matrix import MatrixStore
+
+TEXTS = ["maize", "sorghum", "cassava", "millet", "teff"]
+
+
+def test_matrix_store(tmp_path: Path) -> None:
+    embedding = DeterministicFakeEmbedding(size=8)
+    _ = MatrixStore.from_texts(
+        TEXTS,
+        embedding,
+        metadatas=[{"crop": text} for text in TEXTS],
+        ids=[f"id-{text}" for text in TEXTS],
+        persist_directory=str(tmp_path),
+    )
+    store = MatrixStore.load(tmp_path, embedding)
+    assert store.get()["ids"] == [f"id-{text}" for text in TEXTS]
+    assert store.get(include=["metadatas"])["metadatas"][0] == {"crop": "maize"}
+
+    chroma = Chroma.from_texts(
+        TEXTS, embedding, persist_directory=str(tmp_path / "chroma")
+    )
+    for query in ["maize", "rice"]:
+        results = store.similarity_search_with_score(query, k=3)
+        expected = chroma.similarity_search_with_score(query, k=3)
+        assert [document.page_content for document, _ in results] == [
+            document.page_content for document, _ in expected
+        ]
+        assert [score for _, score in results] == [
+            pytest.approx(score, abs=1e-4) for _, score in expected
+        ]
+    document, score = store.similarity_search_with_score("teff", k=1)[0]
+    assert document.id == "id-teff"
+    assert document.metadata == {"crop": "teff"}
+    assert score == pytest.approx(0, abs=1e-4)
+    assert len(store.similarity_search("maize", k=10)) == len(TEXTS)
+
+
+def test_vector_store_numpy(tmp_path: Path) -> None:
+    embedding = DeterministicFakeEmbedding(size=8)
+    _ = MatrixStore.from_texts(["maize"], embedding, persist_directory=str(tmp_path))
+    vector_store = VectorStore(tmp_path, lambda: embedding, backend="numpy")
+    store = vector_store.get()
+    assert isinstance(store, MatrixStore)
+    assert vector_store.get() is store
+
+    _ = MatrixStore.from_texts(
+        ["maize", "sorghum"], embedding, persist_directory=str(tmp_path)
+    )
+    assert vector_store.get().get()["documents"] == ["maize", "sorghum"]
@@ -0,0 +1,148 @@
+import os
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import duckdb
+import pytest
+
+import atlas_assistant.dataset.version
+from atlas_assistant.database import ResultCache
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.mirror import Mirror
+from atlas_assistant.dataset.version import VersionCache
+from atlas_assistant.tools.sql import SqlQueryParts
+
+
+def test_hit_and_miss(tmp_path: Path, parquet_path: Path) -> None:
+    mirror = Mirror(tmp_path / "mirror", max_bytes=2**30)
+    path = mirror.get_path(parquet_path.as_uri())
+    assert path.read_bytes() == parquet_path.read_bytes()
+    assert mirror.get_path(parquet_path.as_uri()) == path
+    assert mirror.stats.misses == 1
+    assert mirror.stats.hits == 1
+
+
+def test_persists_across_instances(tmp_path: Path, parquet_path: Path) -> None:
+    _ = Mirror(tmp_path / "mirror", max_bytes=2**30).get_path(parquet_path.as_uri())
+    mirror = Mirror(tmp_path / "mirror", max_bytes=2**30)
+    _ = mirror.get_path(parquet_path.as_uri())
+    assert mirror.stats.hits == 1
+
+
+def test_eviction(tmp_path: Path, parquet_path: Path) -> None:
+    other_path = tmp_path / "other.parquet"
+    duckdb.sql(f"COPY (SELECT 42 AS value) TO '{other_path}' (FORMAT parquet)")
+    mirror = Mirror(tmp_path / "mirror", max_bytes=parquet_path.stat().st_size)
+    first = mirror.get_path(parquet_path.as_uri())
+    second = mirror.get_path(other_path.as_uri())
+    assert not first.exists()
+    assert second.exists()
+    assert mirror.stats.evictions == 1
+
+
+def test_changed_version(tmp_path: Path, parquet_path: Path) -> None:
+    versions = VersionCache(ttl=0)
+    mirror = Mirror(tmp_path / "mirror", max_bytes=2**30, versions=versions)
+    first = mirror.get_path(parquet_path.as_uri())
+    duckdb.sql(f"COPY (SELECT 42 AS value) TO '{parquet_path}' (FORMAT parquet)")
+    second = mirror.get_path(parquet_path.as_uri())
+    assert first != second
+    assert mirror.stats.misses == 2
+
+
+def test_shared_versions(
+    tmp_path: Path, parquet_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    hrefs: list[str] = []
+
+    def get_version(href: str, timeout: float) -> str:
+        hrefs.append(href)
+        return "v1"
+
+    monkeypatch.setattr(atlas_assistant.dataset.version, "get_version", get_version)
+    versions = VersionCache()
+    mirror = Mirror(tmp_path / "mirror", max_bytes=2**30, versions=versions)
+    result_cache = ResultCache(max_bytes=2**20, ttl=60, versions=versions)
+    _ = mirror.get_path(parquet_path.as_uri())
+    _ = result_cache.get_or_execute(
+        "SELECT 42",
+        parquet_path.as_uri(),
+        lambda: duckdb.sql("SELECT 42").fetch_arrow_table(),
+    )
+    assert hrefs == [parquet_path.as_uri()]
+
+
+def test_resolve_falls_back_to_href(tmp_path: Path) -> None:
+    mirror = Mirror(tmp_path / "mirror", max_bytes=2**30)
+    href = (tmp_path / "does-not-exist.parquet").as_uri()
+    with mirror.resolve(href) as source:
+        assert source == href
+
+
+def test_pinned_copy_is_not_evicted(tmp_path: Path, parquet_path: Path) -> None:
+    other_path = tmp_path / "other.parquet"
+    duckdb.sql(f"COPY (SELECT 42 AS value) TO '{other_path}' (FORMAT parquet)")
+    mirror = Mirror(tmp_path / "mirror", max_bytes=parquet_path.stat().st_size)
+    with mirror.resolve(parquet_path.as_uri()) as source:
+        _ = mirror.get_path(other_path.as_uri())
+        assert Path(source).exists()
+        assert mirror.stats.evictions == 0
+    assert not Path(source).exists()
+    assert mirror.stats.evictions == 1
+
+
+def test_query_local_copy(tmp_path: Path, local_dataset: Dataset) -> None:
+    mirror = Mirror(tmp_path / "mirror", max_bytes=2**30)
+    sql_query_parts = SqlQueryParts(
+        select="iso3, SUM(value) AS value",
+        where="crop = 'maize'",
+        group_by="iso3",
+        order_by="iso3",
+        limit=None,
+        explanation="Maize value by country",
+    )
+    with mirror.resolve(local_dataset.asset.href) as source:
+        sql_query = sql_query_parts.get_query(source)
+        assert duckdb.sql(sql_query.query).fetchall() == [("KEN", 3.0), ("TZA", 4.0)]
+    assert "KEN" in local_dataset.get_head_table(mirror=mirror)
+
+
+def test_concurrent_misses_share_a_download(
+    tmp_path: Path, parquet_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    hrefs: list[str] = []
+    urlopen = urllib.request.urlopen
+
+    def slow_urlopen(url: str | urllib.request.Request, timeout: float) -> Any:
+        # Versions are requested too, but only downloads are by href
+        if isinstance(url, str):
+            hrefs.append(url)
+            time.sleep(0.2)
+        return urlopen(url, timeout=timeout)
+
+    monkeypatch.setattr(urllib.request, "urlopen", slow_urlopen)
+    mirror = Mirror(tmp_path / "mirror", max_bytes=2**30)
+    with ThreadPoolExecutor(4) as executor:
+        paths = list(
+            executor.map(lambda _: mirror.get_path(parquet_path.as_uri()), range(4))
+        )
+    assert hrefs == [parquet_path.as_uri()]
+    assert len(set(paths)) == 1
+    assert (mirror.stats.misses, mirror.stats.hits) == (1, 3)
+
+
+def test_stale_temporary_files(tmp_path: Path) -> None:
+    directory = tmp_path / "mirror"
+    directory.mkdir()
+    stale = directory / "stale.tmp"
+    stale.touch()
+    os.utime(stale, (0, 0))
+    # Another process may still be writing this one
+    current = directory / "current.tmp"
+    current.touch()
+    _ = Mirror(directory, max_bytes=2**30)
+    assert not stale.exists()
+    assert current.exists()
@@ -0,0 +1,137 @@
+import asyncio
+import math
+import threading
+import time
+from typing import Any, override
+
+from langchain.tools import ToolRuntime
+
+from atlas_assistant.cache import ResponseCache
+from atlas_assistant.chart import ChartInference
+from atlas_assistant.context import Context
+from atlas_assistant.database import Database
+from atlas_assistant.settings import (
+    CachedCodeClient,
+    CodeClient,
+    Message,
+    PydanticModel,
+    Settings,
+)
+from atlas_assistant.state import BarChartMetadata, MapChartMetadata
+from atlas_assistant.tools.plot import generate_chart_metadata
+
+CHART_METADATA = BarChartMetadata(
+    title="Value by country", x_column="iso3", y_column="value", grouping_column=None
+)
+
+
+class SlowCodeClient(CodeClient):
+    """Answers with the same chart metadata, after a while"""
+
+    @override
+    def chat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        raise AssertionError("Only async chats are expected")
+
+    @override
+    async def achat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        await asyncio.sleep(0.5)
+        return CHART_METADATA  # pyright: ignore[reportReturnType]
+
+
+def test_generate_chart_metadata_concurrently(
+    settings: Settings, database: Database
+) -> None:
+    client = SlowCodeClient()
+    # Every chart's metadata is generated, however obvious
+    charts = ChartInference(min_confidence=math.inf)
+    context = Context(
+        settings=settings, database=database, code_client=client, charts=charts
+    )
+
+    async def generate(i: int) -> Any:
+        state: Any = {"data": '[{"iso3":"KEN","value":3.0}]', "messages": []}
+        runtime = ToolRuntime(
+            state=state,
+            context=context,
+            config={},
+            stream_writer=lambda _: None,
+            tool_call_id=f"tool-call-{i}",
+            store=None,
+        )
+        assert generate_chart_metadata.coroutine
+        return await generate_chart_metadata.coroutine(
+            chart_type="bar", runtime=runtime
+        )
+
+    async def generate_all() -> list[Any]:
+        return await asyncio.gather(*(generate(i) for i in range(300)))
+
+    threads = threading.active_count()
+    start = time.monotonic()
+    commands = asyncio.run(generate_all())
+    # The chats wait together, without a thread each
+    assert time.monotonic() - start < 5
+    assert threading.active_count() <= threads + 1
+    assert all(
+        command.update["chart_metadata"] == CHART_METADATA for command in commands
+    )
+    assert charts.stats["bar"].generated == 300
+
+
+def test_generate_chart_metadata_inferred(
+    settings: Settings, database: Database
+) -> None:
+    charts = ChartInference()
+    state: Any = {"data": '[{"iso3":"KEN","value":3.0}]', "messages": []}
+    runtime = ToolRuntime(
+        state=state,
+        context=Context(
+            settings=settings,
+            database=database,
+            code_client=SlowCodeClient(),
+            charts=charts,
+        ),
+        config={},
+        stream_writer=lambda _: None,
+        tool_call_id="a-tool-call-id",
+        store=None,
+    )
+    # The slow client isn't asked
+    command = generate_chart_metadata.func(chart_type="map", runtime=runtime)  # pyright: ignore[reportOptionalCall]
+    assert command.update["chart_metadata"] == MapChartMetadata(
+        title="Value by country", id_column="iso3", value_column="value"
+    )
+    assert charts.stats["map"].inferred == 1
+
+
+def test_generate_chart_metadata_cached(settings: Settings, database: Database) -> None:
+    charts = ChartInference(min_confidence=math.inf)
+    client = CachedCodeClient(SlowCodeClient(), "a-model", ResponseCache())
+    context = Context(
+        settings=settings, database=database, code_client=client, charts=charts
+    )
+    state: Any = {"data": '[{"iso3":"KEN","value":3.0}]', "messages": []}
+    runtime = ToolRuntime(
+        state=state,
+        context=context,
+        config={},
+        stream_writer=lambda _: None,
+        tool_call_id="a-tool-call-id",
+        store=None,
+    )
+
+    async def generate() -> Any:
+        assert generate_chart_metadata.coroutine
+        return await generate_chart_metadata.coroutine(
+            chart_type="bar", runtime=runtime
+        )
+
+    for _ in range(2):
+        command = asyncio.run(generate())
+        assert command.update["chart_metadata"] == CHART_METADATA
+    # The cached answer took no time, so it isn't counted as the model's
+    assert charts.stats["bar"].generated == 1
@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pytest
+
+import atlas_assistant.prompt
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.profile import (
+    MAX_APPROX_VALUES,
+    ProfileStore,
+    profile_dataset,
+)
+from atlas_assistant.prompt import CompiledPrompt, PromptCache, compile_prompt
+
+
+def test_compile_prompt(local_dataset: Dataset) -> None:
+    compiled_prompt = compile_prompt(local_dataset)
+    assert compiled_prompt.item_id == local_dataset.item.id
+    assert compiled_prompt.version
+    assert "Nairobi" in compiled_prompt.prompt
+
+
+def test_precompiled_prompt(tmp_path: Path, local_dataset: Dataset) -> None:
+    prompt_cache = PromptCache(tmp_path)
+    compiled_prompt = compile_prompt(local_dataset)
+    compiled_prompt.prompt = "precompiled"
+    prompt_cache.write(compiled_prompt)
+    assert prompt_cache.get(local_dataset) == "precompiled"
+
+
+def test_stale_prompt(tmp_path: Path, local_dataset: Dataset) -> None:
+    prompt_cache = PromptCache(tmp_path)
+    prompt_cache.write(
+        CompiledPrompt(
+            item_id=local_dataset.item.id,
+            asset_key=local_dataset.asset_key,
+            version="stale",
+            prompt="precompiled",
+        )
+    )
+    assert "Nairobi" in prompt_cache.get(local_dataset)
+
+
+def test_in_memory(tmp_path: Path, local_dataset: Dataset) -> None:
+    prompt_cache = PromptCache(tmp_path / "prompts")
+    prompt = prompt_cache.get(local_dataset)
+    assert not prompt_cache.directory.exists()
+    assert prompt_cache.get(local_dataset) is prompt
+
+
+def test_asset_keys(tmp_path: Path, local_dataset: Dataset) -> None:
+    prompt_cache = PromptCache(tmp_path / "prompts")
+    other_dataset = local_dataset.model_copy(deep=True)
+    other_dataset.item.assets["other"] = other_dataset.asset
+    other_dataset.asset_key = "other"
+    compiled_prompt = compile_prompt(local_dataset)
+    compiled_prompt.prompt = "data"
+    prompt_cache.write(compiled_prompt)
+    compiled_prompt = compile_prompt(other_dataset)
+    compiled_prompt.prompt = "other"
+    prompt_cache.write(compiled_prompt)
+    assert prompt_cache.get(local_dataset) == "data"
+    assert prompt_cache.get(other_dataset) == "other"
+
+
+def test_compile_prompt_without_version(
+    local_dataset: Dataset, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def get_version(href: str) -> str:
+        raise OSError(f"Could not reach {href}")
+
+    monkeypatch.setattr(atlas_assistant.prompt, "get_version", get_version)
+    compiled_prompt = compile_prompt(local_dataset)
+    assert compiled_prompt.version is None
+    assert "Nairobi" in compiled_prompt.prompt
+
+
+def test_profile(local_dataset: Dataset) -> None:
+    profile = profile_dataset(local_dataset)
+    assert profile.row_count == 5
+    crop = profile.get_column("crop")
+    assert crop
+    assert crop.values == ["coffee", "maize", "sorghum"]
+    assert crop.null_fraction == 0.0
+    value = profile.get_column("value")
+    assert value
+    assert (value.min, value.max, value.values) == ("1.0", "5.0", None)
+
+
+def test_profile_many_values(admin2_dataset: Dataset) -> None:
+    profile = profile_dataset(admin2_dataset)
+    admin1_name = profile.get_column("admin1_name")
+    assert admin1_name
+    assert admin1_name.values == ["Region 0", "Region 1", "Region 2", "Region 3"]
+    # Too many to list, or even to collect
+    admin2_name = profile.get_column("admin2_name")
+    assert admin2_name
+    assert admin2_name.approx_unique > MAX_APPROX_VALUES
+    assert admin2_name.values is None
+
+
+def test_profile_in_prompt(tmp_path: Path, local_dataset: Dataset) -> None:
+    profile_store = ProfileStore(tmp_path / "profiles")
+    profile_store.write(profile_dataset(local_dataset))
+    prompt_cache = PromptCache(tmp_path / "prompts", profiles=profile_store)
+    prompt = prompt_cache.get(local_dataset)
+    # The item doesn't list these, so they come from the profile
+    assert "The `admin1_name` column has the following values:" in prompt
+    assert "- Dodoma" in prompt
+    assert "The dataset has 5 rows" in prompt
+
+
+def test_view_in_prompt(tmp_path: Path, local_dataset: Dataset) -> None:
+    prompt_cache = PromptCache(tmp_path / "prompts")
+    # Only datasets in the catalog have a view
+    assert "table named" not in prompt_cache.get(local_dataset)
+    prompt = prompt_cache.get(local_dataset, view="a_view")
+    assert "The dataset is also a table named `a_view`" in prompt
+    assert "table named" not in prompt_cache.get(local_dataset)
@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.rollup import RollupStore, results_match, rewrite
+from atlas_assistant.dataset.version import get_version
+from atlas_assistant.tools.sql import SqlQueryParts
+
+
+@pytest.fixture
+def rollup_store(tmp_path: Path, admin2_dataset: Dataset) -> RollupStore:
+    rollup_store = RollupStore(tmp_path / "rollups")
+    _ = rollup_store.build(admin2_dataset, get_version(admin2_dataset.asset.href))
+    return rollup_store
+
+
+def parts(
+    select: str = "iso3, SUM(value) AS total",
+    where: str = "NOT isnan(value)",
+    group_by: str | None = "iso3",
+    order_by: str | None = "iso3",
+) -> SqlQueryParts:
+    return SqlQueryParts(
+        select=select,
+        where=where,
+        group_by=group_by,
+        order_by=order_by,
+        limit=None,
+        explanation="A test query",
+    )
+
+
+def test_build(rollup_store: RollupStore, admin2_dataset: Dataset) -> None:
+    rollup_set = rollup_store.build(admin2_dataset, version="v1")
+    assert [rollup.level for rollup in rollup_set.rollups] == ["admin0", "admin1"]
+    assert rollup_set.rollups[0].dropped == ["admin2_name", "admin1_name"]
+    assert rollup_set.rollups[0].measures == ["value"]
+
+
+@pytest.mark.parametrize(
+    "sql_query_parts",
+    [
+        parts(),
+        parts(
+            select="crop, COUNT(*) AS n, AVG(value) AS mean",
+            group_by="crop",
+            order_by=None,
+        ),
+        parts(
+            select="admin1_name, MIN(value) AS low, MAX(value) AS high",
+            where="crop = 'maize' AND NOT isnan(value)",
+            group_by="admin1_name",
+            order_by="admin1_name",
+        ),
+        parts(select="iso3, COUNT(DISTINCT crop) AS crops", where="true"),
+    ],
+)
+def test_routed_results_match(
+    rollup_store: RollupStore, admin2_dataset: Dataset, sql_query_parts: SqlQueryParts
+) -> None:
+    rollup_query = rollup_store.route(admin2_dataset, sql_query_parts)
+    assert rollup_query
+    assert "rollups" in rollup_query
+    base_query = sql_query_parts.get_query(admin2_dataset.asset.href).query
+    assert results_match(
+        duckdb.sql(rollup_query).fetch_arrow_table(),
+        duckdb.sql(base_query).fetch_arrow_table(),
+        ordered=bool(sql_query_parts.order_by),
+    )
+
+
+@pytest.mark.parametrize(
+    "sql_query_parts",
+    [
+        # Needs a column that was aggregated away
+        parts(select="admin2_name, SUM(value)", group_by="admin2_name"),
+        # NaNs would make the totals NaN
+        parts(where="true"),
+        parts(where="crop = 'maize' OR NOT isnan(value)"),
+        # Row-level results
+        parts(select="iso3, value", group_by=None),
+        # Depends on the number of rows
+        parts(select="iso3, COUNT(crop)"),
+        parts(select="iso3, SUM(value * 2)"),
+        parts(where="NOT isnan(value) AND value > 10"),
+    ],
+)
+def test_not_routed(
+    rollup_store: RollupStore, admin2_dataset: Dataset, sql_query_parts: SqlQueryParts
+) -> None:
+    rollup_set = rollup_store.build(admin2_dataset, version=None)
+    assert rollup_set.rollups
+    assert all(
+        rewrite(sql_query_parts, rollup) is None for rollup in rollup_set.rollups
+    )
+
+
+def test_stale_rollups_are_not_used(
+    rollup_store: RollupStore, admin2_dataset: Dataset
+) -> None:
+    _ = rollup_store.build(admin2_dataset, version="stale")
+    assert rollup_store.route(admin2_dataset, parts()) is None
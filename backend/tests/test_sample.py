@@ -0,0 +1,121 @@
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.sample import Approximation, SampleStore, sample_relation
+from atlas_assistant.dataset.version import get_version
+from atlas_assistant.tools.sql import SqlQueryParts, get_relation
+
+
+def parts(
+    select: str = "iso3, SUM(value) AS total, COUNT(*) AS n",
+    where: str = "NOT isnan(value)",
+    group_by: str | None = "iso3",
+    order_by: str | None = "iso3",
+) -> SqlQueryParts:
+    return SqlQueryParts(
+        select=select,
+        where=where,
+        group_by=group_by,
+        order_by=order_by,
+        limit=None,
+        explanation="A test query",
+    )
+
+
+@pytest.mark.parametrize(
+    "sql_query_parts",
+    [
+        parts(),
+        parts(select="AVG(value) AS mean", group_by=None, order_by=None),
+        parts(select="crop, COUNT(value)", group_by="crop", order_by="COUNT(value)"),
+    ],
+)
+def test_eligible(sql_query_parts: SqlQueryParts) -> None:
+    assert Approximation.from_query_parts(sql_query_parts)
+
+
+@pytest.mark.parametrize(
+    "sql_query_parts",
+    [
+        parts(select="iso3, value", group_by=None),
+        parts(select="*", group_by=None),
+        parts(select="iso3, MAX(value)"),
+        parts(select="iso3, COUNT(DISTINCT crop)"),
+        parts(select="iso3, median(value)"),
+    ],
+)
+def test_not_eligible(sql_query_parts: SqlQueryParts) -> None:
+    assert Approximation.from_query_parts(sql_query_parts) is None
+
+
+def test_small_strata_are_sampled_whole(
+    tmp_path: Path, admin2_dataset: Dataset
+) -> None:
+    sample_store = SampleStore(tmp_path / "samples")
+    sample = sample_store.build(
+        admin2_dataset, get_version(admin2_dataset.asset.href), 0.01
+    )
+    assert sample.row_count == 200
+    stored = sample_store.get(admin2_dataset)
+    assert stored
+    path, _ = stored
+
+    sql_query_parts = parts()
+    approximation = Approximation.from_query_parts(sql_query_parts)
+    assert approximation
+    relation = get_relation(str(path))
+    table = approximation.add_margins(
+        duckdb.sql(
+            approximation.estimate.get_query_from(relation).query
+        ).fetch_arrow_table(),
+        duckdb.sql(
+            approximation.replicates.get_query_from(relation).query
+        ).fetch_arrow_table(),
+    )
+    assert table.column_names == ["iso3", "total", "total_margin", "n", "n_margin"]
+    exact = duckdb.sql(sql_query_parts.get_query(admin2_dataset.asset.href).query)
+    for row, (iso3, total, n) in zip(table.to_pylist(), exact.fetchall(), strict=True):
+        assert row["iso3"] == iso3
+        assert row["total"] == pytest.approx(total)
+        assert row["n"] == pytest.approx(n)
+        assert row["total_margin"] > 0
+
+
+def test_stale_samples_are_not_used(tmp_path: Path, admin2_dataset: Dataset) -> None:
+    sample_store = SampleStore(tmp_path / "samples")
+    _ = sample_store.build(admin2_dataset, "stale", 0.01)
+    assert sample_store.get(admin2_dataset) is None
+
+
+def test_sample_on_the_fly(tmp_path: Path) -> None:
+    path = tmp_path / "large.parquet"
+    _ = duckdb.sql(
+        f"""COPY (
+            SELECT i % 2 AS parity, (i % 100)::DOUBLE AS value FROM range(200000) t(i)
+        ) TO '{path}' (FORMAT parquet)"""
+    )
+    sql_query_parts = parts(
+        select="parity, SUM(value) AS total, AVG(value) AS mean",
+        where="true",
+        group_by="parity",
+        order_by="parity",
+    )
+    approximation = Approximation.from_query_parts(sql_query_parts)
+    assert approximation
+    relation = sample_relation(get_relation(str(path)), 0.1)
+    table = approximation.add_margins(
+        duckdb.sql(
+            approximation.estimate.get_query_from(relation).query
+        ).fetch_arrow_table(),
+        duckdb.sql(
+            approximation.replicates.get_query_from(relation).query
+        ).fetch_arrow_table(),
+    )
+    exact = duckdb.sql(sql_query_parts.get_query(str(path)).query).fetchall()
+    for row, (_, total, mean) in zip(table.to_pylist(), exact, strict=True):
+        assert row["total"] == pytest.approx(total, rel=0.05)
+        assert row["mean"] == pytest.approx(mean, rel=0.05)
+        assert 0 < row["total_margin"] < total * 0.05
@@ -0,0 +1,114 @@
+from pathlib import Path
+
+import duckdb
+import pytest
+
+from atlas_assistant.dataset.scan import Footer, FooterCache, parse_predicate
+from atlas_assistant.dataset.version import VersionCache
+from atlas_assistant.tools.sql import SqlQueryParts
+
+
+@pytest.fixture
+def footer(tmp_path: Path) -> Footer:
+    """A footer of a file with a row group per country, sorted by value."""
+    path = tmp_path / "sorted.parquet"
+    _ = duckdb.sql(
+        f"""COPY (
+            SELECT
+                ['AGO', 'BEN', 'KEN', 'TZA'][i // 2048 + 1] AS iso3,
+                'District ' || i AS admin2_name,
+                i::DOUBLE AS value
+            FROM range(4 * 2048) t(i)
+        ) TO '{path}' (FORMAT parquet, ROW_GROUP_SIZE 2048)"""
+    )
+    return Footer.read(str(path))
+
+
+def parts(select: str = "admin2_name, value", where: str = "true") -> SqlQueryParts:
+    return SqlQueryParts(
+        select=select,
+        where=where,
+        group_by=None,
+        order_by=None,
+        limit=None,
+        explanation="A test query",
+    )
+
+
+def test_read(footer: Footer) -> None:
+    assert len(footer.row_groups) == 4
+    assert footer.row_groups[2].bounds["iso3"] == ("KEN", "KEN")
+    assert footer.row_groups[2].bounds["value"] == (4096.0, 6143.0)
+
+
+@pytest.mark.parametrize(
+    "where, row_groups",
+    [
+        ("true", 4),
+        ("iso3 = 'KEN'", 1),
+        ("(\"iso3\" = 'KEN')", 1),
+        ("iso3 IN ('KEN', 'TZA')", 2),
+        ("iso3 = 'KEN' AND value < 5000", 1),
+        ("value >= 5000", 2),
+        ("value < 0", 0),
+        # Anything but top-level ANDs of simple comparisons can't prune
+        ("iso3 = 'KEN' OR value < 10", 4),
+        ("lower(iso3) = 'ken'", 4),
+        ("iso3 = 1", 4),
+    ],
+)
+def test_estimate_row_groups(footer: Footer, where: str, row_groups: int) -> None:
+    estimate = footer.estimate(parts(where=where))
+    assert estimate.row_groups == row_groups
+    assert estimate.total_row_groups == 4
+
+
+def test_estimate_columns(footer: Footer) -> None:
+    everything = footer.estimate(parts(select="*"))
+    assert everything.bytes == everything.total_bytes
+    value = footer.estimate(parts(select="SUM(value)"))
+    assert 0 < value.bytes < everything.bytes
+    kenya = footer.estimate(parts(select="SUM(value)", where="iso3 = 'KEN'"))
+    assert 0 < kenya.bytes < value.bytes
+
+
+def test_parse_predicate() -> None:
+    predicate = parse_predicate("\"ISO3\" IN ('KEN', 'O''Brien')")
+    assert predicate
+    assert predicate.column == "iso3"
+    assert predicate.values == ["KEN", "O'Brien"]
+    assert parse_predicate("(iso3 = 'KEN') OR (iso3 = 'TZA')") is None
+    assert parse_predicate("iso3 IN (SELECT iso3 FROM t)") is None
+
+
+def test_footer_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = tmp_path / "data.parquet"
+    _ = duckdb.sql(f"COPY (SELECT 1 AS a) TO '{path}' (FORMAT parquet)")
+    reads: list[str] = []
+    read = Footer.read
+
+    def counting_read(
+        source: str, connection: None = None, hive_partitioning: bool = False
+    ) -> Footer:
+        reads.append(source)
+        return read(source, connection, hive_partitioning)
+
+    monkeypatch.setattr(Footer, "read", counting_read)
+    versions = VersionCache()
+    monkeypatch.setattr(versions, "get", lambda _: "v1")
+    footers = FooterCache(versions=versions)
+    _ = footers.get(str(path))
+    _ = footers.get(str(path))
+    assert reads == [str(path)]
+
+
+def test_read_hive_partitions(tmp_path: Path) -> None:
+    directory = tmp_path / "model=historic"
+    directory.mkdir()
+    path = directory / "data.parquet"
+    _ = duckdb.sql(f"COPY (SELECT 'KEN' AS iso3) TO '{path}' (FORMAT parquet)")
+    # Only partitioned layouts are bounded by their directories
+    [row_group] = Footer.read(str(path)).row_groups
+    assert "model" not in row_group.bounds
+    [row_group] = Footer.read(str(path), hive_partitioning=True).row_groups
+    assert row_group.bounds["model"] == ("historic", "historic")
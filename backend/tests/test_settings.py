@@ -0,0 +1,144 @@
+import asyncio
+import json
+import socket
+import threading
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, override
+
+import pytest
+from pydantic import BaseModel, SecretStr
+
+from atlas_assistant.cache import ResponseCache
+from atlas_assistant.settings import (
+    CachedCodeClient,
+    CodeClient,
+    CodestralClient,
+    Message,
+    MistralConfig,
+    PydanticModel,
+)
+
+
+class Answer(BaseModel):
+    answer: str
+
+
+class CountingServer(ThreadingHTTPServer):
+    """A server that counts the connections it accepts"""
+
+    connections: int = 0
+
+    @override
+    def get_request(self) -> tuple[socket.socket, Any]:
+        request = super().get_request()
+        self.connections += 1
+        return request
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    """Answers every chat completion with the same parsed answer"""
+
+    protocol_version: str = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        _ = self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps(
+            {
+                "id": "a-chat",
+                "object": "chat.completion",
+                "model": "codestral-latest",
+                "created": 0,
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": Answer(answer="42").model_dump_json(),
+                        },
+                    }
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        _ = self.wfile.write(body)
+
+    @override
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[CountingServer]:
+    server = CountingServer(("127.0.0.1", 0), ChatHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_codestral_client_reuses_connections(server: CountingServer) -> None:
+    client = CodestralClient(
+        MistralConfig(api_key=SecretStr("a-key")),
+        server_url=f"http://127.0.0.1:{server.server_address[1]}",
+    )
+    messages = [{"role": "user", "content": "A question"}]
+    for _ in range(5):
+        assert client.chat(messages, Answer) == Answer(answer="42")
+    assert server.connections == 1
+
+    async def chat() -> None:
+        for _ in range(5):
+            assert await client.achat(messages, Answer) == Answer(answer="42")
+        await client.aclose()
+
+    # The async client has a pool of its own
+    asyncio.run(chat())
+    assert server.connections == 2
+    assert client.http_client.is_closed
+    assert client.async_http_client.is_closed
+
+
+class CountingCodeClient(CodeClient):
+    """Answers with the same answer, counting the chats"""
+
+    chats: int = 0
+
+    @override
+    def chat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        self.chats += 1
+        return response_format.model_validate({"answer": "42"})
+
+
+def test_cached_code_client(tmp_path: Path) -> None:
+    client = CountingCodeClient()
+    cached = CachedCodeClient(
+        client, "a-model", ResponseCache(path=tmp_path / "responses.sqlite3")
+    )
+    messages = [{"role": "user", "content": "A question"}]
+    assert cached.chat(messages, Answer) == Answer(answer="42")
+    assert cached.chat(messages, Answer) == Answer(answer="42")
+    assert asyncio.run(cached.achat(messages, Answer)) == Answer(answer="42")
+    assert client.chats == 1
+    _ = cached.chat([{"role": "user", "content": "Another question"}], Answer)
+    assert client.chats == 2
+
+    # The responses outlive the process
+    other = CachedCodeClient(
+        client, "a-model", ResponseCache(path=tmp_path / "responses.sqlite3")
+    )
+    assert asyncio.run(other.achat(messages, Answer)) == Answer(answer="42")
+    assert client.chats == 2
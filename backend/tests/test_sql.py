@@ -0,0 +1,435 @@
+import asyncio
+import dataclasses
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, override
+
+import duckdb
+import pytest
+from langchain.tools import ToolRuntime
+from langchain_core.messages import ToolMessage
+
+import atlas_assistant.tools.sql
+from atlas_assistant.catalog import build_catalog, get_view_name
+from atlas_assistant.context import Context
+from atlas_assistant.database import Database
+from atlas_assistant.dataset import Dataset
+from atlas_assistant.dataset.rollup import RollupStore
+from atlas_assistant.dataset.sample import SampleStore
+from atlas_assistant.dataset.scan import FooterCache
+from atlas_assistant.dataset.version import get_version
+from atlas_assistant.settings import CodeClient, Message, PydanticModel, Settings
+from atlas_assistant.tools.sql import SqlQueryParts, generate_table
+
+
+class FakeCodeClient(CodeClient):
+    """Always answers with the same SQL"""
+
+    def __init__(self, sql_query_parts: SqlQueryParts) -> None:
+        self.sql_query_parts: SqlQueryParts = sql_query_parts
+
+    @override
+    def chat(
+        self, messages: list[Message], response_format: type[PydanticModel]
+    ) -> PydanticModel:
+        assert response_format is SqlQueryParts
+        return self.sql_query_parts  # pyright: ignore[reportReturnType]
+
+
+APPROXIMATE_PARTS = SqlQueryParts(
+    select="crop, SUM(value) AS value",
+    where="NOT isnan(value)",
+    group_by="crop",
+    order_by="crop",
+    limit=None,
+    explanation="Value by crop",
+)
+
+
+def run_generate_table(
+    sql_query_parts: SqlQueryParts,
+    dataset: Dataset,
+    context: Context,
+) -> ToolMessage:
+    state: Any = {"dataset": dataset, "messages": []}
+    runtime = ToolRuntime(
+        state=state,
+        context=dataclasses.replace(
+            context, code_client=FakeCodeClient(sql_query_parts)
+        ),
+        config={},
+        stream_writer=lambda _: None,
+        tool_call_id="a-tool-call-id",
+        store=None,
+    )
+    command = generate_table.func(query="A question", runtime=runtime)  # pyright: ignore[reportOptionalCall]
+    message = command.update["messages"][0]
+    assert isinstance(message, ToolMessage)
+    return message
+
+
+def test_generate_table(
+    settings: Settings,
+    local_dataset: Dataset,
+    database: Database,
+) -> None:
+    message = run_generate_table(
+        SqlQueryParts(
+            select="iso3, SUM(value) AS value",
+            where="crop = 'maize'",
+            group_by="iso3",
+            order_by="iso3",
+            limit=None,
+            explanation="Maize value by country",
+        ),
+        local_dataset,
+        Context(settings=settings, database=database),
+    )
+    assert "Data returned" in message.content
+    assert (
+        message.artifact["data"]
+        == '[{"iso3":"KEN","value":3.0},{"iso3":"TZA","value":4.0}]'
+    )
+
+
+def test_agenerate_table(
+    settings: Settings,
+    local_dataset: Dataset,
+    database: Database,
+) -> None:
+    sql_query_parts = SqlQueryParts(
+        select="iso3, SUM(value) AS value",
+        where="crop = 'maize'",
+        group_by="iso3",
+        order_by="iso3",
+        limit=None,
+        explanation="Maize value by country",
+    )
+    code_client = FakeCodeClient(sql_query_parts)
+    with ThreadPoolExecutor(1, thread_name_prefix="tool") as executor:
+        state: Any = {"dataset": local_dataset, "messages": []}
+        runtime = ToolRuntime(
+            state=state,
+            context=Context(
+                settings=settings,
+                database=database,
+                code_client=code_client,
+                executor=executor,
+            ),
+            config={},
+            stream_writer=lambda _: None,
+            tool_call_id="a-tool-call-id",
+            store=None,
+        )
+        assert generate_table.coroutine
+        command = asyncio.run(
+            generate_table.coroutine(query="A question", runtime=runtime)
+        )
+    message = command.update["messages"][0]
+    assert (
+        message.artifact["data"]
+        == '[{"iso3":"KEN","value":3.0},{"iso3":"TZA","value":4.0}]'
+    )
+
+
+def test_generate_table_too_many_rows(
+    settings: Settings,
+    local_dataset: Dataset,
+    database: Database,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(atlas_assistant.tools.sql, "MAX_DATA_FRAME_LENGTH", 2)
+    queries: list[str] = []
+    execute = database.execute
+
+    def record(query: str, **kwargs: Any) -> Any:
+        queries.append(query)
+        return execute(query, **kwargs)
+
+    monkeypatch.setattr(database, "execute", record)
+    message = run_generate_table(
+        SqlQueryParts(
+            select="*",
+            where="true",
+            group_by=None,
+            order_by=None,
+            limit=None,
+            explanation="Every row",
+        ),
+        local_dataset,
+        Context(settings=settings, database=database),
+    )
+    assert "Returned data had 5 rows" in message.content
+    assert message.artifact["data"] is None
+    assert queries[0].startswith("EXPLAIN")
+    assert queries[1].endswith("LIMIT 3")
+    assert queries[2].startswith("SELECT COUNT(*)")
+
+
+def test_generate_table_timeout(
+    settings: Settings,
+    local_dataset: Dataset,
+    database: Database,
+) -> None:
+    message = run_generate_table(
+        SqlQueryParts(
+            select="COUNT(*)",
+            where="(SELECT COUNT(*) FROM range(1000000000000) r "
+            "WHERE r.range % 7 = 3) > 0",
+            group_by=None,
+            order_by=None,
+            limit=None,
+            explanation="A very slow query",
+        ),
+        local_dataset,
+        Context(
+            settings=settings.model_copy(update={"query_timeout": 0.2}),
+            database=database,
+        ),
+    )
+    assert message.content.startswith("The SQL query timed out after 0 seconds")
+    assert message.artifact is None
+
+
+def test_generate_table_verifies_rollups(
+    tmp_path: Path,
+    settings: Settings,
+    admin2_dataset: Dataset,
+    database: Database,
+) -> None:
+    rollup_store = RollupStore(tmp_path / "rollups")
+    rollup_set = rollup_store.build(
+        admin2_dataset, get_version(admin2_dataset.asset.href)
+    )
+    # Break the rollups, so they no longer match the dataset
+    for path in rollup_store.directory.glob("*.parquet"):
+        duckdb.sql(
+            f"COPY (SELECT * REPLACE (0.0 AS __sum_value) FROM '{path}') "
+            f"TO '{path}.tmp' (FORMAT parquet)"
+        )
+        _ = Path(f"{path}.tmp").replace(path)
+    assert rollup_set.rollups
+
+    def run(rollup_verify: bool) -> ToolMessage:
+        return run_generate_table(
+            SqlQueryParts(
+                select="iso3, SUM(value) AS value",
+                where="NOT isnan(value)",
+                group_by="iso3",
+                order_by="iso3",
+                limit=None,
+                explanation="Value by country",
+            ),
+            admin2_dataset,
+            Context(
+                settings=settings.model_copy(update={"rollup_verify": rollup_verify}),
+                database=database,
+                rollups=rollup_store,
+            ),
+        )
+
+    assert '"value":0.0' in run(rollup_verify=False).artifact["data"]
+    assert '"value":0.0' not in run(rollup_verify=True).artifact["data"]
+
+
+def test_generate_table_verifies_complete_rollups(
+    tmp_path: Path,
+    settings: Settings,
+    admin2_dataset: Dataset,
+    database: Database,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(atlas_assistant.tools.sql, "MAX_DATA_FRAME_LENGTH", 1)
+    rollup_store = RollupStore(tmp_path / "rollups")
+    _ = rollup_store.build(admin2_dataset, get_version(admin2_dataset.asset.href))
+    queries: list[str] = []
+    execute = database.execute
+
+    def record(query: str, **kwargs: Any) -> Any:
+        queries.append(query)
+        return execute(query, **kwargs)
+
+    monkeypatch.setattr(database, "execute", record)
+    message = run_generate_table(
+        SqlQueryParts(
+            select="iso3, SUM(value) AS value",
+            where="NOT isnan(value)",
+            group_by="iso3",
+            order_by=None,
+            limit=None,
+            explanation="Value by country",
+        ),
+        admin2_dataset,
+        Context(
+            settings=settings.model_copy(update={"rollup_verify": True}),
+            database=database,
+            rollups=rollup_store,
+        ),
+    )
+    assert "Returned data had 2 rows" in message.content
+    # The first row of each could be either country, so only the counts are
+    # compared
+    href = admin2_dataset.asset.href
+    assert not any(href in query and "LIMIT" in query for query in queries)
+    assert any(href in query and "COUNT(*)" in query for query in queries)
+
+
+def test_generate_table_invalid_column(
+    settings: Settings,
+    local_dataset: Dataset,
+    database: Database,
+) -> None:
+    message = run_generate_table(
+        SqlQueryParts(
+            select="iso3, SUM(values) AS value",
+            where="crop = 'maize'",
+            group_by="iso3",
+            order_by=None,
+            limit=None,
+            explanation="A typo",
+        ),
+        local_dataset,
+        Context(settings=settings, database=database),
+    )
+    assert message.content.startswith("The SQL is invalid, so it wasn't run")
+    assert "Did you mean `value`?" in message.content
+    assert message.artifact is None
+
+
+def test_generate_table_scan_budget(
+    settings: Settings,
+    local_dataset: Dataset,
+    database: Database,
+) -> None:
+    sql_query_parts = SqlQueryParts(
+        select="iso3, SUM(value) AS value",
+        where="iso3 = 'KEN'",
+        group_by="iso3",
+        order_by=None,
+        limit=None,
+        explanation="Value in Kenya",
+    )
+
+    def run(scan_budget_bytes: int | None) -> ToolMessage:
+        return run_generate_table(
+            sql_query_parts,
+            local_dataset,
+            Context(
+                settings=settings.model_copy(
+                    update={"scan_budget_bytes": scan_budget_bytes}
+                ),
+                database=database,
+                footers=FooterCache(),
+            ),
+        )
+
+    message = run(scan_budget_bytes=1)
+    assert "over the budget" in message.content
+    assert message.artifact is None
+
+    message = run(scan_budget_bytes=None)
+    assert "Data returned" in message.content
+    scan = message.artifact["scan"]
+    assert 0 < scan["bytes"] < scan["total_bytes"]
+    assert scan["row_groups"] == scan["total_row_groups"] == 1
+
+
+def test_generate_table_approximate(
+    settings: Settings,
+    admin2_dataset: Dataset,
+    database: Database,
+) -> None:
+    with ThreadPoolExecutor(1, thread_name_prefix="tool") as executor:
+        context = Context(
+            settings=settings.model_copy(
+                update={"approximate_refine": True, "sample_fraction": 0.5}
+            ),
+            database=database,
+            executor=executor,
+            approximate=True,
+        )
+        message = run_generate_table(APPROXIMATE_PARTS, admin2_dataset, context)
+        assert "estimates from a sample" in message.content
+        assert message.artifact["approximate"]
+        assert "value_margin" in message.artifact["data"]
+
+        [refinement] = context.refinements
+        exact = refinement.result(timeout=10)
+    assert not exact.artifact["approximate"]
+    assert "value_margin" not in exact.artifact["data"]
+    assert exact.tool_call_id == message.tool_call_id
+
+
+def test_generate_table_refine_scan_budget(
+    tmp_path: Path,
+    settings: Settings,
+    admin2_dataset: Dataset,
+    database: Database,
+) -> None:
+    samples = SampleStore(tmp_path / "samples")
+    _ = samples.build(admin2_dataset, get_version(admin2_dataset.asset.href), 0.5)
+    with ThreadPoolExecutor(1, thread_name_prefix="tool") as executor:
+        context = Context(
+            settings=settings.model_copy(
+                update={"approximate_refine": True, "scan_budget_bytes": 1}
+            ),
+            database=database,
+            executor=executor,
+            approximate=True,
+            footers=FooterCache(),
+            samples=samples,
+        )
+        message = run_generate_table(APPROXIMATE_PARTS, admin2_dataset, context)
+    # The sample is within the budget, but the exact result isn't
+    assert message.artifact["approximate"]
+    assert not context.refinements
+
+
+def test_generate_table_not_approximate(
+    settings: Settings,
+    local_dataset: Dataset,
+    database: Database,
+) -> None:
+    context = Context(settings=settings, database=database, approximate=True)
+    message = run_generate_table(
+        SqlQueryParts(
+            select="iso3, MAX(value) AS value",
+            where="true",
+            group_by="iso3",
+            order_by="iso3",
+            limit=None,
+            explanation="Largest value by country",
+        ),
+        local_dataset,
+        context,
+    )
+    assert "run exactly" in message.content
+    assert not message.artifact["approximate"]
+    assert not context.refinements
+
+
+def test_generate_table_catalog(
+    tmp_path: Path,
+    settings: Settings,
+    local_dataset: Dataset,
+) -> None:
+    catalog_path = tmp_path / "catalog.duckdb"
+    assert build_catalog(catalog_path, [local_dataset]) == 1
+    with Database(catalog=catalog_path) as database:
+        message = run_generate_table(
+            SqlQueryParts(
+                select="iso3, SUM(value) AS value",
+                where="value > (SELECT AVG(value) FROM "
+                f"{get_view_name(local_dataset)})",
+                group_by="iso3",
+                order_by="iso3",
+                limit=None,
+                explanation="Above-average value by country",
+            ),
+            local_dataset,
+            Context(settings=settings, database=database),
+        )
+    assert message.artifact["sql_query"].startswith(
+        f"SELECT iso3, SUM(value) AS value FROM {get_view_name(local_dataset)} "
+    )
+    assert message.artifact["data"] == '[{"iso3":"TZA","value":9.0}]'
@@ -134,6 +134,10 @@ export type ChatRequest = {
      * Thread Id
      */
     thread_id?: string | null;
+    /**
+     * Approximate
+     */
+    approximate?: boolean;
 };
 
 /**
@@ -149,6 +153,7 @@ export type Dataset = {
      * Asset Key
      */
     asset_key: string;
+    layout?: Layout | null;
 };
 
 /**
@@ -273,6 +278,14 @@ export type GenerateTableResponseMessage = {
      * Sql Query
      */
     sql_query: string | null;
+    /**
+     * Approximate
+     */
+    approximate?: boolean;
+    /**
+     * Tool Call Id
+     */
+    tool_call_id: string;
 };
 
 /**
@@ -332,6 +345,23 @@ export type Item = {
     };
 };
 
+/**
+ * Layout
+ *
+ * A local copy of a dataset, hive-partitioned and sorted so that queries
+ * can skip most of it
+ */
+export type Layout = {
+    /**
+     * Href
+     */
+    href: string;
+    /**
+     * Version
+     */
+    version: string | null;
+};
+
 /**
  * LineChartMetadata
  *